@@ -0,0 +1,82 @@
+"""
+Per-request setup cost of the chat agent, before and after it was built once per process.
+
+"before" repeats what get_response did on every message: build the tool list
+with a new PythonREPLTool, create the tool-calling agent and wrap it in an
+AgentExecutor. "after" is what it does now: build the invocation config with
+a fresh REPL session for the shared agent. No LLM calls are made.
+
+Firebase is replaced by the stand-ins in benchmarks/offline.py. Run from
+universl_backend:
+
+    python benchmarks/agent_setup.py --iterations 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from offline import setup_django
+
+setup_django()
+
+from langchain.agents import AgentExecutor, create_tool_calling_agent
+from core import views
+
+
+def setup_per_request(user_id):
+    tools = [
+        views.search_vector_store_tool,
+        views.get_user_functions_firestore_tool,
+        views.PythonREPLTool(),
+        views.save_function_execution_tool,
+    ]
+    agent = create_tool_calling_agent(llm=views.llm, tools=tools, prompt=views.CHAT_PROMPT)
+    return AgentExecutor(agent=agent, tools=tools, verbose=True)
+
+
+def setup_shared(user_id):
+    return views.agent_config(user_id)
+
+
+def measure(setup, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        setup(f"benchmark-user-{i}")
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'mean': statistics.mean(timings),
+        'p50': timings[len(timings) // 2],
+        'p95': timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    # Warm up imports and pydantic schema caches so neither side pays for them
+    setup_per_request('warmup')
+    setup_shared('warmup')
+
+    results = {
+        'before (per request)': measure(setup_per_request, args.iterations),
+        'after (shared agent)': measure(setup_shared, args.iterations),
+    }
+
+    print(f"Agent setup per request, {args.iterations} iterations (ms)")
+    print(f"{'':<24}{'mean':>10}{'p50':>10}{'p95':>10}")
+    for name, stats in results.items():
+        print(f"{name:<24}{stats['mean']:>10.3f}{stats['p50']:>10.3f}{stats['p95']:>10.3f}")
+    before, after = results['before (per request)']['mean'], results['after (shared agent)']['mean']
+    print(f"Speedup: {before / after:.0f}x ({before - after:.3f} ms saved per message)")
+
+
+if __name__ == '__main__':
+    main()
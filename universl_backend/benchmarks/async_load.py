@@ -0,0 +1,205 @@
+"""
+Concurrent chat turns and SSE streams, sync views versus their async versions.
+
+chat: get_response on a pool of worker threads versus Aget_response on a
+single event loop.
+
+stream: concurrent stream_response versus Astream_response requests through
+Django's ASGI handler. Reports time to the first token and how long the
+server's event loop was stalled: a heartbeat task on that loop records its
+largest delay.
+
+Firebase and OpenAI are replaced by the stand-ins in benchmarks/offline.py,
+the LLM answers after --llm-latency seconds (streamed token by token), so
+the numbers show how many turns each view keeps in flight rather than
+model speed. Run from universl_backend:
+
+    python benchmarks/async_load.py --requests 200 --workers 8 --llm-latency 1.0
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from offline import setup_django
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(int(len(values) * fraction) - 1, 0)]
+
+
+def row(name, *columns):
+    return f"{name:<36}" + ''.join(f"{column:>12.2f}" for column in columns)
+
+
+async def asgi_post(app, path, body, token):
+    """
+    POST through an ASGI application and read the whole response.
+
+    Returns:
+        Tuple of (status, seconds to the first token event, seconds to the end)
+    """
+    start = time.perf_counter()
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'authorization', token.encode())],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    sent = False
+    status = None
+    first_token = None
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status, first_token
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif first_token is None and b'event: token' in message.get('body', b''):
+            first_token = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    end = time.perf_counter() - start
+    return status, first_token or end, end
+
+
+async def measure_loop_stall(until, interval=0.01):
+    """Largest delay of a periodic timer on the running loop, until the future is done"""
+    worst = 0.0
+    while not until.done():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - expected)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--streams', type=int, default=20, help="Concurrent SSE streams")
+    parser.add_argument('--workers', type=int, default=8, help="Worker threads of the sync chat run")
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--only', choices=['chat', 'stream'], help="Run one of the two benchmarks")
+    parser.add_argument('--stream-views', choices=['sync', 'async', 'both'], default='both',
+                        help="Streaming views to compare, Django before 4.2 can only serve the sync one")
+    args = parser.parse_args()
+
+    setup_django(llm_latency=args.llm_latency, async_views=True)
+    from django.core.handlers.asgi import ASGIHandler
+    from django.test import RequestFactory, override_settings
+    from django.urls import path
+    from core import views
+    from core.session_tokens import issue_session_token
+
+    factory = RequestFactory()
+    body = json.dumps({'message': 'Run fibonacci with n=10'})
+
+    def token_for(i):
+        return issue_session_token(f"benchmark-{i}", f"benchmark-{i}", f"benchmark-{i}@example.com")[0]
+
+    def build_request(i):
+        return factory.post('/api/get_response/', data=body, content_type='application/json',
+                            HTTP_AUTHORIZATION=token_for(i))
+
+    def timed_sync(request):
+        start = time.perf_counter()
+        response = views.get_response(request)
+        assert response.status_code == 200, response.content
+        return time.perf_counter() - start
+
+    async def timed_async(request):
+        start = time.perf_counter()
+        response = await views.Aget_response(request)
+        assert response.status_code == 200, response.content
+        return time.perf_counter() - start
+
+    async def run_streams(app, view_path, tokens):
+        done = asyncio.get_running_loop().create_future()
+        stall = asyncio.create_task(measure_loop_stall(done))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(asgi_post(app, view_path, body.encode(), token) for token in tokens))
+        elapsed = time.perf_counter() - start
+        done.set_result(None)
+        assert all(status == 200 for status, _, _ in results), results
+        return elapsed, [first for _, first, _ in results], await stall
+
+    views.agent_executor.verbose = False
+    rows = []
+    stream_views = [
+        (name, view_path, view) for name, view_path, view in [
+            ('stream_response (sync)', '/sync/', views.stream_response),
+            ('Astream_response (async)', '/async/', views.Astream_response),
+        ] if args.stream_views in ('both', view_path.strip('/'))
+    ]
+    # Both streaming views behind one ASGI handler
+    urlconf = type(sys)('benchmark_urls')
+    urlconf.urlpatterns = [path(view_path[1:], view) for _, view_path, view in stream_views]
+
+    # The views log every step, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.only in (None, 'chat'):
+            requests = [build_request(i) for i in range(args.requests)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                latencies = list(pool.map(timed_sync, requests))
+            elapsed = time.perf_counter() - start
+            rows.append(('chat', row(f"get_response, {args.workers} threads", args.requests / elapsed,
+                                     elapsed, statistics.median(latencies), percentile(latencies, 0.95))))
+
+            requests = [build_request(args.requests + i) for i in range(args.requests)]
+
+            async def run_chat():
+                return await asyncio.gather(*(timed_async(request) for request in requests))
+
+            start = time.perf_counter()
+            latencies = asyncio.run(run_chat())
+            elapsed = time.perf_counter() - start
+            rows.append(('chat', row("Aget_response, 1 event loop", args.requests / elapsed,
+                                     elapsed, statistics.median(latencies), percentile(latencies, 0.95))))
+
+        if args.only in (None, 'stream'):
+            with override_settings(ROOT_URLCONF=urlconf):
+                app = ASGIHandler()
+                for name, view_path, _ in stream_views:
+                    tokens = [token_for(f"stream-{view_path}-{i}") for i in range(args.streams)]
+                    elapsed, first_tokens, stall = asyncio.run(run_streams(app, view_path, tokens))
+                    rows.append(('stream', row(name, elapsed, statistics.median(first_tokens),
+                                               percentile(first_tokens, 0.95), stall)))
+
+    import django
+    print(f"Django {django.get_version()}, stand-in LLM latency {args.llm_latency}s")
+    if args.only in (None, 'chat'):
+        print(f"\n{args.requests} chat turns")
+        print(f"{'':<36}{'turns/s':>12}{'total s':>12}{'p50 s':>12}{'p95 s':>12}")
+        print('\n'.join(line for kind, line in rows if kind == 'chat'))
+    if args.only in (None, 'stream'):
+        print(f"\n{args.streams} concurrent SSE streams through the ASGI handler")
+        print(f"{'':<36}{'total s':>12}{'p50 TTFT s':>12}{'p95 TTFT s':>12}{'max stall s':>12}")
+        print('\n'.join(line for kind, line in rows if kind == 'stream'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Offline stand-ins for the benchmarks, so core.views can be imported and
+driven without Firebase credentials or an OpenAI key.
+
+- Firebase: no app is initialized and firestore.client() returns an
+  in-memory store with just the document operations a chat turn makes.
+- OpenAI: a local server answers every chat completion after a fixed
+  latency, streamed token by token when the request asks for it.
+
+Call setup_django() before anything imports core.views.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+ANSWER_TOKENS = ['The', ' function', ' returned', ' 55', '.']
+
+
+class InMemoryFirestore:
+    """Documents by (collection, id); queries find nothing"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def collection(self, name):
+        return _Collection(self, name)
+
+    def batch(self):
+        return _Batch()
+
+
+class _Collection:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def document(self, doc_id=None):
+        return _Document(self.store, self.name, doc_id or os.urandom(10).hex())
+
+    def where(self, *args, **kwargs):
+        return self
+
+    def order_by(self, *args, **kwargs):
+        return self
+
+    def limit(self, *args):
+        return self
+
+    def stream(self):
+        return iter(())
+
+
+class _Document:
+    def __init__(self, store, collection, doc_id):
+        self.store = store
+        self.id = doc_id
+        self._key = (collection, doc_id)
+
+    @property
+    def exists(self):
+        return self._key in self.store.documents
+
+    def get(self):
+        return self
+
+    def to_dict(self):
+        return dict(self.store.documents.get(self._key, {}))
+
+    def set(self, data, merge=False):
+        from firebase_admin import firestore
+        stored = self.to_dict() if merge else {}
+        for field, value in data.items():
+            if isinstance(value, firestore.Increment):
+                value = stored.get(field, 0) + value.value
+            stored[field] = value
+        self.store.documents[self._key] = stored
+
+    def update(self, data):
+        self.set(data, merge=True)
+
+    def delete(self):
+        self.store.documents.pop(self._key, None)
+
+
+class _Batch:
+    def set(self, doc_ref, data, merge=False):
+        doc_ref.set(data, merge=merge)
+
+    def commit(self):
+        pass
+
+
+def _completion(content):
+    return {
+        'id': 'chatcmpl-benchmark',
+        'object': 'chat.completion',
+        'created': 0,
+        'model': 'gpt-4o-mini',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 1, 'completion_tokens': len(ANSWER_TOKENS), 'total_tokens': 1 + len(ANSWER_TOKENS)},
+    }
+
+
+def _chunk(delta, finish_reason=None):
+    return {
+        'id': 'chatcmpl-benchmark',
+        'object': 'chat.completion.chunk',
+        'created': 0,
+        'model': 'gpt-4o-mini',
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+    }
+
+
+def start_llm_stand_in(latency):
+    """
+    Serve OpenAI chat completions on a local port from a background event loop.
+
+    A completion takes latency seconds. Streamed completions spread that time
+    evenly over their tokens.
+
+    Returns:
+        The base URL to use as OPENAI_API_BASE
+    """
+    body = json.dumps(_completion(''.join(ANSWER_TOKENS))).encode()
+    plain_response = (
+        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+        b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+    )
+
+    async def write_chunk(writer, data):
+        payload = f"data: {data}\n\n".encode()
+        writer.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        await writer.drain()
+
+    async def stream(writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await write_chunk(writer, json.dumps(_chunk({'role': 'assistant', 'content': ''})))
+        for token in ANSWER_TOKENS:
+            await asyncio.sleep(latency / len(ANSWER_TOKENS))
+            await write_chunk(writer, json.dumps(_chunk({'content': token})))
+        await write_chunk(writer, json.dumps(_chunk({}, 'stop')))
+        await write_chunk(writer, '[DONE]')
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                request = json.loads(await reader.readexactly(length) or b'{}')
+                if request.get('stream'):
+                    await stream(writer)
+                else:
+                    await asyncio.sleep(latency)
+                    writer.write(plain_response)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0, backlog=4096))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1"
+
+
+def setup_django(llm_latency=None, async_views=False):
+    """
+    Configure Django against the offline stand-ins.
+
+    Args:
+        llm_latency: Start the OpenAI stand-in with this latency, or None to
+            leave OpenAI unreachable (for benchmarks that make no LLM call)
+        async_views: Route the views as the ASGI entry point does
+    """
+    os.environ['OPENAI_API_KEY'] = 'benchmark'
+    if llm_latency is not None:
+        os.environ['OPENAI_API_BASE'] = start_llm_stand_in(llm_latency)
+    os.environ['SESSION_TOKEN_SECRET'] = 'benchmark'
+    os.environ['ASYNC_VIEWS'] = '1' if async_views else ''
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'universal_platform.settings')
+
+    # settings.py initializes the Firebase app from credentials that are not available here
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    store = InMemoryFirestore()
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    firestore.client = lambda *args, **kwargs: store
+
+    import django
+    django.setup()
+    return store
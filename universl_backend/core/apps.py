@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+import os
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Optionally bootstrap Qdrant at startup so a schema mismatch stops the process early
+        if os.getenv('QDRANT_BOOTSTRAP_ON_STARTUP', '').lower() in ('1', 'true', 'yes'):
+            from .views import init_qdrant_collection
+            init_qdrant_collection()
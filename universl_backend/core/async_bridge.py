@@ -0,0 +1,108 @@
+from asgiref.sync import sync_to_async
+import asyncio
+import threading
+
+_loop = None
+_lock = threading.Lock()
+_DONE = object()
+
+
+def get_event_loop():
+    """
+    Return the process-wide event loop, started on a daemon thread on first use.
+
+    Async clients (OpenAI, Firestore, Qdrant) bind their connection pools to
+    the loop they first ran on, so every agent run is driven on this one
+    long-lived loop: from sync views instead of a new loop per request, and
+    from async views instead of the ASGI server's loop.
+    """
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-bridge', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_sync(coroutine):
+    """Run a coroutine on the shared loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+async def run_async(coroutine):
+    """Await a coroutine run on the shared loop, from another event loop"""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()))
+
+
+async def _next(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _DONE
+
+
+def iterate_sync(iterator):
+    """
+    Consume an async iterator from sync code, one item at a time.
+
+    Each item is produced on the shared loop, so a WSGI StreamingHttpResponse
+    can send it as soon as it is ready. Closing the generator early (e.g. the
+    client disconnected) closes the async iterator too.
+    """
+    try:
+        while True:
+            item = run_sync(_next(iterator))
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            run_sync(aclose())
+
+
+async def iterate_async(iterator):
+    """
+    Consume an async iterator on the shared loop from another event loop.
+
+    Items are awaited without blocking the caller's loop, so an ASGI
+    StreamingHttpResponse can send each one as soon as it is ready.
+    """
+    try:
+        while True:
+            item = await run_async(_next(iterator))
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            try:
+                await run_async(aclose())
+            except RuntimeError:
+                # A cancelled step is still unwinding, it closes the iterator itself
+                pass
+
+
+async def iterate_in_thread(iterator):
+    """
+    Consume a blocking iterator from async code. Each item is produced on a
+    worker thread, so the caller's loop keeps serving other requests.
+    """
+    next_item = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            item = await next_item(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except ValueError:
+                # Still running on a worker thread after a disconnect, left to the garbage collector
+                pass
@@ -0,0 +1,147 @@
+from google.cloud.firestore import AsyncClient
+from qdrant_client import AsyncQdrantClient, models
+from .function_refs import original_function_ids, apply_function_references
+from .user_cache import user_libraries, local_library_version, LIBRARY_VERSIONS_COLLECTION
+from .qdrant_setup import QDRANT_COLLECTION
+from .local_index import local_index, LOCAL_INDEX_ENABLED
+import asyncio
+import firebase_admin
+import os
+import threading
+
+_local = threading.local()
+
+
+def _get_clients():
+    """
+    Return the Firestore AsyncClient and AsyncQdrantClient for the running loop.
+
+    Both clients bind to the event loop they were created on, so one pair is
+    kept per thread and recreated when that thread starts running a different
+    loop (as async_to_sync does on every call under WSGI).
+    """
+    loop = asyncio.get_running_loop()
+    if getattr(_local, 'loop', None) is not loop:
+        app = firebase_admin.get_app()
+        _local.firestore = AsyncClient(
+            project=app.project_id,
+            credentials=app.credential.get_credential()
+        )
+        _local.qdrant = AsyncQdrantClient(
+            url=os.getenv("QDRANT_URL"),
+            api_key=os.getenv("QDRANT_API_KEY"),
+        )
+        _local.loop = loop
+    return _local.firestore, _local.qdrant
+
+
+def get_firestore():
+    return _get_clients()[0]
+
+
+def get_qdrant():
+    return _get_clients()[1]
+
+
+async def resolve_function_references(functions, fields=None):
+    """Async counterpart of views.resolve_function_references"""
+    original_ids = original_function_ids(functions)
+    if not original_ids:
+        return functions
+
+    client = get_firestore()
+    original_refs = [client.collection('functions').document(original_id) for original_id in original_ids]
+    originals = {}
+    async for doc in client.get_all(original_refs):
+        if doc.exists:
+            originals[doc.id] = doc.to_dict()
+    return apply_function_references(functions, originals, fields)
+
+
+async def get_user_functions(user_id):
+    """
+    Get all functions of a user, through the same per-user cache as the sync path.
+
+    Returns:
+        List of function dictionaries (copies, safe to modify)
+    """
+    return (await get_versioned_user_functions(user_id))[0]
+
+
+async def get_versioned_user_functions(user_id):
+    """
+    Get all functions of a user and the library version they were read at.
+
+    Returns:
+        Tuple of (list of function dictionaries, library version)
+    """
+    library = user_libraries.peek(user_id)
+    if library is None:
+        local_version = user_libraries.version(user_id)
+        client = get_firestore()
+        # Read before the functions, like the sync path
+        version_doc = await client.collection(LIBRARY_VERSIONS_COLLECTION).document(user_id).get()
+        query = client.collection('functions').where('userId', '==', user_id)
+        functions = [{'id': doc.id, **doc.to_dict()} async for doc in query.stream()]
+        library = {
+            'version': version_doc.to_dict().get('version', 0) if version_doc.exists else 0,
+            'functions': await resolve_function_references(functions),
+        }
+        user_libraries.put(user_id, library, local_version)
+    return [dict(function) for function in library['functions']], library['version']
+
+
+async def get_library_version(user_id):
+    """Async counterpart of user_cache.shared_library_version"""
+    local_version = local_library_version(user_id)
+    version_doc = await get_firestore().collection(LIBRARY_VERSIONS_COLLECTION).document(user_id).get()
+    return (version_doc.to_dict().get('version', 0) if version_doc.exists else 0, local_version)
+
+
+async def search_functions(user_id, query_vector, limit, score_threshold=None):
+    """Search the user's function descriptions in Qdrant"""
+    return await get_qdrant().search(
+        collection_name=QDRANT_COLLECTION,
+        query_vector=query_vector,
+        query_filter=models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="userId",
+                    match={"value": user_id}
+                )
+            ]
+        ),
+        limit=limit,
+        score_threshold=score_threshold
+    )
+
+
+async def get_local_index(user_id):
+    """Async counterpart of views.get_local_index"""
+    if not LOCAL_INDEX_ENABLED:
+        return False
+    index = local_index.peek(user_id)
+    if index is None:
+        version = local_index.version(user_id)
+        points, _ = await get_qdrant().scroll(
+            collection_name=QDRANT_COLLECTION,
+            scroll_filter=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="userId",
+                        match={"value": user_id}
+                    )
+                ]
+            ),
+            limit=local_index.max_functions + 1,
+            with_payload=True,
+            with_vectors=True
+        )
+        index = local_index.put(user_id, [(point.id, point.vector, point.payload) for point in points], version)
+    return index
+
+
+async def set_document(collection, document_id, data):
+    """Write a document without blocking the event loop"""
+    await get_firestore().collection(collection).document(document_id).set(data)
+    return document_id
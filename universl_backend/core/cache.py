@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with optional per-entry expiry.
+
+    Entries are evicted least-recently-used first once maxsize is reached and
+    are dropped lazily when they are read after their expiry time.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on a miss or expiry"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """
+        Store value under key.
+
+        Args:
+            ttl: Seconds until the entry expires (defaults to the cache ttl)
+            expires_at: Absolute unix time of expiry, overrides ttl
+        """
+        if expires_at is None:
+            ttl = self.ttl if ttl is None else ttl
+            expires_at = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class KeyVersions:
+    """
+    Bounded per-key write counters, for discarding loads that raced with a write.
+
+    Only the maxsize most recently bumped keys are remembered. Versions come
+    from one increasing counter, and a forgotten key reads as the highest
+    version forgotten so far, so a load that started before the key's last
+    bump still sees a different version when it finishes.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._floor = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key, self._floor)
+
+    def bump(self, key):
+        with self._lock:
+            self._counter += 1
+            self._data[key] = self._counter
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                _, version = self._data.popitem(last=False)
+                self._floor = max(self._floor, version)
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,207 @@
+from langchain_core.embeddings import Embeddings
+from .cache import LRUCache
+from array import array
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '5000'))
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'embedding_cache.sqlite3')
+)
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', '100000'))
+# How many inserts happen between checks of the persistent tier's size cap
+PRUNE_EVERY = 500
+# A hit refreshes the entry's last_used at most this often, so hot entries
+# do not turn every read into a write
+TOUCH_INTERVAL = 60
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different inputs share an entry"""
+    return ' '.join(text.split()).lower()
+
+
+class _SQLiteTier:
+    """
+    Persistent embedding store, vectors are kept as float32 blobs.
+
+    Hits refresh last_used, so pruning drops the least recently used entries.
+    """
+
+    def __init__(self, path, max_rows):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._inserts = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT vector, last_used FROM embeddings WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        vector, last_used = row
+        now = time.time()
+        if now - last_used >= TOUCH_INTERVAL:
+            try:
+                with conn:
+                    conn.execute('UPDATE embeddings SET last_used = ? WHERE key = ?', (now, key))
+            except sqlite3.OperationalError as e:
+                # Another process holds the write lock, the next hit retries
+                print(f"Error refreshing embedding cache entry: {str(e)}")
+        return array('f', vector).tolist()
+
+    def set(self, key, vector):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)',
+                (key, array('f', vector).tobytes(), time.time())
+            )
+        self._inserts += 1
+        if self._inserts % PRUNE_EVERY == 0:
+            self._prune(conn)
+
+    def _prune(self, conn):
+        with conn:
+            conn.execute(
+                'DELETE FROM embeddings WHERE key IN ('
+                'SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_rows,)
+            )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that caches vectors by (model, normalized text hash).
+
+    Lookups go to an in-memory LRU first and then to a SQLite file shared by
+    all worker processes on the host. Only misses reach the wrapped model, and
+    embed_documents sends all of its misses in one call.
+    """
+
+    def __init__(self, embeddings, model, maxsize=EMBEDDING_CACHE_SIZE,
+                 path=EMBEDDING_CACHE_PATH, max_rows=EMBEDDING_CACHE_MAX_ROWS):
+        self.embeddings = embeddings
+        self.model = model
+        self._memory = LRUCache(maxsize=maxsize)
+        self._disk = _SQLiteTier(path, max_rows) if path else None
+        self._counts = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def _lookup(self, key):
+        vector = self._lookup_memory(key)
+        if vector is None:
+            vector = self._lookup_disk(key)
+        return vector
+
+    async def _alookup(self, key):
+        # SQLite reads (and the last_used refresh) block, keep them off the event loop
+        vector = self._lookup_memory(key)
+        if vector is None:
+            vector = await asyncio.to_thread(self._lookup_disk, key)
+        return vector
+
+    def _lookup_memory(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._counts['memory_hits'] += 1
+        return vector
+
+    def _lookup_disk(self, key):
+        if self._disk is not None:
+            try:
+                vector = self._disk.get(key)
+            except Exception as e:
+                print(f"Error reading embedding cache: {str(e)}")
+                vector = None
+            if vector is not None:
+                self._counts['disk_hits'] += 1
+                self._memory.set(key, vector)
+                return vector
+        self._counts['misses'] += 1
+        return None
+
+    def _store(self, key, vector):
+        self._memory.set(key, vector)
+        self._store_disk(key, vector)
+
+    def _store_disk(self, key, vector):
+        if self._disk is not None:
+            try:
+                self._disk.set(key, vector)
+            except Exception as e:
+                print(f"Error writing embedding cache: {str(e)}")
+
+    def embed_query(self, text):
+        key = self._key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._store(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        key = self._key(text)
+        vector = await self._alookup(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self._memory.set(key, vector)
+            await asyncio.to_thread(self._store_disk, key, vector)
+        return vector
+
+    def _split(self, texts):
+        keys = [self._key(text) for text in texts]
+        vectors = [self._lookup(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        return keys, vectors, missing
+
+    def _fill(self, keys, vectors, missing, new_vectors):
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+            self._store(keys[i], vector)
+        return vectors
+
+    def embed_documents(self, texts):
+        keys, vectors, missing = self._split(texts)
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            self._fill(keys, vectors, missing, new_vectors)
+        return vectors
+
+    async def aembed_documents(self, texts):
+        keys, vectors, missing = await asyncio.to_thread(self._split, texts)
+        if missing:
+            new_vectors = await self.embeddings.aembed_documents([texts[i] for i in missing])
+            await asyncio.to_thread(self._fill, keys, vectors, missing, new_vectors)
+        return vectors
+
+    def stats(self):
+        """Return hit counters per tier and the overall hit rate"""
+        hits = self._counts['memory_hits'] + self._counts['disk_hits']
+        lookups = hits + self._counts['misses']
+        return {
+            **self._counts,
+            'memory_size': len(self._memory),
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
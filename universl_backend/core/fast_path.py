@@ -0,0 +1,238 @@
+import ast
+import difflib
+import os
+import re
+
+# Phrasings of "run this function with these arguments" handled without the agent
+_RUN_VERBS = r'(?:run|execute|call|invoke|compute|calculate|evaluate)'
+_RUN_COMMAND = re.compile(
+    rf'^(?:please\s+|can you\s+|could you\s+)?{_RUN_VERBS}\s+'
+    r'(?:the\s+|my\s+)?(?:function\s+)?'
+    r'(?P<name>[A-Za-z_][\w.\- ]*?)\s*'
+    r'(?:\((?P<call_args>.*)\)|(?:\s(?:with|on|using|for|where)\s+(?P<args>.*))|)'
+    r'\s*[.!?]?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+_CALL_EXPRESSION = re.compile(r'^(?P<name>[A-Za-z_]\w*)\s*\((?P<call_args>.*)\)\s*$', re.DOTALL)
+# "n 10" or "n: 10" style pairs, rewritten to keyword arguments
+_LOOSE_PAIR = re.compile(r'^\s*([A-Za-z_]\w*)\s*(?:=|:|\s+(?:is|as|of)\s+|\s+)\s*(.+?)\s*$')
+_WORD_SEPARATORS = re.compile(r'\s+and\s+|\s*,\s*')
+
+NAME_MATCH_CUTOFF = 0.85
+# Minimum description similarity, and lead over the runner-up, for resolving a
+# function name that does not match any name in the library
+FAST_PATH_MIN_SCORE = float(os.getenv('FAST_PATH_MIN_SCORE', '0.5'))
+FAST_PATH_MIN_MARGIN = 0.05
+
+
+def normalize_name(name):
+    """Compare function names regardless of case, spaces, dashes and underscores"""
+    return re.sub(r'[\s_\-]+', '', name).lower()
+
+
+def parse_run_command(message):
+    """
+    Recognize a "run <function> with <arguments>" message.
+
+    Returns:
+        Dict with the function name as written and the argument text, or None
+        if the message is not a plain run command
+    """
+    text = message.strip()
+    match = _CALL_EXPRESSION.match(text) or _RUN_COMMAND.match(text)
+    if not match:
+        return None
+    groups = match.groupdict()
+    arguments = groups.get('call_args')
+    if arguments is None:
+        # Sentence punctuation after loose arguments ("with n=10.") is not part of them
+        arguments = (groups.get('args') or '').rstrip(' .!?')
+    return {'function_name': groups['name'].strip(), 'arguments': arguments.strip()}
+
+
+def match_function_name(name, functions):
+    """
+    Find the library function a name refers to, exactly or by a close spelling.
+
+    Returns:
+        The function dict, or None if no name matches unambiguously
+    """
+    wanted = normalize_name(name)
+    by_name = {}
+    for function in functions:
+        by_name.setdefault(normalize_name(function.get('name') or ''), []).append(function)
+
+    exact = by_name.get(wanted, [])
+    if len(exact) == 1:
+        return exact[0]
+    if exact:
+        return None
+
+    close = difflib.get_close_matches(wanted, list(by_name), n=2, cutoff=NAME_MATCH_CUTOFF)
+    if len(close) == 1 and len(by_name[close[0]]) == 1:
+        return by_name[close[0]][0]
+    return None
+
+
+def parse_arguments(text):
+    """
+    Parse argument text into literal positional and keyword arguments.
+
+    Accepts Python call syntax ("10, k=3") as well as loose forms such as
+    "n=10 and k=3" or "n 10". Only literals are accepted, nothing is evaluated.
+
+    Raises:
+        ValueError: If the text is not a list of literal arguments
+    """
+    if not text:
+        return [], {}
+    try:
+        return _parse_call_arguments(text)
+    except (SyntaxError, ValueError):
+        pass
+
+    # Loose form: split on "and"/commas and turn "name value" pairs into keywords
+    parts = [part for part in _WORD_SEPARATORS.split(text) if part]
+    rewritten = []
+    for part in parts:
+        pair = _LOOSE_PAIR.match(part)
+        rewritten.append(f"{pair.group(1)}={pair.group(2)}" if pair and not _is_literal(part) else part)
+    try:
+        return _parse_call_arguments(', '.join(rewritten))
+    except SyntaxError as e:
+        raise ValueError(f"Could not parse arguments: {text}") from e
+
+
+def _is_literal(text):
+    try:
+        ast.literal_eval(text.strip())
+        return True
+    except (SyntaxError, ValueError):
+        return False
+
+
+def _parse_call_arguments(text):
+    call = ast.parse(f"f({text})", mode='eval').body
+    if not isinstance(call, ast.Call):
+        raise ValueError("Not a call")
+    args = []
+    for node in call.args:
+        if isinstance(node, ast.Starred):
+            raise ValueError("Unpacking is not supported")
+        args.append(ast.literal_eval(node))
+    kwargs = {}
+    for keyword in call.keywords:
+        if keyword.arg is None:
+            raise ValueError("Unpacking is not supported")
+        kwargs[keyword.arg] = ast.literal_eval(keyword.value)
+    return args, kwargs
+
+
+def find_function_definition(code, name=None):
+    """
+    Return the top-level function definition to call: the one called name,
+    or the only one in the code
+
+    Raises:
+        ValueError: If there is no such definition or the choice is ambiguous
+    """
+    definitions = [
+        node for node in ast.parse(code).body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    ]
+    if name:
+        named = [node for node in definitions if normalize_name(node.name) == normalize_name(name)]
+        if len(named) == 1:
+            return named[0]
+    if len(definitions) == 1:
+        return definitions[0]
+    raise ValueError("Could not tell which function to call")
+
+
+def bind_arguments(definition, args, kwargs):
+    """
+    Check that args and kwargs fit the signature of a function definition.
+
+    Raises:
+        ValueError: Describing the missing or unexpected arguments
+    """
+    arguments = definition.args
+    if isinstance(definition, ast.AsyncFunctionDef):
+        raise ValueError("Async functions are not supported")
+
+    positional = [arg.arg for arg in arguments.posonlyargs + arguments.args]
+    keyword_only = [arg.arg for arg in arguments.kwonlyargs]
+    required = positional[:len(positional) - len(arguments.defaults)]
+    required += [arg.arg for arg, default in zip(arguments.kwonlyargs, arguments.kw_defaults) if default is None]
+
+    if len(args) > len(positional) and arguments.vararg is None:
+        raise ValueError(f"{definition.name} takes {len(positional)} positional arguments, got {len(args)}")
+    bound = set(positional[:len(args)])
+    posonly = {arg.arg for arg in arguments.posonlyargs}
+    for name in kwargs:
+        if name in bound:
+            raise ValueError(f"{definition.name} got multiple values for {name}")
+        if name in posonly or (name not in positional and name not in keyword_only and arguments.kwarg is None):
+            raise ValueError(f"{definition.name} has no parameter {name}")
+        bound.add(name)
+
+    missing = [name for name in required if name not in bound]
+    if missing:
+        raise ValueError(f"Missing arguments for {definition.name}: {', '.join(missing)}")
+
+
+def format_call(function_name, args, kwargs):
+    """Python source of a call with literal arguments"""
+    parts = [repr(value) for value in args] + [f"{name}={value!r}" for name, value in kwargs.items()]
+    return f"{function_name}({', '.join(parts)})"
+
+
+def format_signature(definition):
+    """Signature of a function definition as written, e.g. fibonacci(n, memo=None)"""
+    return f"{definition.name}({ast.unparse(definition.args)})"
+
+
+def is_confident_match(results):
+    """
+    The top search result clears FAST_PATH_MIN_SCORE and leads the runner-up
+    by FAST_PATH_MIN_MARGIN, results below the minimum score are ignored
+    """
+    confident = [result for result in results if result['score'] >= FAST_PATH_MIN_SCORE]
+    if not confident:
+        return False
+    return len(confident) < 2 or confident[0]['score'] - confident[1]['score'] >= FAST_PATH_MIN_MARGIN
+
+
+def allows_similarity_match(intent):
+    """
+    Whether a run command may be resolved by description similarity when no
+    function name matches. Only commands with arguments qualify: without them
+    "run the tests" could run any zero-argument function that happens to be
+    the closest description.
+    """
+    return bool(intent.get('arguments'))
+
+
+def determine_action(intent, search_results):
+    """Execute only when the function and a complete set of literal arguments are known"""
+    if intent['intent'] != 'run':
+        return {"type": "agent", "reason": "not a run command"}
+    function = search_results.get('function')
+    if function is None:
+        return {"type": "agent", "reason": f"no confident match for {intent['function_name']}"}
+    if search_results.get('match') == 'embedding' and not allows_similarity_match(intent):
+        return {"type": "agent", "reason": f"{intent['function_name']} only matched by similarity"}
+
+    try:
+        args, kwargs = parse_arguments(intent['arguments'])
+        definition = find_function_definition(function.get('code') or '', function.get('name'))
+        bind_arguments(definition, args, kwargs)
+    except (SyntaxError, ValueError) as e:
+        return {"type": "agent", "reason": str(e)}
+
+    return {
+        "type": "execute",
+        "function": function,
+        "call": format_call(definition.name, args, kwargs),
+        "parameters": {"args": args, "kwargs": kwargs}
+    }
@@ -1,8 +1,181 @@
 from firebase_admin import auth
+import firebase_admin
+from google.auth import jwt as google_jwt
+from .cache import LRUCache
+from .session_tokens import is_session_token, verify_session_token
+import hashlib
+import os
+import re
+import threading
+import time
+import requests
+
+FIREBASE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+CLOCK_SKEW_SECONDS = 5
+# Refresh the signing certificates this many seconds before Google says they expire
+CERT_REFRESH_MARGIN = 300
+
+_token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE)
+_verification_counts = {'local': 0, 'remote': 0, 'rejected': 0}
+
+
+class TokenRejected(ValueError):
+    """The token is invalid whatever certificates the Admin SDK would use"""
+
+
+class _CertificateStore:
+    """
+    Holds Google's public signing certificates for Firebase ID tokens.
+
+    The first call fetches them synchronously; afterwards a daemon timer
+    refreshes them in the background shortly before the max-age advertised
+    in the Cache-Control header runs out, so requests never wait on it.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.refreshes = 0
+        self._certs = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._started = False
+
+    def get(self):
+        # Only the very first caller fetches inline; failures are retried by the timer
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    self._started = True
+                    self._refresh()
+        return self._certs
+
+    def _refresh(self):
+        try:
+            response = requests.get(self.url, timeout=5)
+            response.raise_for_status()
+            self._certs = response.json()
+            self.refreshes += 1
+            max_age = self._parse_max_age(response.headers.get('Cache-Control', ''))
+        except Exception as e:
+            print(f"Error refreshing Firebase signing certificates: {str(e)}")
+            max_age = 60 + CERT_REFRESH_MARGIN
+
+        self._timer = threading.Timer(max(max_age - CERT_REFRESH_MARGIN, 60), self._refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    @staticmethod
+    def _parse_max_age(cache_control):
+        match = re.search(r'max-age=(\d+)', cache_control)
+        return int(match.group(1)) if match else 3600
+
+
+_certificate_store = _CertificateStore(FIREBASE_CERTS_URL)
+
+
+def _get_project_id():
+    try:
+        return firebase_admin.get_app().project_id
+    except Exception:
+        return os.getenv('GOOGLE_CLOUD_PROJECT')
+
+
+def _verify_locally(id_token):
+    """
+    Verify a Firebase ID token against the cached signing certificates.
+
+    Applies the same checks as auth.verify_id_token (signature, audience,
+    issuer, subject, iat/exp/auth_time) without any outbound call.
+
+    Raises:
+        TokenRejected: If the token is malformed, expired or fails a check
+            against a known signing key
+        ValueError: If the token cannot be checked locally, e.g. it is signed
+            with a key newer than the cached certificates
+    """
+    try:
+        header = google_jwt.decode_header(id_token)
+        unverified = google_jwt.decode(id_token, verify=False)
+    except Exception as e:
+        raise TokenRejected(f'Malformed token: {str(e)}')
+    # Only used to reject, a forged expiry cannot make a token pass
+    expires_at = unverified.get('exp')
+    if not isinstance(expires_at, (int, float)) or expires_at + CLOCK_SKEW_SECONDS < time.time():
+        raise TokenRejected('Token expired')
+
+    project_id = _get_project_id()
+    certs = _certificate_store.get()
+    if not project_id or not certs:
+        raise ValueError('Local verification unavailable')
+    if header.get('kid') not in certs:
+        raise ValueError('Unknown signing key')
+
+    try:
+        claims = google_jwt.decode(id_token, certs=certs, audience=project_id,
+                                   clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+    except Exception as e:
+        raise TokenRejected(str(e))
+
+    if claims.get('iss') != f'https://securetoken.google.com/{project_id}':
+        raise TokenRejected('Invalid issuer')
+    subject = claims.get('sub')
+    if not isinstance(subject, str) or not subject or len(subject) > 128:
+        raise TokenRejected('Invalid subject')
+    if claims.get('auth_time', 0) > time.time() + CLOCK_SKEW_SECONDS:
+        raise TokenRejected('Invalid auth_time')
+
+    claims['uid'] = subject
+    return claims
+
 
 def verify_firebase_token(id_token):
+    if not id_token:
+        return None
+
+    cache_key = hashlib.sha256(id_token.encode()).hexdigest()
+    cached_token = _token_cache.get(cache_key)
+    if cached_token is not None:
+        return dict(cached_token)
+
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        return decoded_token
-    except:
-        return None
\ No newline at end of file
+        decoded_token = _verify_locally(id_token)
+        _verification_counts['local'] += 1
+    except TokenRejected:
+        _verification_counts['rejected'] += 1
+        return None
+    except Exception:
+        # Fall back to the Admin SDK, e.g. right after a key rotation
+        try:
+            decoded_token = auth.verify_id_token(id_token)
+            _verification_counts['remote'] += 1
+        except Exception:
+            return None
+
+    # Never serve a cached token past its own expiry
+    expires_at = decoded_token.get('exp', 0) - CLOCK_SKEW_SECONDS
+    if expires_at > time.time():
+        _token_cache.set(cache_key, decoded_token, expires_at=expires_at)
+    return dict(decoded_token)
+
+
+def verify_auth_token(token):
+    """
+    Verify an Authorization header value.
+
+    Accepts either a server-issued session token, which is checked locally,
+    or a raw Firebase ID token.
+    """
+    if is_session_token(token):
+        return verify_session_token(token)
+    return verify_firebase_token(token)
+
+
+def get_token_cache_stats():
+    """Return token cache hit/miss counters and how tokens were verified"""
+    stats = _token_cache.stats()
+    stats['local_verifications'] = _verification_counts['local']
+    stats['remote_verifications'] = _verification_counts['remote']
+    stats['rejected_locally'] = _verification_counts['rejected']
+    stats['certificate_refreshes'] = _certificate_store.refreshes
+    return stats
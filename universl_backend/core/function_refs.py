@@ -0,0 +1,41 @@
+# Fields a library reference takes from its original function
+REFERENCE_FIELDS = ('name', 'description', 'code', 'language')
+
+
+def library_reference_id(user_id, function_id):
+    """Deterministic document ID of a public function added to a user's library"""
+    return f"{user_id}_{function_id}"
+
+
+def original_function_ids(functions):
+    """IDs of the originals the library references in functions point to"""
+    return [function['originalFunctionId'] for function in functions if function.get('isReference')]
+
+
+def apply_function_references(functions, originals, fields=None):
+    """
+    Copy the content of original functions into the library references.
+
+    An original that was deleted or made private is unavailable: the reference
+    is marked originalMissing and none of the original's current content is
+    copied, so its owner's later edits stay private.
+
+    Args:
+        functions: List of function dictionaries, modified in place
+        originals: Dict of original function ID to original function data
+        fields: Restrict the copied fields to these (defaults to all reference fields)
+
+    Returns:
+        The same list of functions
+    """
+    copied_fields = [field for field in REFERENCE_FIELDS if fields is None or field in fields]
+    for function in functions:
+        if not function.get('isReference'):
+            continue
+        original = originals.get(function['originalFunctionId'])
+        if original is None or not original.get('isPublic', False):
+            function['originalMissing'] = True
+            continue
+        for field in copied_fields:
+            function[field] = original.get(field)
+    return functions
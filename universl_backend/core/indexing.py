@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import datetime
+import os
+import threading
+import time
+
+INDEXING_WORKERS = int(os.getenv('INDEXING_WORKERS', '4'))
+INDEXING_MAX_RETRIES = 3
+INDEXING_BACKOFF = 2.0
+# Jobs only live in the memory of the worker that queued them, a function
+# still pending after this many seconds lost its job and is requeued
+INDEXING_STALE_AFTER = int(os.getenv('INDEXING_STALE_AFTER', '600'))
+
+INDEXING_PENDING = 'pending'
+INDEXING_INDEXED = 'indexed'
+INDEXING_FAILED = 'failed'
+
+
+def is_indexing_stale(function_data, now=None, stale_after=INDEXING_STALE_AFTER):
+    """
+    Whether a function document is pending for longer than a job can take.
+
+    Documents saved before indexingRequestedAt was recorded fall back to
+    updatedAt, and are stale if they have neither.
+    """
+    if function_data.get('indexingStatus') != INDEXING_PENDING:
+        return False
+    requested_at = function_data.get('indexingRequestedAt') or function_data.get('updatedAt')
+    if requested_at is None:
+        return True
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now - requested_at).total_seconds() > stale_after
+
+
+class IndexingQueue:
+    """
+    Runs function indexing on a bounded pool of background workers.
+
+    index_func is called with the submitted arguments and must return a dict
+    with a success flag (like save_function_description). Failures are
+    retried with exponential backoff, and status_func(key, status, error) is
+    called with the final outcome. When the same key is submitted again
+    before an earlier job ran, the earlier job is skipped, and jobs for the
+    same key never run concurrently, so the latest save always wins.
+    """
+
+    def __init__(self, index_func, status_func, workers=INDEXING_WORKERS,
+                 max_retries=INDEXING_MAX_RETRIES, backoff=INDEXING_BACKOFF):
+        self.index_func = index_func
+        self.status_func = status_func
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='indexing')
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._key_locks = {}
+        self._exclusive = {}
+
+    def submit(self, key, *args, **kwargs):
+        with self._lock:
+            sequence = self._latest.get(key, 0) + 1
+            self._latest[key] = sequence
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        return self._executor.submit(self._run, key, sequence, key_lock, args, kwargs)
+
+    def is_queued(self, key):
+        """Whether a job for key is queued or running in this process"""
+        with self._lock:
+            return key in self._latest
+
+    @contextlib.contextmanager
+    def exclusive(self, key):
+        """
+        Cancel the jobs for key that have not started, wait for a running one
+        to finish and keep new ones from starting until the block exits
+        """
+        with self._lock:
+            sequence = None
+            if key in self._latest:
+                sequence = self._latest[key] + 1
+                self._latest[key] = sequence
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+            self._exclusive[key] = self._exclusive.get(key, 0) + 1
+        try:
+            with key_lock:
+                yield
+        finally:
+            with self._lock:
+                self._exclusive[key] -= 1
+                if not self._exclusive[key]:
+                    del self._exclusive[key]
+                    # Unless a job was submitted meanwhile, every job for key
+                    # is superseded and none is left to clean up after it
+                    if self._latest.get(key) == sequence:
+                        self._latest.pop(key, None)
+                        self._key_locks.pop(key, None)
+
+    def _is_superseded(self, key, sequence):
+        return self._latest.get(key) != sequence
+
+    def _run(self, key, sequence, key_lock, args, kwargs):
+        error = None
+        for attempt in range(self.max_retries):
+            # The key lock is not held while backing off, so a delete or a
+            # newer save does not wait for the retry
+            with key_lock:
+                if self._is_superseded(key, sequence):
+                    return
+                try:
+                    result = self.index_func(*args, **kwargs)
+                    if result.get('success'):
+                        self._finish(key, sequence, INDEXING_INDEXED, None)
+                        return
+                    error = result.get('error')
+                except Exception as e:
+                    error = str(e)
+            print(f"Indexing {key} failed (attempt {attempt + 1}): {error}")
+            if attempt + 1 < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        with key_lock:
+            self._finish(key, sequence, INDEXING_FAILED, error)
+
+    def _finish(self, key, sequence, status, error):
+        if self._is_superseded(key, sequence):
+            return
+        try:
+            self.status_func(key, status, error)
+        except Exception as e:
+            print(f"Error updating indexing status of {key}: {str(e)}")
+        with self._lock:
+            if not self._is_superseded(key, sequence):
+                del self._latest[key]
+                if key not in self._exclusive:
+                    self._key_locks.pop(key, None)
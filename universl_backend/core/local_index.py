@@ -0,0 +1,189 @@
+from collections import OrderedDict, namedtuple
+from .cache import KeyVersions, LRUCache
+import numpy as np
+import os
+import threading
+import time
+
+# Off by default: each worker process holds its own copy, so another worker's
+# writes only show up after LOCAL_INDEX_TTL
+LOCAL_INDEX_ENABLED = os.getenv('LOCAL_INDEX_ENABLED', '').lower() in ('1', 'true', 'yes')
+LOCAL_INDEX_MAX_FUNCTIONS = int(os.getenv('LOCAL_INDEX_MAX_FUNCTIONS', '500'))
+LOCAL_INDEX_MEMORY_BUDGET = int(os.getenv('LOCAL_INDEX_MEMORY_BUDGET', str(256 * 1024 * 1024)))
+LOCAL_INDEX_TTL = int(os.getenv('LOCAL_INDEX_TTL', '300'))
+# Users whose write versions and too-large flags are remembered
+LOCAL_INDEX_MAX_USERS = int(os.getenv('LOCAL_INDEX_MAX_USERS', '10000'))
+
+# Mirrors the id/score/payload attributes of a Qdrant ScoredPoint
+LocalHit = namedtuple('LocalHit', ['id', 'score', 'payload'])
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class UserVectorIndex:
+    """
+    Description vectors of one user's functions as a normalized float32 matrix.
+
+    ids, payloads and matrix are held in one immutable snapshot that writers
+    rebuild and swap in with a single assignment, so a search running
+    concurrently with a write sees either the old or the new index, never a
+    mix of the two.
+    """
+
+    def __init__(self, points):
+        ids = tuple(str(point_id) for point_id, _, _ in points)
+        payloads = tuple(payload for _, _, payload in points)
+        vectors = np.asarray([vector for _, vector, _ in points], dtype=np.float32)
+        matrix = _normalize(vectors) if len(points) else np.zeros((0, 0), dtype=np.float32)
+        self._snapshot = (ids, payloads, matrix)
+        self.loaded_at = time.time()
+
+    @property
+    def nbytes(self):
+        return self._snapshot[2].nbytes
+
+    def search(self, query_vector, limit, score_threshold=None):
+        """Cosine top-k, scored the same way as the Qdrant collection"""
+        ids, payloads, matrix = self._snapshot
+        if not ids:
+            return []
+        query = _normalize(np.asarray(query_vector, dtype=np.float32))
+        scores = matrix @ query
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            LocalHit(ids[i], float(scores[i]), payloads[i])
+            for i in top
+            if score_threshold is None or scores[i] >= score_threshold
+        ]
+
+    def upsert(self, point_id, vector, payload):
+        ids, payloads, matrix = self._snapshot
+        vector = _normalize(np.asarray(vector, dtype=np.float32))
+        point_id = str(point_id)
+        if point_id in ids:
+            i = ids.index(point_id)
+            matrix = matrix.copy()
+            matrix[i] = vector
+            self._snapshot = (ids, payloads[:i] + (payload,) + payloads[i + 1:], matrix)
+        elif ids:
+            self._snapshot = (ids + (point_id,), payloads + (payload,), np.vstack([matrix, vector]))
+        else:
+            self._snapshot = ((point_id,), (payload,), vector[np.newaxis, :])
+
+    def set_payload(self, point_id, payload):
+        ids, payloads, matrix = self._snapshot
+        point_id = str(point_id)
+        if point_id in ids:
+            i = ids.index(point_id)
+            payloads = payloads[:i] + ({**payloads[i], **payload},) + payloads[i + 1:]
+            self._snapshot = (ids, payloads, matrix)
+
+    def remove(self, point_id):
+        ids, payloads, matrix = self._snapshot
+        point_id = str(point_id)
+        if point_id in ids:
+            i = ids.index(point_id)
+            self._snapshot = (ids[:i] + ids[i + 1:], payloads[:i] + payloads[i + 1:], np.delete(matrix, i, axis=0))
+
+
+class LocalVectorIndex:
+    """
+    LRU of per-user vector indexes under a memory budget.
+
+    Users with more than max_functions functions are remembered as too large
+    and left to Qdrant. Writes made in this process are applied to loaded
+    indexes; a load that raced with a write is discarded rather than cached.
+    """
+
+    def __init__(self, max_functions=LOCAL_INDEX_MAX_FUNCTIONS,
+                 memory_budget=LOCAL_INDEX_MEMORY_BUDGET, ttl=LOCAL_INDEX_TTL,
+                 max_users=LOCAL_INDEX_MAX_USERS):
+        self.max_functions = max_functions
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self._indexes = OrderedDict()
+        self._too_large = LRUCache(maxsize=max_users, ttl=ttl)
+        self._versions = KeyVersions(maxsize=max_users)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, user_id):
+        return self._versions.get(user_id)
+
+    def peek(self, user_id):
+        """
+        Return the user's loaded index, False if the library is too large for
+        a local index, or None if it has to be loaded
+        """
+        with self._lock:
+            if self._too_large.get(user_id):
+                return False
+            index = self._indexes.get(user_id)
+            if index is None or time.time() - index.loaded_at >= self.ttl:
+                self._indexes.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._indexes.move_to_end(user_id)
+            self.hits += 1
+            return index
+
+    def put(self, user_id, points, version):
+        """
+        Store the points loaded for a user, as (id, vector, payload) tuples.
+
+        Returns:
+            The new index, or False if the library is too large
+        """
+        if len(points) > self.max_functions:
+            self._too_large.set(user_id, True)
+            return False
+
+        index = UserVectorIndex(points)
+        with self._lock:
+            if self.version(user_id) != version:
+                return index
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            self._evict()
+        return index
+
+    def _evict(self):
+        total = sum(index.nbytes for index in self._indexes.values())
+        while total > self.memory_budget and len(self._indexes) > 1:
+            _, index = self._indexes.popitem(last=False)
+            total -= index.nbytes
+
+    def _update(self, user_id, apply):
+        with self._lock:
+            self._versions.bump(user_id)
+            index = self._indexes.get(user_id)
+            if index is not None:
+                apply(index)
+
+    def upsert(self, user_id, point_id, vector, payload):
+        self._update(user_id, lambda index: index.upsert(point_id, vector, payload))
+
+    def set_payload(self, user_id, point_id, payload):
+        self._update(user_id, lambda index: index.set_payload(point_id, payload))
+
+    def remove(self, user_id, point_id):
+        self._update(user_id, lambda index: index.remove(point_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._indexes),
+                'bytes': sum(index.nbytes for index in self._indexes.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+local_index = LocalVectorIndex()
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from firebase_admin import firestore
+from core.views import db, invalidate_user_library
+
+
+class Command(BaseCommand):
+    help = (
+        "Set updatedAt on functions saved without it, from createdAt. The "
+        "paginated library is ordered by updatedAt, and Firestore leaves "
+        "documents without the field out of that query"
+    )
+
+    def add_arguments(self, parser):
+        # A Firestore batch takes at most 500 writes
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Report changes without writing them")
+
+    def handle(self, *args, **options):
+        batch_size = min(options['batch_size'], 500)
+        dry_run = options['dry_run']
+        counts = {'scanned': 0, 'backfilled': 0}
+        users = set()
+        batch = db.batch()
+        pending = 0
+
+        for doc in db.collection('functions').select(['userId', 'createdAt', 'updatedAt']).stream():
+            counts['scanned'] += 1
+            function_data = doc.to_dict()
+            if function_data.get('updatedAt') is not None:
+                continue
+            counts['backfilled'] += 1
+            users.add(function_data.get('userId'))
+            if dry_run:
+                continue
+            # Without createdAt either, the backfill time is the best estimate
+            batch.update(doc.reference, {
+                'updatedAt': function_data.get('createdAt') or firestore.SERVER_TIMESTAMP
+            })
+            pending += 1
+            if pending >= batch_size:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+
+        if pending:
+            batch.commit()
+        if not dry_run:
+            for user_id in users:
+                invalidate_user_library(user_id)
+
+        verb = "Would backfill" if dry_run else "Backfilled"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} updatedAt on {counts['backfilled']} of {counts['scanned']} functions"
+        ))
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from qdrant_client import models
+from core.qdrant_setup import QDRANT_COLLECTION, function_point_id
+from core.views import db, qdrant_client
+
+
+class Command(BaseCommand):
+    help = (
+        "Move function description points to IDs derived from their Firestore "
+        "function ID and delete points whose function no longer exists"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--dry-run', action='store_true', help="Report changes without writing them")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        # userId -> (function IDs, {function name: function ID}); names resolve
+        # points indexed before function_id was stored in the payload
+        libraries = {}
+        counts = {'scanned': 0, 'migrated': 0, 'up_to_date': 0, 'orphaned': 0}
+
+        offset = None
+        while True:
+            points, offset = qdrant_client.scroll(
+                collection_name=QDRANT_COLLECTION,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            upserts = []
+            deletes = []
+
+            for point in points:
+                counts['scanned'] += 1
+                function_id = self._resolve_function_id(point.payload, libraries)
+                if function_id is None:
+                    counts['orphaned'] += 1
+                    deletes.append(point.id)
+                    continue
+
+                new_id = function_point_id(function_id)
+                if str(point.id) == new_id:
+                    counts['up_to_date'] += 1
+                    continue
+
+                counts['migrated'] += 1
+                upserts.append(models.PointStruct(
+                    id=new_id,
+                    vector=point.vector,
+                    payload={**point.payload, 'function_id': function_id}
+                ))
+                deletes.append(point.id)
+
+            if not dry_run:
+                # Upsert before deleting so a failure never loses a vector
+                if upserts:
+                    qdrant_client.upsert(collection_name=QDRANT_COLLECTION, points=upserts)
+                if deletes:
+                    qdrant_client.delete(
+                        collection_name=QDRANT_COLLECTION,
+                        points_selector=models.PointIdsList(points=deletes)
+                    )
+
+            self.stdout.write(
+                f"Scanned {counts['scanned']}: {counts['migrated']} migrated, "
+                f"{counts['up_to_date']} up to date, {counts['orphaned']} orphaned"
+            )
+            if offset is None:
+                break
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING("Dry run, no points were changed"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Qdrant point migration complete"))
+
+    def _resolve_function_id(self, payload, libraries):
+        """Return the ID of the existing function a point belongs to, or None"""
+        user_id = payload.get('userId')
+        if user_id not in libraries:
+            docs = db.collection('functions').where('userId', '==', user_id).select(['name']).stream()
+            function_ids, names = set(), {}
+            for doc in docs:
+                function_ids.add(doc.id)
+                names.setdefault(doc.to_dict().get('name'), doc.id)
+            libraries[user_id] = (function_ids, names)
+
+        function_ids, names = libraries[user_id]
+        function_id = payload.get('function_id')
+        if function_id:
+            return function_id if function_id in function_ids else None
+        return names.get(payload.get('function_name'))
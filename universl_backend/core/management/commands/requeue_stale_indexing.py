@@ -0,0 +1,23 @@
+from concurrent.futures import wait
+from django.core.management.base import BaseCommand
+from core.indexing import INDEXING_PENDING
+from core.views import db, requeue_stale_indexing
+
+
+class Command(BaseCommand):
+    help = (
+        "Requeue functions left pending by indexing jobs that were lost with "
+        "their worker, and wait for the jobs to finish"
+    )
+
+    def handle(self, *args, **options):
+        futures = []
+        pending = db.collection('functions').where('indexingStatus', '==', INDEXING_PENDING).stream()
+        for doc in pending:
+            future = requeue_stale_indexing(doc)
+            if future is not None:
+                futures.append(future)
+
+        # The queue's workers live in this process, exit once they are done
+        wait(futures)
+        self.stdout.write(self.style.SUCCESS(f"Requeued {len(futures)} functions"))
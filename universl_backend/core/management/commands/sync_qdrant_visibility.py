@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from qdrant_client import models
+from core.qdrant_setup import QDRANT_COLLECTION, function_point_id
+from core.views import db, qdrant_client, init_qdrant_collection
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the isPublic flag of every function onto its Qdrant point, for "
+        "points indexed before visibility was part of the payload"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=256)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Creates the isPublic payload index if it is missing
+        init_qdrant_collection()
+
+        counts = {True: 0, False: 0}
+        batches = {True: [], False: []}
+        for doc in db.collection('functions').select(['isPublic']).stream():
+            is_public = bool(doc.to_dict().get('isPublic'))
+            batches[is_public].append(function_point_id(doc.id))
+            if len(batches[is_public]) >= batch_size:
+                counts[is_public] += self._apply(batches[is_public], is_public)
+                batches[is_public] = []
+
+        for is_public, points in batches.items():
+            if points:
+                counts[is_public] += self._apply(points, is_public)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Marked {counts[True]} points public and {counts[False]} private"
+        ))
+
+    def _apply(self, points, is_public):
+        # Selecting by filter skips functions that were never indexed, where
+        # a list of IDs would fail the whole batch
+        qdrant_client.set_payload(
+            collection_name=QDRANT_COLLECTION,
+            payload={'isPublic': is_public},
+            points=models.Filter(must=[models.HasIdCondition(has_id=points)]),
+            wait=False
+        )
+        return len(points)
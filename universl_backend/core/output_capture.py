@@ -0,0 +1,57 @@
+import contextlib
+import contextvars
+import io
+import sys
+import threading
+
+_buffer = contextvars.ContextVar('captured_output', default=None)
+_lock = threading.Lock()
+
+
+class _ContextStdout:
+    """
+    Stand-in for sys.stdout that writes to the buffer of the current context
+    while one is set, and to the wrapped stream otherwise.
+
+    Replacing sys.stdout itself for a capture would also capture whatever the
+    other threads and tasks of the process print in the meantime.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _target(self):
+        buffer = _buffer.get()
+        return self._stream if buffer is None else buffer
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+def _install():
+    with _lock:
+        if not isinstance(sys.stdout, _ContextStdout):
+            sys.stdout = _ContextStdout(sys.stdout)
+
+
+@contextlib.contextmanager
+def capture_output():
+    """
+    Capture what the current thread or task prints, into the yielded StringIO.
+
+    The context is copied into asyncio tasks and to_thread calls, so output of
+    work started from inside the block is captured as well.
+    """
+    _install()
+    buffer = io.StringIO()
+    token = _buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _buffer.reset(token)
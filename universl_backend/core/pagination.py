@@ -0,0 +1,90 @@
+from firebase_admin import firestore
+import base64
+import datetime
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a page_size query parameter, clamped to MAX_PAGE_SIZE"""
+    if value in (None, ''):
+        return default
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('page_size must be an integer')
+    if page_size < 1:
+        raise ValueError('page_size must be positive')
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def parse_fields(value, allowed):
+    """
+    Parse a comma separated fields= projection.
+
+    Returns:
+        List of field names, or None when no projection was requested
+    """
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def encode_cursor(order_value, doc_id):
+    """Build an opaque cursor from the last document of a page"""
+    if isinstance(order_value, datetime.datetime):
+        order_value = {'dt': order_value.isoformat()}
+    raw = json.dumps({'v': order_value, 'id': doc_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, returns (order_value, doc_id)"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        order_value = data['v']
+        if isinstance(order_value, dict) and 'dt' in order_value:
+            order_value = datetime.datetime.fromisoformat(order_value['dt'])
+        return order_value, data['id']
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def paginate_query(query, collection_ref, order_field, page_size, cursor=None,
+                   direction=firestore.Query.DESCENDING):
+    """
+    Fetch one page of a Firestore query ordered by order_field.
+
+    Ties on order_field are broken by document ID so cursors are stable.
+    Combined with equality filters this needs a composite index, the ones
+    for the paginated endpoints are in firestore.indexes.json and deployed
+    with `firebase deploy --only firestore:indexes`.
+
+    Returns:
+        Tuple of (list of document snapshots, next cursor or None)
+    """
+    query = query.order_by(order_field, direction=direction).order_by(
+        firestore.FieldPath.document_id(), direction=direction
+    )
+
+    if cursor:
+        order_value, doc_id = decode_cursor(cursor)
+        query = query.start_after({
+            order_field: order_value,
+            '__name__': collection_ref.document(doc_id),
+        })
+
+    # Fetch one extra document to know whether another page exists
+    docs = list(query.limit(page_size + 1).stream())
+    next_cursor = None
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        last_doc = docs[-1]
+        next_cursor = encode_cursor(last_doc.get(order_field), last_doc.id)
+    return docs, next_cursor
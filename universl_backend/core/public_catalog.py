@@ -0,0 +1,167 @@
+from firebase_admin import firestore
+import bisect
+import datetime
+import json
+import os
+import threading
+import time
+
+PUBLIC_CATALOG_PATH = os.getenv('PUBLIC_CATALOG_PATH')
+# Each worker process holds its own catalog, so rebuild it periodically to pick up
+# changes made through other workers
+PUBLIC_CATALOG_MAX_AGE = int(os.getenv('PUBLIC_CATALOG_MAX_AGE', '300'))
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+class PublicFunctionCatalog:
+    """
+    In-process materialized view of all public functions.
+
+    The catalog is built from Firestore once (or loaded from PUBLIC_CATALOG_PATH)
+    and then kept current by upsert/remove calls from the views that change a
+    function's visibility or content. Every change bumps the version stamp.
+    Entries are kept sorted by (lowercased name, id) so pages can be served
+    with keyset cursors that survive concurrent inserts.
+    """
+
+    def __init__(self, persist_path=None, max_age=PUBLIC_CATALOG_MAX_AGE):
+        self.persist_path = persist_path
+        self.max_age = max_age
+        self.version = 0
+        self._functions = {}
+        self._sort_keys = []
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _sort_key(function_id, function_data):
+        return ((function_data.get('name') or '').lower(), function_id)
+
+    def _is_fresh(self):
+        return self._built_at is not None and time.time() - self._built_at < self.max_age
+
+    def ensure_built(self, loader):
+        """
+        Build the catalog if it is missing or older than max_age.
+
+        Args:
+            loader: Callable returning an iterable of (function_id, function_data)
+        """
+        if self._is_fresh():
+            return
+        with self._lock:
+            if self._is_fresh():
+                return
+            if self._built_at is None and self._load_from_disk():
+                return
+            self._replace(dict(loader()))
+            self._persist()
+
+    def _replace(self, functions):
+        self._functions = functions
+        self._sort_keys = sorted(self._sort_key(fid, data) for fid, data in functions.items())
+        self._built_at = time.time()
+        self.version += 1
+
+    def _load_from_disk(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return False
+        try:
+            if time.time() - os.path.getmtime(self.persist_path) >= self.max_age:
+                return False
+            with open(self.persist_path) as f:
+                snapshot = json.load(f)
+            self._replace(snapshot['functions'])
+            self.version = snapshot.get('version', self.version)
+            return True
+        except Exception as e:
+            print(f"Error loading public catalog from disk: {str(e)}")
+            return False
+
+    def _persist(self):
+        if not self.persist_path:
+            return
+        try:
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': self.version, 'functions': self._functions}, f, default=_json_default)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            print(f"Error persisting public catalog: {str(e)}")
+
+    def upsert(self, function_id, function_data):
+        """Add or replace a public function"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        function_data = {
+            key: now if value is firestore.SERVER_TIMESTAMP else value
+            for key, value in function_data.items()
+        }
+        function_data['id'] = function_id
+
+        with self._lock:
+            if self._built_at is None:
+                # Not built yet, the first read will load it from Firestore
+                return
+            existing = self._functions.get(function_id)
+            if existing is not None:
+                self._sort_keys.remove(self._sort_key(function_id, existing))
+            self._functions[function_id] = function_data
+            bisect.insort(self._sort_keys, self._sort_key(function_id, function_data))
+            self.version += 1
+            self._persist()
+
+    def remove(self, function_id):
+        """Drop a function that was deleted or made private"""
+        with self._lock:
+            existing = self._functions.pop(function_id, None)
+            if existing is None:
+                return
+            self._sort_keys.remove(self._sort_key(function_id, existing))
+            self.version += 1
+            self._persist()
+
+    def get_many(self, function_ids, include_code=True):
+        """Return the catalog entries of function_ids in order, skipping ones not in the catalog"""
+        with self._lock:
+            return [
+                {
+                    key: value for key, value in self._functions[function_id].items()
+                    if include_code or key != 'code'
+                }
+                for function_id in function_ids
+                if function_id in self._functions
+            ]
+
+    def page(self, page_size=None, after=None, include_code=True):
+        """
+        Return a slice of the catalog.
+
+        Args:
+            page_size: Number of functions to return, or None for all of them
+            after: Sort key of the last entry of the previous page
+            include_code: Whether to include the code field
+
+        Returns:
+            Tuple of (list of functions, sort key of the last entry or None, version)
+        """
+        with self._lock:
+            start = bisect.bisect_right(self._sort_keys, tuple(after)) if after else 0
+            end = len(self._sort_keys) if page_size is None else start + page_size
+            keys = self._sort_keys[start:end]
+            functions = []
+            for _, function_id in keys:
+                function_data = self._functions[function_id]
+                functions.append({
+                    key: value for key, value in function_data.items()
+                    if include_code or key != 'code'
+                })
+            last_key = list(keys[-1]) if keys and end < len(self._sort_keys) else None
+            return functions, last_key, self.version
+
+
+public_catalog = PublicFunctionCatalog(persist_path=PUBLIC_CATALOG_PATH)
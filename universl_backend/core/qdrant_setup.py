@@ -0,0 +1,84 @@
+from django.core.exceptions import ImproperlyConfigured
+from qdrant_client import models
+import threading
+import uuid
+
+QDRANT_COLLECTION = "function_descriptions"
+# Must match the output size of EMBEDDING_MODEL
+EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_DIM = 1536
+QDRANT_DISTANCE = models.Distance.COSINE
+QDRANT_PAYLOAD_INDEXES = {
+    'userId': models.PayloadSchemaType.KEYWORD,
+    'function_name': models.PayloadSchemaType.KEYWORD,
+    'isPublic': models.PayloadSchemaType.BOOL,
+}
+
+# Namespace for point IDs derived from Firestore function document IDs
+FUNCTION_POINT_NAMESPACE = uuid.UUID('6f1c2a7e-3b5d-4e8a-9c41-2d7f0b8e5a13')
+
+_bootstrapped = False
+_bootstrap_lock = threading.Lock()
+
+
+def function_point_id(function_id):
+    """Deterministic Qdrant point ID of a function document"""
+    return str(uuid.uuid5(FUNCTION_POINT_NAMESPACE, function_id))
+
+
+def _verify_collection(client):
+    info = client.get_collection(QDRANT_COLLECTION)
+
+    vectors = info.config.params.vectors
+    if not isinstance(vectors, models.VectorParams):
+        raise ImproperlyConfigured(f"Qdrant collection {QDRANT_COLLECTION} uses named vectors")
+    if vectors.size != EMBEDDING_DIM or vectors.distance != QDRANT_DISTANCE:
+        raise ImproperlyConfigured(
+            f"Qdrant collection {QDRANT_COLLECTION} has {vectors.size}-dim {vectors.distance} vectors, "
+            f"expected {EMBEDDING_DIM}-dim {QDRANT_DISTANCE} for {EMBEDDING_MODEL}"
+        )
+
+    payload_schema = info.payload_schema or {}
+    for field_name, field_schema in QDRANT_PAYLOAD_INDEXES.items():
+        index = payload_schema.get(field_name)
+        if index is None:
+            # Missing indexes are safe to add on a live collection
+            client.create_payload_index(
+                collection_name=QDRANT_COLLECTION,
+                field_name=field_name,
+                field_schema=field_schema
+            )
+        elif index.data_type != field_schema:
+            raise ImproperlyConfigured(
+                f"Qdrant payload index {field_name} is {index.data_type}, expected {field_schema}"
+            )
+
+
+def ensure_qdrant_collection(client):
+    """
+    Create or verify the function descriptions collection, once per process.
+
+    Raises:
+        ImproperlyConfigured: If the live collection does not match the
+            configured dimension, distance or payload indexes
+    """
+    global _bootstrapped
+    if _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+        if client.collection_exists(QDRANT_COLLECTION):
+            _verify_collection(client)
+        else:
+            client.create_collection(
+                collection_name=QDRANT_COLLECTION,
+                vectors_config=models.VectorParams(size=EMBEDDING_DIM, distance=QDRANT_DISTANCE)
+            )
+            for field_name, field_schema in QDRANT_PAYLOAD_INDEXES.items():
+                client.create_payload_index(
+                    collection_name=QDRANT_COLLECTION,
+                    field_name=field_name,
+                    field_schema=field_schema
+                )
+        _bootstrapped = True
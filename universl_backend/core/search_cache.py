@@ -0,0 +1,92 @@
+from .cache import LRUCache
+from .embedding_cache import normalize_text
+from .user_cache import shared_library_version
+import os
+import threading
+import time
+
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '2000'))
+# Entries are checked against the shared library version, the TTL only bounds
+# how long results of users who stopped searching are kept
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '300'))
+
+
+class SearchResultCache:
+    """
+    Vector search results keyed by (user_id, normalized query, limit, score threshold).
+
+    Each entry remembers the user's library version it was computed against.
+    Saves, deletes and finished indexing jobs in any worker bump that version,
+    and an entry from an older version is dropped instead of served.
+    """
+
+    def __init__(self, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, version_func=shared_library_version):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._version_func = version_func
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._served_age = 0.0
+        self._max_served_age = 0.0
+
+    def _key(self, user_id, query, limit, score_threshold):
+        return (user_id, normalize_text(query), limit, score_threshold)
+
+    def version(self, user_id):
+        return self._version_func(user_id)
+
+    def get(self, user_id, query, limit, score_threshold=None, version=None):
+        """
+        Return a copy of the cached result, or None on a miss or stale entry.
+
+        version is the user's current library version, read here if not given.
+        Callers that go on to search on a miss pass the version they read
+        first, and store the result with it.
+        """
+        key = self._key(user_id, query, limit, score_threshold)
+        entry = self._cache.get(key)
+        if entry is not None and version is None:
+            version = self.version(user_id)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_version, stored_at, result = entry
+            if stored_version != version:
+                self.stale += 1
+                self.misses += 1
+                self._cache.delete(key)
+                return None
+            age = time.time() - stored_at
+            self.hits += 1
+            self._served_age += age
+            self._max_served_age = max(self._max_served_age, age)
+        return {**result, 'results': [dict(item) for item in result['results']]}
+
+    def put(self, user_id, query, limit, score_threshold, result, version):
+        """
+        Store a search result computed against library version, which must be
+        read before the search ran so a concurrent write marks it stale
+        """
+        key = self._key(user_id, query, limit, score_threshold)
+        result = {**result, 'results': [dict(item) for item in result['results']]}
+        self._cache.set(key, (version, time.time(), result))
+
+    def stats(self):
+        """Return hit rate, how many lookups found a stale entry and the age of served results"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'stale_rate': self.stale / lookups if lookups else 0.0,
+                'avg_served_age': self._served_age / self.hits if self.hits else 0.0,
+                'max_served_age': self._max_served_age,
+            }
+
+
+search_results = SearchResultCache()
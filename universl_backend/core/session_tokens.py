@@ -0,0 +1,188 @@
+from django.core.exceptions import ImproperlyConfigured
+from firebase_admin import firestore
+from .cache import LRUCache
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+
+SESSION_TOKEN_PREFIX = 'st1.'
+SESSION_TOKEN_TTL = int(os.getenv('SESSION_TOKEN_TTL', '3600'))
+REVOKED_SESSIONS_COLLECTION = 'revokedSessionTokens'
+# How long a token found not revoked is trusted before the denylist is read again,
+# i.e. how long a logout can take to reach the other workers
+REVOCATION_CHECK_INTERVAL = int(os.getenv('SESSION_REVOCATION_CHECK_INTERVAL', '30'))
+REVOCATION_CACHE_SIZE = int(os.getenv('SESSION_REVOCATION_CACHE_SIZE', '10000'))
+
+
+def _get_secret():
+    # Never fall back to SECRET_KEY: it is committed to the repository, and
+    # anyone holding it could mint a token for any email address
+    secret = os.getenv('SESSION_TOKEN_SECRET')
+    return secret.encode() if secret else None
+
+
+def session_tokens_enabled():
+    """Session tokens are only issued and accepted when SESSION_TOKEN_SECRET is set"""
+    return _get_secret() is not None
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def _sign(secret, payload_segment):
+    return hmac.new(secret, payload_segment.encode(), hashlib.sha256).digest()
+
+
+class SessionDenylist:
+    """
+    IDs of revoked session tokens, shared by every worker through Firestore.
+
+    Each document is kept until the token would have expired anyway
+    (expiresAt, suitable for a Firestore TTL policy). Verification stays
+    local for most requests: a token found not revoked is trusted for
+    check_interval seconds before its document is read again.
+    """
+
+    def __init__(self, collection=REVOKED_SESSIONS_COLLECTION, check_interval=REVOCATION_CHECK_INTERVAL,
+                 maxsize=REVOCATION_CACHE_SIZE, db=None):
+        self.collection = collection
+        self._db = db
+        self._not_revoked = LRUCache(maxsize=maxsize, ttl=check_interval)
+        self._revoked = LRUCache(maxsize=maxsize)
+
+    def _documents(self):
+        if self._db is None:
+            self._db = firestore.client()
+        return self._db.collection(self.collection)
+
+    def is_revoked(self, claims):
+        jti = claims['jti']
+        if self._revoked.get(jti):
+            return True
+        if self._not_revoked.get(jti):
+            return False
+
+        try:
+            revoked = self._documents().document(jti).get().exists
+        except Exception as e:
+            # Fail closed, the client can still authenticate with its Firebase ID token
+            print(f"Error reading session token denylist: {str(e)}")
+            return True
+
+        if revoked:
+            self._revoked.set(jti, True, expires_at=claims['exp'])
+        else:
+            self._not_revoked.set(jti, True)
+        return revoked
+
+    def revoke(self, claims):
+        jti = claims['jti']
+        self._documents().document(jti).set({
+            'userId': claims.get('user_id'),
+            'expiresAt': datetime.datetime.fromtimestamp(claims['exp'], tz=datetime.timezone.utc),
+            'revokedAt': firestore.SERVER_TIMESTAMP,
+        })
+        self._revoked.set(jti, True, expires_at=claims['exp'])
+        self._not_revoked.delete(jti)
+
+
+session_denylist = SessionDenylist()
+
+
+def is_session_token(token):
+    return bool(token) and token.startswith(SESSION_TOKEN_PREFIX)
+
+
+def issue_session_token(user_id, uid, email, ttl=None):
+    """
+    Mint a compact HMAC-signed session token for an authenticated user.
+
+    Args:
+        user_id: The sha256-derived user ID used as the Firestore key
+        uid: The Firebase UID of the user
+        email: The user's email address
+        ttl: Lifetime in seconds (defaults to SESSION_TOKEN_TTL)
+
+    Returns:
+        Tuple of (token, expires_at unix timestamp)
+
+    Raises:
+        ImproperlyConfigured: If SESSION_TOKEN_SECRET is not set
+    """
+    secret = _get_secret()
+    if secret is None:
+        raise ImproperlyConfigured("SESSION_TOKEN_SECRET must be set to issue session tokens")
+
+    issued_at = int(time.time())
+    expires_at = issued_at + (ttl or SESSION_TOKEN_TTL)
+    payload = {
+        'user_id': user_id,
+        'uid': uid,
+        'email': email,
+        'iat': issued_at,
+        'exp': expires_at,
+        'jti': uuid.uuid4().hex,
+    }
+    payload_segment = _b64encode(json.dumps(payload, separators=(',', ':')).encode())
+    token = f"{SESSION_TOKEN_PREFIX}{payload_segment}.{_b64encode(_sign(secret, payload_segment))}"
+    return token, expires_at
+
+
+def _decode(token):
+    """Return the payload of a correctly signed token, ignoring expiry"""
+    secret = _get_secret()
+    if secret is None:
+        return None
+    try:
+        payload_segment, signature = token[len(SESSION_TOKEN_PREFIX):].split('.')
+        if not hmac.compare_digest(_sign(secret, payload_segment), _b64decode(signature)):
+            return None
+        return json.loads(_b64decode(payload_segment))
+    except Exception:
+        return None
+
+
+def verify_session_token(token, denylist=None):
+    """
+    Verify a session token locally.
+
+    Returns:
+        The token claims (user_id, uid, email, iat, exp, jti) or None if the
+        token is malformed, tampered with, expired or revoked, or session
+        tokens are disabled
+    """
+    if not is_session_token(token):
+        return None
+
+    claims = _decode(token)
+    if not claims or claims.get('exp', 0) <= time.time():
+        return None
+    if (denylist or session_denylist).is_revoked(claims):
+        return None
+    return claims
+
+
+def revoke_session_token(token, denylist=None):
+    """
+    Add a session token to the shared denylist until it would have expired anyway.
+
+    Returns:
+        True if the token was valid and is now revoked, False otherwise
+    """
+    claims = _decode(token) if is_session_token(token) else None
+    if not claims:
+        return False
+
+    if claims.get('exp', 0) > time.time():
+        (denylist or session_denylist).revoke(claims)
+    return True
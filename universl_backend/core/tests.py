@@ -1,3 +1,825 @@
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from firebase_admin import firestore
+from unittest import mock
+import asyncio
+import datetime
+import hashlib
+import os
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+import numpy as np
+
+from .async_bridge import get_event_loop, run_async
+from .cache import KeyVersions, LRUCache
+from .embedding_cache import CachedEmbeddings, _SQLiteTier
+from .fast_path import (
+    parse_run_command, parse_arguments, find_function_definition, bind_arguments, is_confident_match,
+    determine_action
+)
+from . import firebase_auth
+from .function_refs import apply_function_references
+from .indexing import IndexingQueue, is_indexing_stale, INDEXING_INDEXED, INDEXING_PENDING
+from .local_index import UserVectorIndex
+from .output_capture import capture_output
+from .search_cache import SearchResultCache
+from .user_cache import LibraryVersions
+from .write_behind import WriteBehindQueue
+from .session_tokens import (
+    SessionDenylist, issue_session_token, verify_session_token, revoke_session_token, session_tokens_enabled
+)
+
+
+class FakeFirestore:
+    """Just enough of a Firestore client for document get/set/delete by ID"""
+
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, (self.name, doc_id))
+
+
+class FakeDocument:
+    def __init__(self, db, key):
+        self.db = db
+        self.key = key
+
+    @property
+    def exists(self):
+        return self.key in self.db.documents
+
+    def get(self):
+        self.db.reads += 1
+        return self
+
+    def to_dict(self):
+        return dict(self.db.documents[self.key]) if self.exists else None
+
+    def set(self, data, merge=False):
+        stored = dict(self.db.documents.get(self.key, {})) if merge else {}
+        for field, value in data.items():
+            if isinstance(value, firestore.Increment):
+                value = stored.get(field, 0) + value.value
+            stored[field] = value
+        self.db.documents[self.key] = stored
+
+    def delete(self):
+        self.db.documents.pop(self.key, None)
+
+
+@mock.patch.dict('os.environ', {'SESSION_TOKEN_SECRET': 'test-secret'})
+class SessionTokenTests(SimpleTestCase):
+
+    def setUp(self):
+        self.db = FakeFirestore()
+        self.denylist = SessionDenylist(db=self.db, check_interval=30)
+
+    def issue(self, ttl=None):
+        token, _ = issue_session_token('user-1', 'uid-1', 'user@example.com', ttl=ttl)
+        return token
+
+    def test_round_trip(self):
+        token, expires_at = issue_session_token('user-1', 'uid-1', 'user@example.com', ttl=60)
+        claims = verify_session_token(token, denylist=self.denylist)
+        self.assertEqual(claims['user_id'], 'user-1')
+        self.assertEqual(claims['uid'], 'uid-1')
+        self.assertEqual(claims['email'], 'user@example.com')
+        self.assertEqual(claims['exp'], expires_at)
+
+    def test_rejects_tampered_payload(self):
+        token = self.issue()
+        payload, signature = token[len('st1.'):].split('.')
+        forged = 'st1.' + payload[:-2] + ('AA' if payload[-2:] != 'AA' else 'BB') + '.' + signature
+        self.assertIsNone(verify_session_token(forged, denylist=self.denylist))
+        self.assertIsNone(verify_session_token(token + 'x', denylist=self.denylist))
+        self.assertIsNone(verify_session_token('st1.garbage', denylist=self.denylist))
+
+    def test_rejects_token_signed_with_another_secret(self):
+        with mock.patch.dict('os.environ', {'SESSION_TOKEN_SECRET': 'other-secret'}):
+            token = self.issue()
+        self.assertIsNone(verify_session_token(token, denylist=self.denylist))
+
+    def test_rejects_expired_token(self):
+        token = self.issue(ttl=60)
+        with mock.patch('core.session_tokens.time.time', return_value=time.time() + 61):
+            self.assertIsNone(verify_session_token(token, denylist=self.denylist))
+
+    def test_revoked_token_is_rejected(self):
+        token = self.issue()
+        self.assertIsNotNone(verify_session_token(token, denylist=self.denylist))
+        self.assertTrue(revoke_session_token(token, denylist=self.denylist))
+        self.assertIsNone(verify_session_token(token, denylist=self.denylist))
+        self.assertEqual(len(self.db.documents), 1)
+
+    def test_revocation_reaches_other_workers(self):
+        token = self.issue()
+        other_worker = SessionDenylist(db=self.db, check_interval=30)
+        self.assertIsNotNone(verify_session_token(token, denylist=other_worker))
+
+        revoke_session_token(token, denylist=self.denylist)
+        # Trusted until the not-revoked answer is rechecked
+        self.assertIsNotNone(verify_session_token(token, denylist=other_worker))
+        with mock.patch('core.cache.time.time', return_value=time.time() + 31):
+            self.assertIsNone(verify_session_token(token, denylist=other_worker))
+
+    def test_not_revoked_answer_is_cached(self):
+        token = self.issue()
+        for _ in range(5):
+            verify_session_token(token, denylist=self.denylist)
+        self.assertEqual(self.db.reads, 1)
+
+    def test_revoke_rejects_invalid_tokens(self):
+        self.assertFalse(revoke_session_token('st1.garbage', denylist=self.denylist))
+        self.assertFalse(revoke_session_token('firebase-id-token', denylist=self.denylist))
+        self.assertEqual(self.db.documents, {})
+
+    def test_denylist_read_failure_fails_closed(self):
+        token = self.issue()
+        broken = SessionDenylist(db=mock.Mock(collection=mock.Mock(side_effect=RuntimeError('down'))))
+        self.assertIsNone(verify_session_token(token, denylist=broken))
+
+
+class SessionTokenSecretTests(SimpleTestCase):
+
+    def test_disabled_without_secret(self):
+        with mock.patch.dict('os.environ', {'SESSION_TOKEN_SECRET': 'test-secret'}):
+            token, _ = issue_session_token('user-1', 'uid-1', 'user@example.com')
+        with mock.patch.dict('os.environ', clear=True):
+            self.assertFalse(session_tokens_enabled())
+            with self.assertRaises(ImproperlyConfigured):
+                issue_session_token('user-1', 'uid-1', 'user@example.com')
+            self.assertIsNone(verify_session_token(token, denylist=SessionDenylist(db=FakeFirestore())))
+
+
+class LibraryVersionTests(SimpleTestCase):
+
+    def test_versions_are_shared_between_workers(self):
+        db = FakeFirestore()
+        worker, other_worker = LibraryVersions(db=db), LibraryVersions(db=db)
+        self.assertEqual(worker.get('user-1'), 0)
+        worker.bump('user-1')
+        other_worker.bump('user-1')
+        self.assertEqual(worker.get('user-1'), 2)
+        self.assertEqual(other_worker.get('user-2'), 0)
+
+    def test_bump_failure_is_not_raised(self):
+        broken = LibraryVersions(db=mock.Mock(collection=mock.Mock(side_effect=RuntimeError('down'))))
+        broken.bump('user-1')
+
+    def test_bumps_requested_together_are_one_increment(self):
+        db = FakeFirestore()
+        versions = LibraryVersions(db=db, delay=60)
+        for _ in range(5):
+            versions.bump_soon('user-1')
+        versions.bump_soon('user-2')
+        self.assertEqual(versions.get('user-1'), 0)
+        versions.flush()
+        self.assertEqual(versions.get('user-1'), 1)
+        self.assertEqual(versions.get('user-2'), 1)
+
+    def test_pending_bumps_are_written_after_the_delay(self):
+        versions = LibraryVersions(db=FakeFirestore(), delay=0.01)
+        versions.bump_soon('user-1')
+        deadline = time.monotonic() + 2
+        while versions.get('user-1') == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(versions.get('user-1'), 1)
+
+
+class KeyVersionsTests(SimpleTestCase):
+
+    def test_size_is_bounded(self):
+        versions = KeyVersions(maxsize=2)
+        for user_id in ('a', 'b', 'c', 'd'):
+            versions.bump(user_id)
+        self.assertEqual(len(versions), 2)
+
+    def test_forgotten_key_does_not_return_to_an_earlier_version(self):
+        versions = KeyVersions(maxsize=1)
+        loaded_at = versions.get('a')
+        versions.bump('a')
+        versions.bump('b')  # forgets a
+        self.assertNotEqual(versions.get('a'), loaded_at)
+
+
+class SearchResultCacheTests(SimpleTestCase):
+
+    def test_write_in_another_worker_marks_results_stale(self):
+        db = FakeFirestore()
+        versions, other_worker = LibraryVersions(db=db), LibraryVersions(db=db)
+        cache = SearchResultCache(version_func=versions.get)
+        result = {'success': True, 'results': [{'function_name': 'add'}], 'count': 1}
+
+        cache.put('user-1', 'add numbers', 5, None, result, cache.version('user-1'))
+        self.assertEqual(cache.get('user-1', 'Add  numbers', 5), result)
+
+        other_worker.bump('user-1')
+        self.assertIsNone(cache.get('user-1', 'add numbers', 5))
+        self.assertEqual(cache.stats()['stale'], 1)
+
+    def test_given_version_is_not_read_again(self):
+        version_func = mock.Mock(return_value=0)
+        cache = SearchResultCache(version_func=version_func)
+        cache.put('user-1', 'add', 5, None, {'results': []}, 0)
+        self.assertIsNotNone(cache.get('user-1', 'add', 5, None, 0))
+        version_func.assert_not_called()
+
+
+class FunctionReferenceTests(SimpleTestCase):
+
+    def reference(self):
+        return {'id': 'adopter_orig', 'isReference': True, 'originalFunctionId': 'orig'}
+
+    def test_public_original_is_copied(self):
+        original = {'name': 'add', 'code': 'def add(a, b): return a + b', 'isPublic': True}
+        function = apply_function_references([self.reference()], {'orig': original})[0]
+        self.assertEqual(function['code'], original['code'])
+        self.assertNotIn('originalMissing', function)
+
+    def test_private_original_is_not_exposed(self):
+        original = {'name': 'add', 'code': 'def add(a, b): return a - b', 'isPublic': False}
+        function = apply_function_references([self.reference()], {'orig': original})[0]
+        self.assertTrue(function['originalMissing'])
+        self.assertNotIn('code', function)
+
+    def test_deleted_original_is_missing(self):
+        function = apply_function_references([self.reference()], {})[0]
+        self.assertTrue(function['originalMissing'])
+
+
+class AsyncBridgeTests(SimpleTestCase):
+
+    def test_run_async_runs_on_the_shared_loop(self):
+        async def running_loop():
+            await asyncio.sleep(0)
+            return asyncio.get_running_loop()
+
+        async def caller():
+            return asyncio.get_running_loop(), await run_async(running_loop())
+
+        caller_loop, coroutine_loop = asyncio.run(caller())
+        self.assertIs(coroutine_loop, get_event_loop())
+        self.assertIsNot(coroutine_loop, caller_loop)
+
+
+class OutputCaptureTests(SimpleTestCase):
+
+    def test_concurrent_captures_only_see_their_own_prints(self):
+        barrier = threading.Barrier(4)
+        captured = {}
+
+        def run(name):
+            with capture_output() as output:
+                barrier.wait(5)
+                for _ in range(50):
+                    print(name)
+            captured[name] = output.getvalue().split()
+
+        threads = [threading.Thread(target=run, args=(f"turn-{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(captured, {f"turn-{i}": [f"turn-{i}"] * 50 for i in range(4)})
+
+    def test_other_threads_are_not_captured(self):
+        with capture_output() as output:
+            thread = threading.Thread(target=print, args=('elsewhere',))
+            thread.start()
+            thread.join(5)
+            print('inside')
+        self.assertEqual(output.getvalue(), 'inside\n')
+
+
+class UserVectorIndexTests(SimpleTestCase):
+
+    def points(self, count, dimensions=8):
+        rng = np.random.default_rng(0)
+        return [(f"p{i}", rng.normal(size=dimensions), {'function_id': f"p{i}"}) for i in range(count)]
+
+    def test_search_ranks_by_cosine_similarity(self):
+        index = UserVectorIndex([('a', [1, 0], {}), ('b', [1, 1], {}), ('c', [0, 1], {})])
+        hits = index.search([1, 0.1], limit=2)
+        self.assertEqual([hit.id for hit in hits], ['a', 'b'])
+        self.assertEqual(index.search([1, 0], limit=3, score_threshold=0.5)[-1].id, 'b')
+
+    def test_upsert_set_payload_and_remove(self):
+        index = UserVectorIndex([('a', [1, 0], {'name': 'a'})])
+        index.upsert('b', [0, 1], {'name': 'b'})
+        index.upsert('a', [0, 1], {'name': 'a2'})
+        index.set_payload('b', {'isPublic': True})
+        index.remove('missing')
+        self.assertEqual({hit.id: hit.payload for hit in index.search([0, 1], limit=5)},
+                         {'a': {'name': 'a2'}, 'b': {'name': 'b', 'isPublic': True}})
+        index.remove('a')
+        self.assertEqual([hit.id for hit in index.search([0, 1], limit=5)], ['b'])
+
+    def test_concurrent_writes_never_mix_ids_and_rows(self):
+        points = self.points(200)
+        query = points[0][1]
+        expected = {
+            point_id: float(np.dot(vector, query) / (np.linalg.norm(vector) * np.linalg.norm(query)))
+            for point_id, vector, _ in points
+        }
+        index = UserVectorIndex(points)
+        stop = threading.Event()
+        errors = []
+
+        def search():
+            while not stop.is_set():
+                try:
+                    for hit in index.search(query, limit=10):
+                        if abs(hit.score - expected[hit.id]) > 1e-4:
+                            errors.append(hit)
+                except Exception as e:
+                    errors.append(e)
+
+        readers = [threading.Thread(target=search) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        for _ in range(5):
+            for point_id, vector, payload in points[1:]:
+                index.remove(point_id)
+                index.upsert(point_id, vector, payload)
+        stop.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+
+
+class IndexingQueueTests(SimpleTestCase):
+
+    def test_exclusive_waits_for_running_job_and_skips_queued_ones(self):
+        started, release = threading.Event(), threading.Event()
+        calls, statuses, events = [], [], []
+
+        def index(name):
+            calls.append(name)
+            if name == 'first':
+                started.set()
+                release.wait(5)
+            events.append(f"indexed {name}")
+            return {'success': True}
+
+        queue = IndexingQueue(index, lambda key, status, error: statuses.append((key, status)), workers=2)
+        running = queue.submit('key', 'first')
+        started.wait(5)
+        queued = queue.submit('key', 'second')
+
+        def delete():
+            with queue.exclusive('key'):
+                events.append('deleted')
+
+        deleter = threading.Thread(target=delete)
+        deleter.start()
+        time.sleep(0.05)
+        release.set()
+        deleter.join(5)
+        running.result(5)
+        queued.result(5)
+
+        self.assertEqual(calls, ['first'])
+        self.assertEqual(events, ['indexed first', 'deleted'])
+        self.assertEqual(statuses, [])
+
+    def test_retries_then_records_status(self):
+        attempts = []
+
+        def index():
+            attempts.append(1)
+            return {'success': len(attempts) == 2, 'error': 'flaky'}
+
+        statuses = []
+        queue = IndexingQueue(index, lambda key, status, error: statuses.append((key, status, error)), backoff=0)
+        queue.submit('key').result(5)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(statuses, [('key', INDEXING_INDEXED, None)])
+
+    def test_is_queued_until_the_job_finishes(self):
+        release = threading.Event()
+        queue = IndexingQueue(lambda: {'success': release.wait(5)}, lambda key, status, error: None)
+        job = queue.submit('key')
+        self.assertTrue(queue.is_queued('key'))
+        release.set()
+        job.result(5)
+        self.assertFalse(queue.is_queued('key'))
+
+
+    def test_exclusive_forgets_the_key_it_cancelled(self):
+        blocker, release = threading.Event(), threading.Event()
+        calls = []
+
+        def index(name):
+            calls.append(name)
+            if name == 'blocker':
+                blocker.set()
+                release.wait(5)
+            return {'success': True}
+
+        queue = IndexingQueue(index, lambda key, status, error: None, workers=1)
+        running = queue.submit('other', 'blocker')
+        blocker.wait(5)
+        queued = queue.submit('key', 'deleted')
+
+        with queue.exclusive('key'):
+            pass
+        self.assertFalse(queue.is_queued('key'))
+        release.set()
+        running.result(5)
+        queued.result(5)
+
+        self.assertEqual(calls, ['blocker'])
+        self.assertEqual(queue._latest, {})
+        self.assertEqual(queue._key_locks, {})
+
+    def test_exclusive_keeps_jobs_submitted_meanwhile(self):
+        queue = IndexingQueue(lambda: {'success': True}, lambda key, status, error: None)
+        with queue.exclusive('key'):
+            job = queue.submit('key')
+            self.assertTrue(queue.is_queued('key'))
+        job.result(5)
+        self.assertFalse(queue.is_queued('key'))
+        self.assertEqual(queue._key_locks, {})
+
+
+class StaleIndexingTests(SimpleTestCase):
+
+    now = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def pending(self, seconds_ago, field='indexingRequestedAt'):
+        return {'indexingStatus': INDEXING_PENDING, field: self.now - datetime.timedelta(seconds=seconds_ago)}
+
+    def test_recent_pending_is_not_stale(self):
+        self.assertFalse(is_indexing_stale(self.pending(60), now=self.now, stale_after=600))
+
+    def test_old_pending_is_stale(self):
+        self.assertTrue(is_indexing_stale(self.pending(601), now=self.now, stale_after=600))
+
+    def test_falls_back_to_updated_at(self):
+        self.assertTrue(is_indexing_stale(self.pending(601, 'updatedAt'), now=self.now, stale_after=600))
+        self.assertTrue(is_indexing_stale({'indexingStatus': INDEXING_PENDING}, now=self.now))
+
+    def test_finished_jobs_are_never_stale(self):
+        self.assertFalse(is_indexing_stale({'indexingStatus': INDEXING_INDEXED}, now=self.now))
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'embeddings.sqlite3')
+
+    def test_prune_keeps_recently_read_entries(self):
+        tier = _SQLiteTier(self.path, max_rows=2)
+        with mock.patch('core.embedding_cache.time.time', return_value=1000):
+            tier.set('old', [1.0])
+        with mock.patch('core.embedding_cache.time.time', return_value=2000):
+            tier.set('newer', [2.0])
+        with mock.patch('core.embedding_cache.time.time', return_value=3000):
+            self.assertEqual(tier.get('old'), [1.0])
+            tier.set('newest', [3.0])
+            tier._prune(tier._connection())
+        self.assertIsNone(tier.get('newer'))
+        self.assertEqual(tier.get('old'), [1.0])
+
+    def test_async_lookups_keep_sqlite_off_the_event_loop(self):
+        model = mock.Mock()
+        model.aembed_query = mock.AsyncMock(return_value=[0.5])
+        cache = CachedEmbeddings(model, 'test-model', path=self.path)
+        threads = []
+        original_get, original_set = cache._disk.get, cache._disk.set
+
+        def record(method):
+            def wrapper(*args):
+                threads.append(threading.get_ident())
+                return method(*args)
+            return wrapper
+
+        cache._disk.get, cache._disk.set = record(original_get), record(original_set)
+
+        async def lookups():
+            vectors = [await cache.aembed_query('add two numbers')]
+            cache._memory.clear()
+            vectors.append(await cache.aembed_query('add two numbers'))
+            return threading.get_ident(), vectors
+
+        loop_thread, vectors = asyncio.run(lookups())
+        self.assertEqual(vectors, [[0.5], [0.5]])
+        self.assertEqual(model.aembed_query.await_count, 1)
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(loop_thread, threads)
+
+
+class FastPathTests(SimpleTestCase):
+
+    FIBONACCI = {'name': 'fibonacci', 'code': 'def fibonacci(n, memo=None):\n    return n'}
+
+    def bind(self, code, args=(), kwargs=None):
+        bind_arguments(find_function_definition(code), list(args), kwargs or {})
+
+    def test_parse_run_command(self):
+        self.assertEqual(parse_run_command('run fibonacci with n=10.'),
+                         {'function_name': 'fibonacci', 'arguments': 'n=10'})
+        self.assertEqual(parse_run_command('Please execute the function add numbers (2, 3)'),
+                         {'function_name': 'add numbers', 'arguments': '2, 3'})
+        self.assertEqual(parse_run_command('fibonacci(10)'), {'function_name': 'fibonacci', 'arguments': '10'})
+        self.assertEqual(parse_run_command('run the tests'), {'function_name': 'tests', 'arguments': ''})
+        self.assertIsNone(parse_run_command('what does fibonacci do?'))
+
+    def test_parse_arguments(self):
+        self.assertEqual(parse_arguments(''), ([], {}))
+        self.assertEqual(parse_arguments('10, k=3'), ([10], {'k': 3}))
+        self.assertEqual(parse_arguments('n=10 and k=3'), ([], {'n': 10, 'k': 3}))
+        self.assertEqual(parse_arguments('n 10'), ([], {'n': 10}))
+        self.assertEqual(parse_arguments("'a b', [1, 2]"), (['a b', [1, 2]], {}))
+
+    def test_parse_arguments_only_accepts_literals(self):
+        for text in ('__import__("os").system("ls")', 'n=open("x")', '*values', 'n=10 and'):
+            with self.assertRaises(ValueError, msg=text):
+                parse_arguments(text)
+
+    def test_bind_arguments(self):
+        code = 'def f(a, b=1, *, c, d=2):\n    pass'
+        self.bind(code, [1], {'c': 3})
+        self.bind(code, [], {'a': 1, 'c': 3, 'd': 4})
+        with self.assertRaisesRegex(ValueError, 'Missing arguments for f: c'):
+            self.bind(code, [1])
+        with self.assertRaisesRegex(ValueError, 'no parameter e'):
+            self.bind(code, [1], {'c': 3, 'e': 5})
+        with self.assertRaisesRegex(ValueError, 'multiple values for a'):
+            self.bind(code, [1], {'a': 1, 'c': 3})
+        with self.assertRaisesRegex(ValueError, 'takes 2 positional arguments'):
+            self.bind(code, [1, 2, 3], {'c': 3})
+        self.bind('def g(*args, **kwargs):\n    pass', [1, 2, 3], {'x': 1})
+
+    def test_is_confident_match(self):
+        self.assertFalse(is_confident_match([]))
+        self.assertFalse(is_confident_match([{'score': 0.3}]))
+        self.assertTrue(is_confident_match([{'score': 0.8}]))
+        self.assertTrue(is_confident_match([{'score': 0.8}, {'score': 0.7}]))
+        self.assertFalse(is_confident_match([{'score': 0.8}, {'score': 0.78}]))
+        # A runner-up below the minimum score does not count
+        self.assertTrue(is_confident_match([{'score': 0.52}, {'score': 0.49}]))
+
+    def test_determine_action_executes_a_complete_call(self):
+        intent = {'intent': 'run', 'function_name': 'fibonacci', 'arguments': 'n=10'}
+        action = determine_action(intent, {'function': self.FIBONACCI, 'match': 'name'})
+        self.assertEqual(action['type'], 'execute')
+        self.assertEqual(action['call'], 'fibonacci(n=10)')
+        self.assertEqual(action['parameters'], {'args': [], 'kwargs': {'n': 10}})
+
+    def test_determine_action_falls_back_to_the_agent(self):
+        run = {'intent': 'run', 'function_name': 'fibonacci', 'arguments': ''}
+        self.assertEqual(determine_action({'intent': 'agent'}, {'function': None})['type'], 'agent')
+        self.assertEqual(determine_action(run, {'function': None})['type'], 'agent')
+        # Missing the required argument n
+        self.assertEqual(determine_action(run, {'function': self.FIBONACCI, 'match': 'name'})['type'], 'agent')
+
+    def test_similarity_match_needs_arguments(self):
+        no_arguments = {'name': 'cleanup', 'code': 'def cleanup():\n    pass'}
+        intent = {'intent': 'run', 'function_name': 'the tests', 'arguments': ''}
+        self.assertEqual(determine_action(intent, {'function': no_arguments, 'match': 'embedding'})['type'], 'agent')
+        self.assertEqual(determine_action(intent, {'function': no_arguments, 'match': 'name'})['type'], 'execute')
+
+
+class FakeBatchClient:
+    """Firestore client whose batched writes fail the first failures commits"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.commits = []
+
+    def batch(self):
+        client = self
+        writes = []
+
+        class Batch:
+            def set(self, doc_ref, data):
+                writes.append((doc_ref.path, data))
+
+            def commit(self):
+                if client.failures:
+                    client.failures -= 1
+                    raise RuntimeError('unavailable')
+                client.commits.append(list(writes))
+
+        return Batch()
+
+
+def fake_ref(doc_id):
+    return mock.Mock(path=f'function_executions/{doc_id}')
+
+
+class WriteBehindQueueTests(SimpleTestCase):
+
+    def test_enqueued_records_are_pending_until_written(self):
+        client = FakeBatchClient()
+        writer = WriteBehindQueue(client, flush_interval=0.01)
+        with mock.patch.object(writer, '_ensure_worker'):
+            self.assertTrue(writer.enqueue(fake_ref('a'), {'result': 1}))
+        self.assertEqual(writer.pending(fake_ref('a')), {'result': 1})
+        self.assertIsNone(writer.pending(fake_ref('b')))
+
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertIsNone(writer.pending(fake_ref('a')))
+        self.assertEqual(client.commits, [[('function_executions/a', {'result': 1})]])
+
+    def test_buffered_records_are_written_in_batches(self):
+        client = FakeBatchClient()
+        writer = WriteBehindQueue(client, batch_size=2, flush_interval=0.01)
+        with mock.patch.object(writer, '_ensure_worker'):
+            for i in range(5):
+                writer.enqueue(fake_ref(str(i)), {'n': i})
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual([len(commit) for commit in client.commits], [2, 2, 1])
+        self.assertEqual(writer.stats()['written'], 5)
+
+    def test_full_queue_rejects(self):
+        writer = WriteBehindQueue(FakeBatchClient(), max_queue=1)
+        with mock.patch.object(writer, '_ensure_worker'):
+            self.assertTrue(writer.enqueue(fake_ref('a'), {}))
+            self.assertFalse(writer.enqueue(fake_ref('b'), {}))
+        self.assertIsNone(writer.pending(fake_ref('b')))
+
+    def test_failed_batch_is_retried(self):
+        client = FakeBatchClient(failures=2)
+        writer = WriteBehindQueue(client, flush_interval=0.01, backoff=0)
+        writer.enqueue(fake_ref('a'), {})
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(len(client.commits), 1)
+        self.assertEqual(writer.stats()['retries'], 2)
+
+    def test_dropped_batch_is_logged_as_error(self):
+        writer = WriteBehindQueue(FakeBatchClient(failures=3), flush_interval=0.01, max_retries=3, backoff=0)
+        with self.assertLogs('core.write_behind', level='ERROR'):
+            writer.enqueue(fake_ref('a'), {})
+            self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(writer.stats()['failed'], 1)
+        self.assertIsNone(writer.pending(fake_ref('a')))
+
+    def test_shutdown_flush_is_registered_with_atexit(self):
+        writer = WriteBehindQueue(FakeBatchClient(), flush_interval=0.01)
+        with mock.patch('core.write_behind.atexit.register') as register:
+            writer.register_shutdown_flush(timeout=3)
+        register.assert_called_once_with(writer.flush, 3)
+
+        writer.enqueue(fake_ref('a'), {})
+        flush, timeout = register.call_args.args
+        self.assertTrue(flush(timeout))
+        self.assertEqual(writer.stats()['written'], 1)
+
+
+def signing_key(key_id):
+    """An RSA signer and the self-signed certificate Google would publish for it"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    from google.auth import crypt
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, key_id)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    signer = crypt.RSASigner.from_string(private_pem, key_id=key_id)
+    return signer, certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class FirebaseTokenTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signer, cls.certificate = signing_key('key-1')
+        cls.other_signer, _ = signing_key('key-1')
+
+    def setUp(self):
+        self.remote = mock.Mock(side_effect=ValueError('remote says no'))
+        for patcher in (
+            mock.patch.object(firebase_auth, '_token_cache', LRUCache(maxsize=2)),
+            mock.patch.object(firebase_auth, '_verification_counts', {'local': 0, 'remote': 0, 'rejected': 0}),
+            mock.patch.object(firebase_auth, '_get_project_id', return_value='project'),
+            mock.patch.object(firebase_auth._certificate_store, 'get', return_value={'key-1': self.certificate}),
+            mock.patch.object(firebase_auth.auth, 'verify_id_token', self.remote),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def token(self, signer=None, **claims):
+        from google.auth import jwt as google_jwt
+
+        now = int(time.time())
+        payload = {
+            'iss': 'https://securetoken.google.com/project',
+            'aud': 'project',
+            'sub': 'user-1',
+            'email': 'user@example.com',
+            'iat': now - 10,
+            'auth_time': now - 10,
+            'exp': now + 3600,
+            **claims
+        }
+        return google_jwt.encode(signer or self.signer, payload).decode()
+
+    def test_valid_token_is_verified_locally_and_cached(self):
+        token = self.token()
+        self.assertEqual(firebase_auth.verify_firebase_token(token)['uid'], 'user-1')
+        self.assertEqual(firebase_auth.verify_firebase_token(token)['email'], 'user@example.com')
+
+        stats = firebase_auth.get_token_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual((stats['local_verifications'], stats['remote_verifications']), (1, 0))
+        self.remote.assert_not_called()
+
+    def test_cached_token_expires_with_the_token(self):
+        expires_at = int(time.time()) + firebase_auth.CLOCK_SKEW_SECONDS + 60
+        token = self.token(exp=expires_at)
+        firebase_auth.verify_firebase_token(token)
+
+        with mock.patch('core.cache.time.time', return_value=expires_at):
+            self.assertIsNone(firebase_auth._token_cache.get(hashlib.sha256(token.encode()).hexdigest()))
+
+    def test_least_recently_used_tokens_are_evicted(self):
+        first, second, third = (self.token(sub=f'user-{i}') for i in range(3))
+        for token in (first, second, first, third):
+            firebase_auth.verify_firebase_token(token)
+
+        stats = firebase_auth.get_token_cache_stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+        firebase_auth.verify_firebase_token(first)
+        self.assertEqual(firebase_auth.get_token_cache_stats()['hits'], 2)
+        firebase_auth.verify_firebase_token(second)
+        self.assertEqual(firebase_auth.get_token_cache_stats()['local_verifications'], 4)
+
+    def test_expired_and_malformed_tokens_are_rejected_locally(self):
+        expired = self.token(exp=int(time.time()) - 60)
+        for token in (expired, 'not-a-token', 'a.b.c'):
+            self.assertIsNone(firebase_auth.verify_firebase_token(token))
+        self.assertEqual(firebase_auth.get_token_cache_stats()['rejected_locally'], 3)
+        self.remote.assert_not_called()
+
+    def test_failed_checks_against_a_known_key_are_rejected_locally(self):
+        for token in (
+            self.token(signer=self.other_signer),
+            self.token(aud='other-project'),
+            self.token(iss='https://securetoken.google.com/other-project'),
+            self.token(sub=''),
+        ):
+            self.assertIsNone(firebase_auth.verify_firebase_token(token))
+        self.remote.assert_not_called()
+
+    def test_unknown_signing_key_falls_back_to_the_admin_sdk(self):
+        rotated, _ = signing_key('key-2')
+        self.remote.side_effect = None
+        self.remote.return_value = {'uid': 'user-1', 'exp': int(time.time()) + 3600}
+
+        self.assertEqual(firebase_auth.verify_firebase_token(self.token(signer=rotated))['uid'], 'user-1')
+        self.assertEqual(firebase_auth.get_token_cache_stats()['remote_verifications'], 1)
+
+
+class CertificateStoreTests(SimpleTestCase):
+
+    def response(self, cache_control):
+        return mock.Mock(headers={'Cache-Control': cache_control}, json=mock.Mock(return_value={'key-1': 'cert'}))
+
+    def test_refresh_is_scheduled_before_the_certificates_expire(self):
+        store = firebase_auth._CertificateStore('https://certs.example')
+        with mock.patch.object(firebase_auth.requests, 'get', return_value=self.response('public, max-age=21600')), \
+                mock.patch.object(firebase_auth.threading, 'Timer') as timer:
+            self.assertEqual(store.get(), {'key-1': 'cert'})
+            store.get()
+        self.assertEqual(store.refreshes, 1)
+        timer.assert_called_once_with(21600 - firebase_auth.CERT_REFRESH_MARGIN, store._refresh)
+
+    def test_failed_refresh_is_retried_soon(self):
+        store = firebase_auth._CertificateStore('https://certs.example')
+        with mock.patch.object(firebase_auth.requests, 'get', side_effect=RuntimeError('down')), \
+                mock.patch.object(firebase_auth.threading, 'Timer') as timer:
+            self.assertIsNone(store.get())
+        self.assertEqual(store.refreshes, 0)
+        timer.assert_called_once_with(60, store._refresh)
@@ -1,7 +1,23 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from .views import password_reset_request
 
+# The async views only pay off under ASGI, under WSGI each call would get its own event loop.
+# Streaming views must be async under ASGI, which iterates a sync stream on the event loop
+if settings.ASYNC_VIEWS:
+    get_response_view = views.Aget_response
+    get_user_functions_view = views.Aget_user_functions
+    get_user_function_view = views.Aget_user_function
+    stream_response_view = views.Astream_response
+    export_functions_view = views.Aexport_functions
+else:
+    get_response_view = views.get_response
+    get_user_functions_view = views.get_user_functions
+    get_user_function_view = views.get_user_function
+    stream_response_view = views.stream_response
+    export_functions_view = views.export_functions
+
 urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.user_login, name='login'),
@@ -15,15 +31,23 @@ urlpatterns = [
     path('chat/', views.chat, name='chat'),
     path('get_user_data/', views.get_user_data, name='get_user_data'),
     path('save_user_data/', views.save_user_data_api, name='save_user_data'),
-    path('get_user_functions/', views.get_user_functions, name='get_user_functions'),
+    path('get_user_functions/', get_user_functions_view, name='get_user_functions'),
+    path('get_user_function/', get_user_function_view, name='get_user_function'),
+    path('get_indexing_status/', views.get_indexing_status, name='get_indexing_status'),
     path('save_user_function/', views.save_user_function, name='save_user_function'),
+    path('bulk_import_functions/', views.bulk_import_functions, name='bulk_import_functions'),
+    path('export_functions/', export_functions_view, name='export_functions'),
     path('toggle_function_visibility/', views.toggle_function_visibility, name='toggle_function_visibility'),
     path('get_public_functions/', views.get_public_functions, name='get_public_functions'),
+    path('search_public_functions/', views.search_public_functions, name='search_public_functions'),
     path('add_public_function_to_library/', views.add_public_function_to_library, name='add_public_function_to_library'),
+    path('search_functions/', views.search_user_functions, name='search_functions'),
     path('delete_user_function/', views.delete_user_function, name='delete_user_function'),
-    path('get_response/', views.get_response, name='get_response'),
+    path('get_response/', get_response_view, name='get_response'),
+    path('stream_response/', stream_response_view, name='stream_response'),
     path('repeat_execution/', views.repeat_execution, name='repeat_execution'),
     path('get_execution_history/', views.get_execution_history, name='get_execution_history'),
+    path('get_execution_detail/', views.get_execution_detail, name='get_execution_detail'),
 
     
 ]
\ No newline at end of file
@@ -0,0 +1,143 @@
+from firebase_admin import firestore
+from .cache import KeyVersions, LRUCache
+import atexit
+import os
+import threading
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1000'))
+# Caches are per process, so the TTL bounds how stale another worker's copy can get
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '30'))
+LIBRARY_VERSIONS_COLLECTION = 'libraryVersions'
+# Bumps of the shared library version requested within this many seconds are
+# written as one increment
+LIBRARY_VERSION_BUMP_DELAY = float(os.getenv('LIBRARY_VERSION_BUMP_DELAY', '0.5'))
+
+
+class ReadThroughCache:
+    """
+    Per-key read-through cache with a version counter per key.
+
+    Writers call invalidate(), which drops the cached value and bumps the
+    key's version. A load that raced with an invalidation is not stored, so
+    the cache never holds data older than the last write it was told about.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._versions = KeyVersions(maxsize=maxsize)
+
+    def version(self, key):
+        return self._versions.get(key)
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, calling loader() on a miss.
+
+        Loader results of None are not cached.
+        """
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+
+        version = self.version(key)
+        value = loader()
+        if value is not None and self.version(key) == version:
+            self._cache.set(key, value)
+        return value
+
+    def peek(self, key):
+        return self._cache.get(key)
+
+    def put(self, key, value, version):
+        """Store a value loaded elsewhere, unless key was invalidated since version"""
+        if value is not None and self.version(key) == version:
+            self._cache.set(key, value)
+
+    def invalidate(self, key):
+        self._versions.bump(key)
+        self._cache.delete(key)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+user_profiles = ReadThroughCache()
+user_libraries = ReadThroughCache()
+
+
+def local_library_version(user_id):
+    """
+    Version of a user's library in this process, bumped on every write made
+    here. Only meant for invalidating local caches, clients get the shared
+    version from LibraryVersions.
+    """
+    return user_libraries.version(user_id)
+
+
+class LibraryVersions:
+    """
+    Per-user library version in Firestore, shared by all worker processes.
+
+    Writers bump it after every write to the library with an atomic server
+    side increment. Readers read it before the functions, so a version never
+    claims data newer than what was read with it.
+
+    bump_soon() coalesces the bumps of a burst of writes, such as the indexing
+    jobs of an import, into one increment per user written after delay.
+    """
+
+    def __init__(self, collection=LIBRARY_VERSIONS_COLLECTION, db=None, delay=LIBRARY_VERSION_BUMP_DELAY):
+        self.collection = collection
+        self.delay = delay
+        self._db = db
+        self._pending = set()
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _documents(self):
+        if self._db is None:
+            self._db = firestore.client()
+        return self._db.collection(self.collection)
+
+    def get(self, user_id):
+        doc = self._documents().document(user_id).get()
+        return doc.to_dict().get('version', 0) if doc.exists else 0
+
+    def bump(self, user_id):
+        try:
+            self._documents().document(user_id).set({'version': firestore.Increment(1)}, merge=True)
+        except Exception as e:
+            # The write itself went through, clients see it with the next bump
+            print(f"Error bumping library version: {str(e)}")
+
+    def bump_soon(self, user_id):
+        """Bump the user's version within delay seconds, together with other bumps requested meanwhile"""
+        with self._lock:
+            self._pending.add(user_id)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write the pending bumps now"""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for user_id in pending:
+            self.bump(user_id)
+
+
+library_versions = LibraryVersions()
+atexit.register(library_versions.flush)
+
+
+def shared_library_version(user_id):
+    """
+    Version of a user's library that changes with a write made by any worker
+    process. The local version is included so a write made here still counts
+    if its shared bump failed.
+    """
+    return (library_versions.get(user_id), local_library_version(user_id))
@@ -1,10 +1,31 @@
-from asgiref.sync import async_to_sync
-from django.http import JsonResponse, HttpResponseServerError
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import JsonResponse, HttpResponseServerError, StreamingHttpResponse, HttpResponseNotAllowed
+from django.core.serializers.json import DjangoJSONEncoder
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
 from firebase_admin import auth as firebase_auth, firestore
-from .firebase_auth import verify_firebase_token
+from .firebase_auth import verify_firebase_token, verify_auth_token
+from .session_tokens import issue_session_token, revoke_session_token, session_tokens_enabled
+from .pagination import parse_page_size, parse_fields, paginate_query, encode_cursor, decode_cursor
+from .public_catalog import public_catalog
+from .write_behind import WriteBehindQueue
+from .user_cache import user_profiles, user_libraries, library_versions
+from .function_refs import REFERENCE_FIELDS, library_reference_id, original_function_ids, apply_function_references
+from . import async_data
+from .async_bridge import iterate_sync, iterate_async, iterate_in_thread, run_async, run_sync
+from .output_capture import capture_output
+from .fast_path import (
+    parse_run_command, match_function_name, parse_arguments, find_function_definition,
+    bind_arguments, format_call, format_signature, is_confident_match, allows_similarity_match,
+    determine_action, FAST_PATH_MIN_SCORE
+)
+from .qdrant_setup import QDRANT_COLLECTION, EMBEDDING_MODEL, ensure_qdrant_collection, function_point_id
+from .embedding_cache import CachedEmbeddings
+from .indexing import IndexingQueue, is_indexing_stale, INDEXING_PENDING, INDEXING_INDEXED, INDEXING_FAILED
+from .local_index import local_index, LOCAL_INDEX_ENABLED
+from .search_cache import search_results as search_result_cache
 import hashlib
 from qdrant_client import QdrantClient, models
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
@@ -12,10 +33,11 @@ from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from langchain.schema import SystemMessage , AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, HumanMessagePromptTemplate
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain.agents import AgentExecutor, create_tool_calling_agent 
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain.tools import StructuredTool  
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from langchain.tools import BaseTool
 from langchain.agents import initialize_agent, AgentType
 from langchain_openai import ChatOpenAI
@@ -30,7 +52,9 @@ from langchain_openai import OpenAIEmbeddings
 
 import os
 import datetime
-import uuid
+import asyncio
+import contextvars
+import functools
 
 
 load_dotenv()
@@ -51,13 +75,48 @@ qdrant_client = QdrantClient(
 
 # llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash")
 
-embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY, model='text-embedding-3-small')
-llm = ChatOpenAI(api_key=OPENAI_API_KEY, model='gpt-4o-mini')
+# Shared by the sync and async search paths and the save path
+embeddings = CachedEmbeddings(
+    OpenAIEmbeddings(api_key=OPENAI_API_KEY, model=EMBEDDING_MODEL),
+    model=EMBEDDING_MODEL
+)
+LLM_MODEL = 'gpt-4o-mini'
+llm = ChatOpenAI(api_key=OPENAI_API_KEY, model=LLM_MODEL)
+
+# Stored with every indexed description, bump the suffix when the description prompt changes
+DESCRIPTION_INDEX_VERSION = f"{LLM_MODEL}/{EMBEDDING_MODEL}/1"
 
  
 # Initialize Firestore client
 db = firestore.client()
 
+# Execution records and history are written in the background, nothing in a
+# response depends on them having been committed
+execution_writer = WriteBehindQueue(db)
+execution_writer.register_shutdown_flush()
+
+
+def async_api_view(methods):
+    """
+    csrf_exempt and require_http_methods for async views. Django before 5.0
+    wraps views in sync functions in those decorators, which would hide the
+    coroutine from the request handler.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapped_view(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        wrapped_view.csrf_exempt = True
+        return wrapped_view
+    return decorator
+
+
+# Token verification is mostly local, but can fetch certificates; run it off
+# the event loop without serializing requests on one thread
+Averify_auth_token = sync_to_async(verify_auth_token, thread_sensitive=False)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def register(request):
@@ -92,8 +151,15 @@ def user_login(request):
     
     decoded_token = verify_firebase_token(id_token)
     if decoded_token:
-        # Here you might want to create a session or generate a JWT
-        return JsonResponse({'success': True, 'message': 'Login successful', 'uid': decoded_token['uid']})
+        response = {'success': True, 'message': 'Login successful', 'uid': decoded_token['uid']}
+        # Issue a short-lived session token so later calls can skip Firebase verification.
+        # Without SESSION_TOKEN_SECRET clients keep sending their Firebase ID token
+        if session_tokens_enabled():
+            user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+            session_token, expires_at = issue_session_token(user_id, decoded_token['uid'], decoded_token['email'])
+            response['sessionToken'] = session_token
+            response['sessionExpiresAt'] = expires_at
+        return JsonResponse(response)
     else:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
 
@@ -101,14 +167,21 @@ def user_login(request):
 @require_http_methods(["POST"])
 def user_logout(request):
     # Firebase handles token invalidation on the client-side
-    # Here you would typically clear any server-side session if you're using one
+    # Server-issued session tokens are added to the shared denylist until they expire
+    session_token = request.headers.get('Authorization')
+    if session_token:
+        try:
+            revoke_session_token(session_token)
+        except Exception as e:
+            print(f"Error revoking session token: {str(e)}")
+            return JsonResponse({'success': False, 'error': str(e)}, status=500)
     return JsonResponse({'success': True, 'message': 'Logout successful'})
 
 @require_http_methods(["GET"])
 def check_auth(request):
     id_token = request.headers.get('Authorization')
     if id_token:
-        decoded_token = verify_firebase_token(id_token)
+        decoded_token = verify_auth_token(id_token)
         if decoded_token:
             return JsonResponse({'success': True, 'message': 'Authentication valid', 'uid': decoded_token['uid']})
     return JsonResponse({'success': False, 'error': 'Authentication invalid'}, status=401)
@@ -123,7 +196,7 @@ def firebase_login(request):
 def protected_view(request):
     id_token = request.headers.get('Authorization')
     if id_token:
-        decoded_token = verify_firebase_token(id_token)
+        decoded_token = verify_auth_token(id_token)
         if decoded_token:
             return JsonResponse({'success': True, 'message': 'This is a protected view', 'uid': decoded_token['uid']})
     return JsonResponse({'success': False, 'error': 'Unauthorized'}, status=401)
@@ -171,6 +244,20 @@ def google_login(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def chat(request):
+    """
+    Chat endpoint with a fast path: plain "run <function> with <arguments>"
+    messages are executed directly, everything else goes to the agent
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
     data = json.loads(request.body)
     user_message = data.get('message')
 
@@ -179,57 +266,116 @@ def chat(request):
 
     try:
         # Process the message
-        response = process_message(user_message)
-        return JsonResponse(response)
+        response = process_message(user_id, user_message)
+        return JsonResponse({**response, 'status': 'success', 'user_id': user_id})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-def process_message(message):
+def process_message(user_id, message):
     # Analyze the message to understand the user's intent
     intent = analyze_intent(message)
 
-    # Perform vector search if needed
-    search_results = perform_vector_search(message)
+    # Resolve the function the message refers to
+    search_results = perform_vector_search(user_id, intent)
 
     # Determine the appropriate action based on intent and search results
     action = determine_action(intent, search_results)
+    if action['type'] == 'agent':
+        print(f"Fast path declined ({action['reason']}), using the agent")
+        return {'response': run_sync(run_agent_turn(user_id, message)), 'route': 'agent'}
 
     # Execute the determined action
-    action_result = execute_action(action)
+    action_result = execute_action(user_id, action)
 
     # Generate a response based on the action result
     response = generate_response(action_result)
-
+    
+    # Keep the turn in the conversation so a later agent turn can refer to it
+    chat_history = get_or_create_chat_history(user_id)
+    chat_history.add_user_message(message)
+    chat_history.add_ai_message(response['response'])
     return response
 
 def analyze_intent(message):
-    # Placeholder for intent analysis implementation
-    print(f"Analyzing intent for: {message}")
-    return {"intent": "Placeholder intent"}
+    """Classify a message locally, only plain run commands skip the agent"""
+    command = parse_run_command(message)
+    if command is None:
+        return {"intent": "agent"}
+    return {"intent": "run", **command}
+
+def perform_vector_search(user_id, intent):
+    """
+    Find the library function a run command names, by name first and by
+    embedding similarity to the indexed descriptions otherwise
+    """
+    if intent['intent'] != 'run':
+        return {"function": None}
+    
+    functions = get_cached_user_library(user_id)
+    function = match_function_name(intent['function_name'], functions)
+    if function is not None:
+        return {"function": function, "match": "name"}
+    if not allows_similarity_match(intent):
+        return {"function": None}
+    
+    search = search_vector_store(user_id, intent['function_name'], limit=2, score_threshold=FAST_PATH_MIN_SCORE)
+    results = search.get('results', [])
+    if not is_confident_match(results):
+        return {"function": None}
+    # Resolved by ID, names need not be unique within a library
+    function = find_library_function(functions, results[0]['function_id'])
+    return {"function": function, "match": "embedding", "score": results[0]['score']}
 
-def perform_vector_search(query):
-    # Placeholder for vector search implementation
-    print(f"Performing vector search for: {query}")
-    return {"relevantInfo": "Placeholder relevant information"}
 
-def determine_action(intent, search_results):
-    # Placeholder for action determination logic
-    print(f"Determining action for intent: {intent} and search results: {search_results}")
-    return {"type": "placeholderAction", "params": {}}
+def find_library_function(functions, function_id):
+    """The function with function_id in a list of library functions, None if it is not there"""
+    return next((function for function in functions if function['id'] == function_id), None)
 
-def execute_action(action):
-    # Placeholder for action execution implementation
-    print(f"Executing action: {action}")
-    return {"result": "Placeholder action result"}
+def execute_action(user_id, action):
+    return run_function_call(user_id, action['function'], action['call'], action['parameters'])
+
+def run_function_call(user_id, function, call, parameters, session=None):
+    """
+    Run a library function with a call expression and record the execution.
+    Uses a fresh REPL session unless one is given.
+    """
+    code = f"{function['code']}\n\n{call}"
+    execution = python_repl_tool.execute(code, session or python_repl_tool.new_session())
+    result = execution['output']
+    status = 'success' if execution['success'] else 'error'
+    execution_id = save_function_execution(
+        function_name=function.get('name'),
+        parameters=json.dumps(parameters, default=str),
+        code=code,
+        result=result,
+        user_id=user_id,
+        status=status
+    )
+    return {
+        "function_name": function.get('name'),
+        "call": call,
+        "result": result,
+        "status": status,
+        "execution_id": execution_id
+    }
 
 def generate_response(action_result):
-    # Placeholder for response generation logic
-    print(f"Generating response for action result: {action_result}")
-    return {"message": "Placeholder response message"}
+    if action_result['status'] == 'error':
+        message = f"{action_result['call']} failed:\n{action_result['result']}"
+    else:
+        message = action_result['result'] or f"{action_result['call']} finished with no output"
+    return {
+        "response": message,
+        "route": "fast_path",
+        "function_name": action_result['function_name'],
+        "execution_id": action_result['execution_id'],
+        "execution_status": action_result['status']
+    }
 
 def save_user_data(user_id, user_data):
     try:
         db.collection('users').document(user_id).set(user_data, merge=True)
+        user_profiles.invalidate(user_id)
         return True
     except Exception as e:
         print(f"Error saving user data: {str(e)}")
@@ -242,86 +388,99 @@ def get_user_data(request):
     if not id_token:
         return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
-    decoded_token = verify_firebase_token(id_token)
+    decoded_token = verify_auth_token(id_token)
     if not decoded_token:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
     
     user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
     
     try:
-        doc_ref = db.collection('users').document(user_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            return JsonResponse({'success': True, 'data': doc.to_dict()})
+        user_data = user_profiles.get(user_id, lambda: load_user_profile(user_id))
+        if user_data is not None:
+            return JsonResponse({'success': True, 'data': user_data})
         else:
             return JsonResponse({'success': False, 'error': 'User data not found'}, status=404)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
-def init_qdrant_collection():
-    try:
-        collections = qdrant_client.get_collections().collections
-        collection_names = [collection.name for collection in collections]
-        
-        if "function_descriptions" not in collection_names:
-            qdrant_client.create_collection(
-                collection_name="function_descriptions",
-                vectors_config={
-                    "size": 1536,  
-                    "distance": "Cosine"
-                }
-            )
-            
-            qdrant_client.create_payload_index(
-                collection_name="function_descriptions",
-                field_name="userId",
-                field_schema="keyword"
-            )
-            
-            
-        return True
-    except Exception as e:
-        print(f"Error initializing Qdrant collection: {str(e)}")
-        return False
+def load_user_profile(user_id):
+    """Read the users document, returns None if it does not exist"""
+    doc = db.collection('users').document(user_id).get()
+    return doc.to_dict() if doc.exists else None
+
 
-def find_existing_function(user_id, function_name):
+def load_user_library(user_id):
     """
-    Helper function to find existing function in Qdrant by userId and function_name
+    Read every function document owned by the user, with the library version
+    read just before them
     """
-    try:
-        search_result = qdrant_client.scroll(
-            collection_name="function_descriptions",
-            scroll_filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="userId",
-                        match={"value": user_id}
-                    ),
-                    models.FieldCondition(
-                        key="function_name",
-                        match={"value": function_name}
-                    )
-                ]
-            ),
-            limit=1
-        )
-        
-        points = search_result[0]  
-        if points:
-            return points[0]  
-        return None
-    except Exception as e:
-        print(f"Error finding existing function: {str(e)}")
-        return None
+    version = library_versions.get(user_id)
+    docs = db.collection('functions').where('userId', '==', user_id).stream()
+    functions = resolve_function_references([{'id': doc.id, **doc.to_dict()} for doc in docs])
+    return {'version': version, 'functions': functions}
 
-def save_function_description(function, userId, name):
-    try:
-        init_qdrant_collection()
-        
-       
+
+def resolve_function_references(functions, fields=None):
+    """
+    Fill in library references with the content of their original functions.
+    
+    All originals are fetched with a single get_all call.
+    
+    Args:
+        functions: List of function dictionaries, modified in place
+        fields: Restrict the copied fields to these (defaults to all reference fields)
         
-        function_text = function
-        prompt = f"""Analyze this Python function and provide a clear, detailed description of:
+    Returns:
+        The same list of functions
+    """
+    original_ids = original_function_ids(functions)
+    if not original_ids:
+        return functions
+    
+    original_refs = [db.collection('functions').document(original_id) for original_id in original_ids]
+    originals = {doc.id: doc.to_dict() for doc in db.get_all(original_refs) if doc.exists}
+    return apply_function_references(functions, originals, fields)
+
+
+def get_cached_user_library(user_id):
+    """
+    Return the user's functions through the per-user read-through cache.
+    
+    The list is copied so callers can modify it freely.
+    """
+    return get_versioned_user_library(user_id)[0]
+
+
+def get_versioned_user_library(user_id):
+    """
+    Return the user's functions through the per-user read-through cache,
+    together with the library version they were read at
+    """
+    library = user_libraries.get(user_id, lambda: load_user_library(user_id))
+    return [dict(function) for function in library['functions']], library['version']
+
+
+def invalidate_user_library(user_id):
+    """
+    Drop the cached library and bump its shared version after a write to it.
+    
+    The shared bump is coalesced with the other writes to the library in the
+    next LIBRARY_VERSION_BUMP_DELAY seconds, e.g. a save and its indexing job.
+    """
+    user_libraries.invalidate(user_id)
+    library_versions.bump_soon(user_id)
+
+
+def init_qdrant_collection():
+    """
+    Bootstrap the Qdrant collection, a no-op after the first successful call.
+    Raises ImproperlyConfigured if the live collection has a different schema.
+    """
+    ensure_qdrant_collection(qdrant_client)
+    return True
+
+def build_description_prompt(function_text):
+    return f"""Analyze this Python function and provide a clear, detailed description of:
         1. What the function does
         2. Its parameters and return values
         3. Any key logic or algorithms used
@@ -329,44 +488,108 @@ def save_function_description(function, userId, name):
         Function:
         {function_text}
         """
+
+def code_hash(code):
+    """Hash of the code with line endings and trailing whitespace normalized"""
+    lines = (code or '').replace('\r\n', '\n').split('\n')
+    normalized = '\n'.join(line.rstrip() for line in lines).strip()
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def get_function_visibility(function_id):
+    """Current visibility of a function document, None if it no longer exists"""
+    function_doc = db.collection('functions').document(function_id).get(field_paths=['isPublic'])
+    return bool(function_doc.to_dict().get('isPublic')) if function_doc.exists else None
+
+
+def save_function_description(function, userId, name, function_id, indexed=None):
+    """
+    Describe a function with the LLM and index the description in Qdrant.
+    
+    The point ID is derived from the function document ID, so the point is
+    written with a single upsert and no prior lookup.
+    
+    Args:
+        function: The function code
+        userId: The ID of the user owning the function
+        name: The function name
+        function_id: The Firestore ID of the function document
+        indexed: The stored function document before this save, used to skip
+            regeneration when its index was built from the same code and models
+    """
+    try:
+        init_qdrant_collection()
+        
+        point_id = function_point_id(function_id)
+        function_hash = code_hash(function)
+        timestamp = datetime.datetime.now().isoformat()
+        # Read at index time so a visibility toggle made while the job was
+        # queued is not overwritten
+        is_public = get_function_visibility(function_id)
+        if is_public is None:
+            # Deleted while the job was queued, there is nothing to index
+            return {"success": True, "id": point_id, "deleted": True}
+        
+        if (indexed
+                and indexed.get('indexingStatus') == INDEXING_INDEXED
+                and indexed.get('codeHash') == function_hash
+                and indexed.get('indexVersion') == DESCRIPTION_INDEX_VERSION):
+            # Code and models unchanged, the description and vector are still valid
+            try:
+                patch = {"function_name": name, "isPublic": is_public, "timestamp": timestamp}
+                qdrant_client.set_payload(
+                    collection_name=QDRANT_COLLECTION,
+                    payload=patch,
+                    points=[point_id]
+                )
+                local_index.set_payload(userId, point_id, patch)
+                reference_points_queue.submit(function_id, function_id)
+                return {
+                    "success": True,
+                    "id": point_id,
+                    "regenerated": False
+                }
+            except Exception as e:
+                # e.g. a point not yet migrated to its deterministic ID
+                print(f"Error patching function payload, regenerating: {str(e)}")
         
-        description = llm.invoke(prompt).content
+        description = llm.invoke(build_description_prompt(function)).content
         embedding_vector = embeddings.embed_query(description)
         
-        existing_function = find_existing_function(userId, name)
+        # The LLM call takes seconds, a delete handled by another worker in the
+        # meantime must not be undone by the upsert
+        is_public = get_function_visibility(function_id)
+        if is_public is None:
+            return {"success": True, "id": point_id, "deleted": True}
         
         payload = {
             "description": description,
             "function_name": name,
+            "function_id": function_id,
             "userId": userId,
-            "timestamp": datetime.datetime.now().isoformat()
+            "isPublic": is_public,
+            "code_hash": function_hash,
+            "index_version": DESCRIPTION_INDEX_VERSION,
+            "timestamp": timestamp
         }
         
-        if existing_function:
-            point_id = existing_function.id
-            qdrant_client.upsert(
-                collection_name="function_descriptions",
-                points=[{
-                    "id": point_id,
-                    "vector": embedding_vector,
-                    "payload": payload
-                }]
-            )
-        else:
-            point_id = str(uuid.uuid4())
-            qdrant_client.upsert(
-                collection_name="function_descriptions",
-                points=[{
-                    "id": point_id,
-                    "vector": embedding_vector,
-                    "payload": payload
-                }]
-            )
+        qdrant_client.upsert(
+            collection_name=QDRANT_COLLECTION,
+            points=[{
+                "id": point_id,
+                "vector": embedding_vector,
+                "payload": payload
+            }]
+        )
+        local_index.upsert(userId, point_id, embedding_vector, payload)
+        # Library references hold a copy of this point
+        reference_points_queue.submit(function_id, function_id)
         
         return {
             "success": True,
             "description": description,
-            "id": point_id
+            "id": point_id,
+            "regenerated": True
         }
         
     except Exception as e:
@@ -376,6 +599,66 @@ def save_function_description(function, userId, name):
             "error": str(e)
         }
 
+def update_indexing_status(key, status, error):
+    """Record the outcome of a background indexing job on the function document"""
+    user_id, function_id = key
+    try:
+        db.collection('functions').document(function_id).update({
+            'indexingStatus': status,
+            'indexingError': error,
+            'indexedAt': firestore.SERVER_TIMESTAMP
+        })
+    except NotFound:
+        # The function was deleted while it was being indexed
+        return
+    invalidate_user_library(user_id)
+
+
+# Descriptions are generated and indexed in the background after a save commits
+indexing_queue = IndexingQueue(save_function_description, update_indexing_status)
+
+
+def requeue_stale_indexing(function_doc):
+    """
+    Resubmit a function whose indexing job was lost, e.g. with the worker
+    instance that held it in memory.
+    
+    Args:
+        function_doc: The function document snapshot, with the indexing
+            timestamps, code, name and reference fields
+    
+    Returns:
+        The future of the requeued job, or None if the function is not stale
+        or another worker requeued it first
+    """
+    function_data = function_doc.to_dict()
+    user_id = function_data.get('userId')
+    key = (user_id, function_doc.id)
+    if not is_indexing_stale(function_data) or indexing_queue.is_queued(key):
+        return None
+    
+    code, name = function_data.get('code'), function_data.get('name')
+    if function_data.get('isReference'):
+        original_doc = db.collection('functions').document(function_data.get('originalFunctionId')).get()
+        original = original_doc.to_dict() if original_doc.exists else None
+        if not original or not original.get('isPublic', False):
+            update_indexing_status(key, INDEXING_FAILED, 'The original function is no longer available')
+            return None
+        code, name = original.get('code'), original.get('name')
+    
+    try:
+        # Conditional on the snapshot, so only one of the workers reading the
+        # stale document requeues it
+        function_doc.reference.update(
+            {'indexingRequestedAt': firestore.SERVER_TIMESTAMP},
+            option=db.write_option(last_update_time=function_doc.update_time)
+        )
+    except (FailedPrecondition, NotFound):
+        return None
+    print(f"Requeueing stale indexing job for function {function_doc.id}")
+    return indexing_queue.submit(key, code, user_id, name, function_doc.id)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def save_user_function(request):
@@ -383,7 +666,7 @@ def save_user_function(request):
     if not id_token:
         return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
-    decoded_token = verify_firebase_token(id_token)
+    decoded_token = verify_auth_token(id_token)
     if not decoded_token:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
     
@@ -400,8 +683,13 @@ def save_user_function(request):
             'code': data.get('code'),
             'language': data.get('language'),
             'isPublic': data.get('isPublic'),
+            'codeHash': code_hash(data.get('code')),
+            'indexVersion': DESCRIPTION_INDEX_VERSION,
+            'indexingStatus': INDEXING_PENDING,
+            'indexingRequestedAt': firestore.SERVER_TIMESTAMP,
             'updatedAt': firestore.SERVER_TIMESTAMP
         }
+        indexed = None
         
         if function_id:
             # Check if the function exists and belongs to the user
@@ -420,22 +708,48 @@ def save_user_function(request):
                     'error': 'Unauthorized to modify this function'
                 }, status=403)
             
+            if doc.to_dict().get('isReference'):
+                # First edit of a library reference turns it into a private copy
+                function_data['isReference'] = False
+            
             # Update existing document
             doc_ref.update(function_data)
+            stored_data = {**doc.to_dict(), **function_data}
+            indexed = doc.to_dict()
         else:
             # Create new document
             function_data['createdAt'] = firestore.SERVER_TIMESTAMP
             doc_ref = db.collection('functions').document()  # Generate new ID
             function_id = doc_ref.id  # Get the ID before saving
             doc_ref.set(function_data)  # Use set instead of add
+            stored_data = function_data
         
-        # Save function description
-        res = save_function_description(data.get('code'), user_id, data.get('name'))
+        invalidate_user_library(user_id)
+        
+        # Keep the public catalog in step with the saved document
+        if stored_data.get('isPublic'):
+            public_catalog.upsert(function_id, stored_data)
+        else:
+            public_catalog.remove(function_id)
+        if indexed is not None and bool(indexed.get('isPublic')) != bool(stored_data.get('isPublic')):
+            # The existing point is searchable until the job re-indexes it
+            sync_function_visibility(user_id, function_id, bool(stored_data.get('isPublic')))
+        
+        # Describe and index the function in the background
+        indexing_queue.submit(
+            (user_id, function_id),
+            data.get('code'),
+            user_id,
+            data.get('name'),
+            function_id,
+            indexed=indexed
+        )
         
         return JsonResponse({
             'success': True,
             'message': 'Function saved successfully',
-            'id': function_id
+            'id': function_id,
+            'indexingStatus': INDEXING_PENDING
         })
     except json.JSONDecodeError:
         return JsonResponse({
@@ -451,147 +765,557 @@ def save_user_function(request):
     
 
 
+# Fields that can be requested through the fields= projection
+FUNCTION_FIELDS = ('name', 'description', 'code', 'language', 'isPublic', 'createdAt', 'updatedAt', 'originalFunctionId')
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
-def get_user_functions(request):
+def get_indexing_status(request):
+    """
+    Poll the indexing status of a saved function (pending, indexed or failed).
+    
+    A function left pending by a job that was lost with its worker is
+    requeued when it is polled.
+    """
     id_token = request.headers.get('Authorization')
     if not id_token:
         return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
-    decoded_token = verify_firebase_token(id_token)
+    decoded_token = verify_auth_token(id_token)
     if not decoded_token:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
     
     user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
     
-    try:
-        functions_ref = db.collection('functions').where('userId', '==', user_id)
-        docs = functions_ref.stream()
-        functions = [{'id': doc.id, **doc.to_dict()} for doc in docs]
-        return JsonResponse({'success': True, 'functions': functions})
-    except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+    function_id = request.GET.get('functionId')
+    if not function_id:
+        return JsonResponse({'success': False, 'error': 'Function ID is required'}, status=400)
     
-
-def delete_function_from_qdrant(user_id, function_name):
-    """
-    Delete function vector from Qdrant
-    Returns True if successful, False otherwise
-    """
     try:
-        existing_function = find_existing_function(user_id, function_name)
+        function_doc = db.collection('functions').document(function_id).get(
+            field_paths=['userId', 'indexingStatus', 'indexingError', 'indexedAt', 'indexingRequestedAt',
+                         'updatedAt', 'code', 'name', 'isReference', 'originalFunctionId']
+        )
+        if not function_doc.exists:
+            return JsonResponse({'success': False, 'error': 'Function not found'}, status=404)
         
-        if existing_function:
-            qdrant_client.delete(
-                collection_name="function_descriptions",
-                points_selector=models.PointIdsList(
-                    points=[existing_function.id]
-                )
-            )
-            return True
-        return False
+        function_data = function_doc.to_dict()
+        if function_data.get('userId') != user_id:
+            return JsonResponse({'success': False, 'error': 'Unauthorized to view this function'}, status=403)
+        
+        # Still reported as pending, the next poll sees the requeued job's outcome
+        requeue_stale_indexing(function_doc)
+        
+        return JsonResponse({
+            'success': True,
+            'indexingStatus': function_data.get('indexingStatus'),
+            'indexingError': function_data.get('indexingError'),
+            'indexedAt': function_data.get('indexedAt')
+        })
     except Exception as e:
-        print(f"Error deleting function from Qdrant: {str(e)}")
-        return False
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
 
 @csrf_exempt
-@require_http_methods(["POST"])
-def delete_user_function(request):
-    """
-    Delete a function and its associated vector from both Firebase and Qdrant
-    """
+@require_http_methods(["GET"])
+def get_user_functions(request):
     id_token = request.headers.get('Authorization')
-
     if not id_token:
         return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
-    decoded_token = verify_firebase_token(id_token)
+    decoded_token = verify_auth_token(id_token)
     if not decoded_token:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
     
     user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
     
-    data = json.loads(request.body)
-    function_id = data.get('functionId')
+    # Pagination and projection are opt-in so existing clients keep getting the full list
+    paginate = 'page_size' in request.GET or 'cursor' in request.GET
+    try:
+        page_size = parse_page_size(request.GET.get('page_size'))
+        fields = parse_fields(request.GET.get('fields'), FUNCTION_FIELDS)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
     
     try:
-        doc_ref = db.collection('functions').document(function_id)
-        function_doc = doc_ref.get()
-        
-        if not function_doc.exists:
-            return JsonResponse({
-                'success': False,
-                'error': 'Function not found'
-            }, status=404)
-        
-        function_data = function_doc.to_dict()
-        if function_data.get('userId') != user_id:
+        if not paginate:
+            functions, library_version = get_versioned_user_library(user_id)
+            if fields:
+                functions = [
+                    {key: value for key, value in function.items() if key == 'id' or key in fields}
+                    for function in functions
+                ]
             return JsonResponse({
-                'success': False,
-                'error': 'Unauthorized to delete this function'
-            }, status=403)
+                'success': True,
+                'functions': functions,
+                'libraryVersion': library_version
+            })
         
-        qdrant_deleted = delete_function_from_qdrant(
-            user_id=user_id,
-            function_name=function_data.get('name')
+        library_version = library_versions.get(user_id)
+        # Every save sets updatedAt, functions saved before it did are
+        # backfilled by the backfill_updated_at command
+        functions_ref = db.collection('functions').where('userId', '==', user_id)
+        if fields:
+            # updatedAt is always needed to build the next cursor, the reference
+            # fields to resolve library references
+            functions_ref = functions_ref.select(fields + ['updatedAt', 'isReference', 'originalFunctionId'])
+        
+        docs, next_cursor = paginate_query(
+            functions_ref,
+            db.collection('functions'),
+            'updatedAt',
+            page_size,
+            cursor=request.GET.get('cursor')
         )
-        
-        doc_ref.delete()
-        
+        functions = [{'id': doc.id, **doc.to_dict()} for doc in docs]
+        resolve_function_references(functions, fields)
         return JsonResponse({
             'success': True,
-            'message': 'Function deleted successfully',
-            'qdrant_deleted': qdrant_deleted
+            'functions': functions,
+            'nextCursor': next_cursor,
+            'libraryVersion': library_version
         })
-        
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
     except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'error': str(e)
-        }, status=500)
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def save_user_data_api(request):
-    data = json.loads(request.body)
-    firstName = data.get('firstName')
-    lastName = data.get('lastName')
-    id_token = request.headers.get('Authorization')
-    try:
-        if not id_token:
-            return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
-        
-        decoded_token = verify_firebase_token(id_token)
-        if not decoded_token:
-            return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
-        
-        user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
-        print(f"Saving user data for {user_id}")
-        
-        save_user_data(user_id,{'firstName': firstName, 'lastName': lastName, 'email': decoded_token['email']})
-        return JsonResponse({'success': True, 'message': 'User data saved successfully'})
-    except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)}, status=400)
-    
+@async_api_view(["GET"])
+async def Aget_user_functions(request):
+    """Async version of get_user_functions, served when ASYNC_VIEWS is enabled"""
+    paginate = 'page_size' in request.GET or 'cursor' in request.GET
+    if paginate:
+        # Cursor pagination has no async implementation yet
+        return await sync_to_async(get_user_functions, thread_sensitive=False)(request)
     
-
-@csrf_exempt
-@require_http_methods(["POST"])
-def toggle_function_visibility(request):
     id_token = request.headers.get('Authorization')
     if not id_token:
         return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
-    decoded_token = verify_firebase_token(id_token)
+    decoded_token = await Averify_auth_token(id_token)
     if not decoded_token:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
     
     user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
     
-    data = json.loads(request.body)
-    function_id = data.get('functionId')
-    
+    try:
+        fields = parse_fields(request.GET.get('fields'), FUNCTION_FIELDS)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        functions, library_version = await async_data.get_versioned_user_functions(user_id)
+        if fields:
+            functions = [
+                {key: value for key, value in function.items() if key == 'id' or key in fields}
+                for function in functions
+            ]
+        return JsonResponse({
+            'success': True,
+            'functions': functions,
+            'libraryVersion': library_version
+        })
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def get_user_function(request):
+    """
+    Fetch a single function with all its fields, e.g. when a list entry is opened
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    function_id = request.GET.get('functionId')
+    if not function_id:
+        return JsonResponse({'success': False, 'error': 'Function ID is required'}, status=400)
+    
+    try:
+        function_doc = db.collection('functions').document(function_id).get()
+        if not function_doc.exists:
+            return JsonResponse({'success': False, 'error': 'Function not found'}, status=404)
+        
+        function_data = function_doc.to_dict()
+        if function_data.get('userId') != user_id:
+            return JsonResponse({'success': False, 'error': 'Unauthorized to view this function'}, status=403)
+        
+        function = resolve_function_references([{'id': function_doc.id, **function_data}])[0]
+        return JsonResponse({'success': True, 'function': function})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@async_api_view(["GET"])
+async def Aget_user_function(request):
+    """Async version of get_user_function, served when ASYNC_VIEWS is enabled"""
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = await Averify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    function_id = request.GET.get('functionId')
+    if not function_id:
+        return JsonResponse({'success': False, 'error': 'Function ID is required'}, status=400)
+    
+    try:
+        function_doc = await async_data.get_firestore().collection('functions').document(function_id).get()
+        if not function_doc.exists:
+            return JsonResponse({'success': False, 'error': 'Function not found'}, status=404)
+        
+        function_data = function_doc.to_dict()
+        if function_data.get('userId') != user_id:
+            return JsonResponse({'success': False, 'error': 'Unauthorized to view this function'}, status=403)
+        
+        functions = await async_data.resolve_function_references([{'id': function_doc.id, **function_data}])
+        return JsonResponse({'success': True, 'function': functions[0]})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+    
+
+# Number of NDJSON lines committed and indexed together by bulk_import_functions
+IMPORT_CHUNK_SIZE = 100
+# Page size used by export_functions when walking the user's library
+EXPORT_PAGE_SIZE = 200
+
+
+def import_function_chunk(user_id, entries):
+    """
+    Store a chunk of imported functions and queue them for indexing.
+    
+    Firestore documents are committed in one batched write and marked pending.
+    Descriptions are generated and indexed by the background indexing queue,
+    which retries failures and records the outcome on each document, instead
+    of inside the import request.
+    
+    Args:
+        user_id: The ID of the user importing the functions
+        entries: List of parsed function dictionaries
+        
+    Returns:
+        List of the new function document IDs
+    """
+    batch = db.batch()
+    function_ids = []
+    stored_functions = []
+    for entry in entries:
+        doc_ref = db.collection('functions').document()
+        function_data = {
+            'userId': user_id,
+            'name': entry.get('name'),
+            'description': entry.get('description'),
+            'code': entry.get('code'),
+            'language': entry.get('language'),
+            'isPublic': bool(entry.get('isPublic', False)),
+            'codeHash': code_hash(entry.get('code')),
+            'indexVersion': DESCRIPTION_INDEX_VERSION,
+            'indexingStatus': INDEXING_PENDING,
+            'indexingRequestedAt': firestore.SERVER_TIMESTAMP,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }
+        batch.set(doc_ref, function_data)
+        function_ids.append(doc_ref.id)
+        stored_functions.append(function_data)
+    batch.commit()
+    invalidate_user_library(user_id)
+    
+    for function_id, function_data in zip(function_ids, stored_functions):
+        if function_data['isPublic']:
+            public_catalog.upsert(function_id, function_data)
+        # Jobs lost with this worker are picked up by requeue_stale_indexing
+        indexing_queue.submit(
+            (user_id, function_id),
+            function_data['code'],
+            user_id,
+            function_data['name'],
+            function_id
+        )
+    
+    return function_ids
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def bulk_import_functions(request):
+    """
+    Import functions from an NDJSON request body, one function object per line
+    with name, code and optionally description, language and isPublic
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    function_ids = []
+    errors = []
+    chunk = []
+    try:
+        # Read the body line by line instead of loading it all at once
+        for line_number, line in enumerate(request, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                errors.append({'line': line_number, 'error': 'Invalid JSON'})
+                continue
+            if not isinstance(entry, dict) or not entry.get('name') or not entry.get('code'):
+                errors.append({'line': line_number, 'error': 'name and code are required'})
+                continue
+            
+            chunk.append(entry)
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                function_ids.extend(import_function_chunk(user_id, chunk))
+                chunk = []
+        
+        if chunk:
+            function_ids.extend(import_function_chunk(user_id, chunk))
+        
+        return JsonResponse({
+            'success': True,
+            'imported': len(function_ids),
+            'functionIds': function_ids,
+            'indexingStatus': INDEXING_PENDING,
+            'errors': errors
+        })
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'imported': len(function_ids),
+            'functionIds': function_ids,
+            'errors': errors
+        }, status=500)
+
+
+def iter_exported_functions(user_id):
+    """Yield the user's functions as NDJSON lines, one Firestore page at a time"""
+    query = db.collection('functions').where('userId', '==', user_id).order_by(
+        firestore.FieldPath.document_id()
+    ).limit(EXPORT_PAGE_SIZE)
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc else query
+        docs = list(page.stream())
+        functions = resolve_function_references([{'id': doc.id, **doc.to_dict()} for doc in docs])
+        for function_data in functions:
+            function_data.pop('userId', None)
+            yield json.dumps(function_data, cls=DjangoJSONEncoder) + '\n'
+        if len(docs) < EXPORT_PAGE_SIZE:
+            return
+        last_doc = docs[-1]
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def export_functions(request):
+    """
+    Stream the user's whole library as NDJSON
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    response = StreamingHttpResponse(iter_exported_functions(user_id), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="functions.ndjson"'
+    return response
+
+
+@async_api_view(["GET"])
+async def Aexport_functions(request):
+    """
+    Async version of export_functions, served when ASYNC_VIEWS is enabled.
+    ASGI iterates a streaming response on the event loop, so the blocking
+    Firestore pages are read on worker threads.
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = await Averify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    response = StreamingHttpResponse(
+        iterate_in_thread(iter_exported_functions(user_id)),
+        content_type='application/x-ndjson'
+    )
+    response['Content-Disposition'] = 'attachment; filename="functions.ndjson"'
+    return response
+    
+
+def sync_function_visibility(user_id, function_id, is_public):
+    """
+    Mirror a visibility change onto the function's Qdrant point and the
+    points of its library references. A point that is not indexed yet picks
+    the visibility up when its indexing job runs.
+    """
+    point_id = function_point_id(function_id)
+    try:
+        qdrant_client.set_payload(
+            collection_name=QDRANT_COLLECTION,
+            payload={"isPublic": is_public},
+            points=[point_id]
+        )
+        local_index.set_payload(user_id, point_id, {"isPublic": is_public})
+    except Exception as e:
+        print(f"Error syncing function visibility to Qdrant: {str(e)}")
+    reference_points_queue.submit(function_id, function_id)
+
+
+def delete_function_from_qdrant(function_id, user_id=None):
+    """
+    Delete function vector from Qdrant
+    Returns True if successful, False otherwise
+    """
+    try:
+        qdrant_client.delete(
+            collection_name=QDRANT_COLLECTION,
+            points_selector=models.PointIdsList(
+                points=[function_point_id(function_id)]
+            )
+        )
+        if user_id is not None:
+            local_index.remove(user_id, function_point_id(function_id))
+        return True
+    except Exception as e:
+        print(f"Error deleting function from Qdrant: {str(e)}")
+        return False
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def delete_user_function(request):
+    """
+    Delete a function and its associated vector from both Firebase and Qdrant
+    """
+    id_token = request.headers.get('Authorization')
+
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    data = json.loads(request.body)
+    function_id = data.get('functionId')
+    
+    try:
+        doc_ref = db.collection('functions').document(function_id)
+        function_doc = doc_ref.get()
+        
+        if not function_doc.exists:
+            return JsonResponse({
+                'success': False,
+                'error': 'Function not found'
+            }, status=404)
+        
+        function_data = function_doc.to_dict()
+        if function_data.get('userId') != user_id:
+            return JsonResponse({
+                'success': False,
+                'error': 'Unauthorized to delete this function'
+            }, status=403)
+        
+        if not function_data.get('isReference'):
+            # Adopters keep a private copy of what they added to their library
+            detach_function_references(function_id, function_data)
+        
+        # Drop queued indexing jobs and wait for a running one, so it cannot
+        # write the point back after it is deleted
+        with indexing_queue.exclusive((user_id, function_id)):
+            qdrant_deleted = delete_function_from_qdrant(function_id, user_id)
+            doc_ref.delete()
+        reference_points_queue.submit(function_id, function_id)
+        invalidate_user_library(user_id)
+        public_catalog.remove(function_id)
+        
+        return JsonResponse({
+            'success': True,
+            'message': 'Function deleted successfully',
+            'qdrant_deleted': qdrant_deleted
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def save_user_data_api(request):
+    data = json.loads(request.body)
+    firstName = data.get('firstName')
+    lastName = data.get('lastName')
+    id_token = request.headers.get('Authorization')
+    try:
+        if not id_token:
+            return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+        
+        decoded_token = verify_auth_token(id_token)
+        if not decoded_token:
+            return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+        
+        user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+        print(f"Saving user data for {user_id}")
+        
+        save_user_data(user_id,{'firstName': firstName, 'lastName': lastName, 'email': decoded_token['email']})
+        return JsonResponse({'success': True, 'message': 'User data saved successfully'})
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def toggle_function_visibility(request):
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    data = json.loads(request.body)
+    function_id = data.get('functionId')
+    
     if not function_id:
         return JsonResponse({'success': False, 'error': 'Function ID is required'}, status=400)
     
@@ -611,9 +1335,28 @@ def toggle_function_visibility(request):
         
         # Toggle the isPublic field
         new_visibility = not function_data.get('isPublic', False)
+        update_data = {'isPublic': new_visibility}
+        
+        if function_data.get('isReference'):
+            # Publishing needs the actual code, so materialize the reference first
+            function_data = resolve_function_references([function_data])[0]
+            if function_data.get('originalMissing'):
+                return JsonResponse({'success': False, 'error': 'The original function is no longer available'}, status=409)
+            update_data.update({field: function_data.get(field) for field in REFERENCE_FIELDS})
+            update_data['isReference'] = False
+        elif not new_visibility:
+            # Adopters keep a private copy of what they added to their library
+            detach_function_references(function_id, function_data)
         
         # Update the function document
-        function_ref.update({'isPublic': new_visibility})
+        function_ref.update(update_data)
+        invalidate_user_library(user_id)
+        
+        if new_visibility:
+            public_catalog.upsert(function_id, {**function_data, **update_data})
+        else:
+            public_catalog.remove(function_id)
+        sync_function_visibility(user_id, function_id, new_visibility)
         
         return JsonResponse({
             'success': True, 
@@ -627,22 +1370,349 @@ def toggle_function_visibility(request):
 @csrf_exempt
 @require_http_methods(["GET"])
 def get_public_functions(request):
+    # Without page_size/cursor the whole catalog is returned, as before
+    paginate = 'page_size' in request.GET or 'cursor' in request.GET
+    include_code = request.GET.get('include_code', 'true').lower() != 'false'
     try:
-        # Query for all public functions
-        public_functions_ref = db.collection('functions').where('isPublic', '==', True)
-        docs = public_functions_ref.stream()
+        page_size = parse_page_size(request.GET.get('page_size')) if paginate else None
+        cursor = request.GET.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        # Served from the in-process catalog, Firestore is only queried to build it
+        public_catalog.ensure_built(load_public_functions)
+        public_functions, last_key, version = public_catalog.page(
+            page_size=page_size,
+            after=after,
+            include_code=include_code
+        )
         
-        # Convert the document data to a list of dictionaries
-        public_functions = []
-        for doc in docs:
-            function_data = doc.to_dict()
-            function_data['id'] = doc.id  # Add the document ID to the function data
-            public_functions.append(function_data)
+        response = {'success': True, 'functions': public_functions, 'catalogVersion': version}
+        if paginate:
+            response['nextCursor'] = encode_cursor(*last_key) if last_key else None
+        return JsonResponse(response)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+MAX_PUBLIC_QUERY_LENGTH = 500
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def search_public_functions(request):
+    """
+    Semantic search over the public catalog, returning the top matches for
+    query instead of the whole catalog.
+
+    Every query costs an embedding call, so unlike the catalog listing the
+    search requires a signed-in user.
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    if not verify_auth_token(id_token):
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    query = (request.GET.get('query') or '').strip()
+    include_code = request.GET.get('include_code', 'true').lower() != 'false'
+    if not query:
+        return JsonResponse({'success': False, 'error': 'Query is required'}, status=400)
+    if len(query) > MAX_PUBLIC_QUERY_LENGTH:
+        return JsonResponse({'success': False, 'error': 'Query is too long'}, status=400)
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be an integer'}, status=400)
+    if not 1 <= limit <= 50:
+        return JsonResponse({'success': False, 'error': 'limit must be between 1 and 50'}, status=400)
+    
+    try:
+        query_vector = embeddings.embed_query(query)
+        search_results = qdrant_client.search(
+            collection_name=QDRANT_COLLECTION,
+            query_vector=query_vector,
+            query_filter=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="isPublic",
+                        match=models.MatchValue(value=True)
+                    )
+                ]
+            ),
+            limit=limit
+        )
+        
+        # The catalog is the source of truth for visibility, hits it no longer
+        # lists are dropped
+        public_catalog.ensure_built(load_public_functions)
+        scores = {result.payload.get('function_id'): result.score for result in search_results}
+        functions = public_catalog.get_many(list(scores), include_code=include_code)
+        for function in functions:
+            function['score'] = scores[function['id']]
         
-        return JsonResponse({'success': True, 'functions': public_functions})
+        return JsonResponse({'success': True, 'functions': functions, 'count': len(functions)})
     except Exception as e:
+        print(f"Error in public function search: {str(e)}")
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
+
+def load_public_functions():
+    """Query Firestore for every public function, used to (re)build the catalog"""
+    public_functions_ref = db.collection('functions').where('isPublic', '==', True)
+    for doc in public_functions_ref.stream():
+        function_data = doc.to_dict()
+        function_data['id'] = doc.id  # Add the document ID to the function data
+        yield doc.id, function_data
+
+def reference_point_payload(original_payload, function_id, user_id, is_public):
+    """Payload of a library reference's copy of the original's point, without its timestamp"""
+    payload = {key: value for key, value in original_payload.items() if key != 'timestamp'}
+    return {**payload, "function_id": function_id, "userId": user_id, "isPublic": is_public}
+
+
+def copy_function_point(original_function_id, user_id, function_id):
+    """
+    Index an adopted function by copying the vector and description of the
+    original's Qdrant point, without an LLM or embedding call.
+    
+    Returns:
+        True if the point was copied, False if the original is not indexed
+        or the copy failed
+    """
+    try:
+        original_points = qdrant_client.retrieve(
+            collection_name=QDRANT_COLLECTION,
+            ids=[function_point_id(original_function_id)],
+            with_payload=True,
+            with_vectors=True
+        )
+        if not original_points:
+            return False
+        original = original_points[0]
+        
+        point_id = function_point_id(function_id)
+        payload = {
+            **reference_point_payload(original.payload, function_id, user_id, False),
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+        qdrant_client.upsert(
+            collection_name=QDRANT_COLLECTION,
+            points=[{
+                "id": point_id,
+                "vector": original.vector,
+                "payload": payload
+            }]
+        )
+        local_index.upsert(user_id, point_id, original.vector, payload)
+        
+        # Record what the copied vector was built from, so a first edit that
+        # keeps the code does not regenerate it. The caller invalidates the
+        # library once for the reference and its indexing status.
+        try:
+            db.collection('functions').document(function_id).update({
+                'codeHash': payload.get('code_hash'),
+                'indexVersion': payload.get('index_version'),
+                'indexingStatus': INDEXING_INDEXED,
+                'indexingError': None,
+                'indexedAt': firestore.SERVER_TIMESTAMP
+            })
+        except NotFound:
+            # The adopted function was deleted meanwhile, do not leave its point behind
+            delete_function_from_qdrant(function_id, user_id)
+            return False
+        return True
+    except Exception as e:
+        print(f"Error copying function point: {str(e)}")
+        return False
+
+
+def refresh_reference_points(original_function_id):
+    """
+    Bring the points of the library references to a function in line with it.
+    
+    Reference points are copies, so they are copied again after the original
+    is re-indexed or made public, and removed while it is private or deleted
+    so adopters stop finding a function they can no longer read. Visibility
+    is read when the job runs, so the latest change wins.
+    
+    References whose point already matches are left alone: there is one
+    Qdrant write and one batched Firestore write for the ones that changed,
+    however many adopters the function has.
+    """
+    try:
+        references = list(
+            db.collection('functions')
+            .where('originalFunctionId', '==', original_function_id)
+            .where('isReference', '==', True)
+            .select(['userId', 'isPublic'])
+            .stream()
+        )
+        if not references:
+            return {"success": True}
+        
+        point_ids = {reference.id: function_point_id(reference.id) for reference in references}
+        current = {
+            str(point.id): point.payload
+            for point in qdrant_client.retrieve(
+                collection_name=QDRANT_COLLECTION,
+                ids=list(point_ids.values()),
+                with_payload=True,
+                with_vectors=False
+            )
+        }
+        
+        original = None
+        if get_function_visibility(original_function_id):
+            original_points = qdrant_client.retrieve(
+                collection_name=QDRANT_COLLECTION,
+                ids=[function_point_id(original_function_id)],
+                with_payload=True,
+                with_vectors=True
+            )
+            original = original_points[0] if original_points else None
+        
+        if original is None:
+            indexed = [reference for reference in references if point_ids[reference.id] in current]
+            if indexed:
+                qdrant_client.delete(
+                    collection_name=QDRANT_COLLECTION,
+                    points_selector=models.PointIdsList(points=[point_ids[reference.id] for reference in indexed])
+                )
+                for reference in indexed:
+                    local_index.remove(reference.to_dict().get('userId'), point_ids[reference.id])
+            return {"success": True}
+        
+        timestamp = datetime.datetime.now().isoformat()
+        changed = []
+        for reference in references:
+            reference_data = reference.to_dict()
+            user_id = reference_data.get('userId')
+            payload = reference_point_payload(original.payload, reference.id, user_id,
+                                              bool(reference_data.get('isPublic')))
+            existing = current.get(point_ids[reference.id])
+            if existing is not None and {key: value for key, value in existing.items() if key != 'timestamp'} == payload:
+                continue
+            changed.append((reference, user_id, {**payload, "timestamp": timestamp}))
+        if not changed:
+            return {"success": True}
+        
+        qdrant_client.upsert(
+            collection_name=QDRANT_COLLECTION,
+            points=[
+                models.PointStruct(id=point_ids[reference.id], vector=original.vector, payload=payload)
+                for reference, _, payload in changed
+            ]
+        )
+        for reference, user_id, payload in changed:
+            local_index.upsert(user_id, point_ids[reference.id], original.vector, payload)
+        record_reference_points(changed, original.payload)
+        return {"success": True}
+    except Exception as e:
+        print(f"Error refreshing library reference points: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def record_reference_points(changed, original_payload):
+    """
+    Mark re-copied references as indexed from the original's code, in batched
+    writes. A reference deleted meanwhile fails its batch; the batch is then
+    written one by one and the deleted reference's new point removed.
+    """
+    fields = {
+        'codeHash': original_payload.get('code_hash'),
+        'indexVersion': original_payload.get('index_version'),
+        'indexingStatus': INDEXING_INDEXED,
+        'indexingError': None,
+        'indexedAt': firestore.SERVER_TIMESTAMP
+    }
+    # A Firestore batch takes at most 500 writes
+    for start in range(0, len(changed), 500):
+        chunk = changed[start:start + 500]
+        batch = db.batch()
+        for reference, _, _ in chunk:
+            batch.update(reference.reference, fields)
+        try:
+            batch.commit()
+        except NotFound:
+            for reference, user_id, _ in chunk:
+                try:
+                    reference.reference.update(fields)
+                except NotFound:
+                    delete_function_from_qdrant(reference.id, user_id)
+    for user_id in {user_id for _, user_id, _ in changed}:
+        invalidate_user_library(user_id)
+
+
+def detach_function_references(original_function_id, original_data):
+    """
+    Turn the library references to a function into private copies of its
+    current content, before its owner deletes or unpublishes it, so adopters
+    keep the function instead of an originalMissing entry.
+    
+    The copies keep the reference's point, which holds the original's vector
+    and description. References that were never indexed are queued for it.
+    
+    Returns:
+        The number of references turned into copies
+    """
+    references = list(
+        db.collection('functions')
+        .where('originalFunctionId', '==', original_function_id)
+        .where('isReference', '==', True)
+        .select(['userId', 'indexingStatus'])
+        .stream()
+    )
+    if not references:
+        return 0
+    
+    copy_data = {field: original_data.get(field) for field in REFERENCE_FIELDS}
+    copy_data.update({
+        'isReference': False,
+        'codeHash': code_hash(original_data.get('code')),
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    })
+    copied = []
+    # A Firestore batch takes at most 500 writes
+    for start in range(0, len(references), 500):
+        chunk = references[start:start + 500]
+        batch = db.batch()
+        for reference in chunk:
+            batch.update(reference.reference, copy_data)
+        try:
+            batch.commit()
+            copied.extend(chunk)
+        except NotFound:
+            # An adopter removed their reference meanwhile
+            for reference in chunk:
+                try:
+                    reference.reference.update(copy_data)
+                    copied.append(reference)
+                except NotFound:
+                    continue
+    
+    for reference in copied:
+        reference_data = reference.to_dict()
+        if reference_data.get('indexingStatus') != INDEXING_INDEXED:
+            indexing_queue.submit(
+                (reference_data.get('userId'), reference.id),
+                copy_data['code'],
+                reference_data.get('userId'),
+                copy_data['name'],
+                reference.id
+            )
+    for user_id in {reference.to_dict().get('userId') for reference in copied}:
+        invalidate_user_library(user_id)
+    return len(copied)
+
+
+# Keyed by the original's ID; the outcome is not recorded on any document
+reference_points_queue = IndexingQueue(refresh_reference_points, lambda key, status, error: None)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @csrf_exempt
@@ -654,7 +1724,7 @@ def add_public_function_to_library(request):
     if not id_token:
         return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
-    decoded_token = verify_firebase_token(id_token)
+    decoded_token = verify_auth_token(id_token)
     if not decoded_token:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
     
@@ -684,43 +1754,70 @@ def add_public_function_to_library(request):
         if function_data['userId'] == user_id:
             return JsonResponse({'success': False, 'error': 'You cannot add your own function to your library'}, status=400)
         
-        # Check if the function is already in the user's library
-        existing_function = db.collection('functions').where('userId', '==', user_id).where('originalFunctionId', '==', function_id).limit(1).get()
-        
-        if len(existing_function) > 0:
-            return JsonResponse({'success': False, 'error': 'This function is already in your library'}, status=400)
-        
-        # Create a new function document for the user
-        new_function_data = {
+        # Store a lightweight reference, the code is resolved from the original on read
+        reference_data = {
             'userId': user_id,
-            'name': function_data['name'],
-            'description': function_data['description'],
-            'code': function_data['code'],
-            'language': function_data['language'],
+            'isReference': True,
             'isPublic': False,  # Set to private by default when adding to user's library
+            'indexingStatus': INDEXING_PENDING,
+            'indexingRequestedAt': firestore.SERVER_TIMESTAMP,
             'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
             'originalFunctionId': function_id  # Reference to the original function
         }
         
-        # Add the function to the user's library
-        new_function_ref = db.collection('functions').add(new_function_data)
+        # The ID is derived from user and original, so create() fails if it is already in the library
+        new_function_ref = db.collection('functions').document(library_reference_id(user_id, function_id))
+        try:
+            new_function_ref.create(reference_data)
+        except AlreadyExists:
+            return JsonResponse({'success': False, 'error': 'This function is already in your library'}, status=400)
+        
+        # Reuse the original's description and vector so the function is searchable right away
+        copied = copy_function_point(function_id, user_id, new_function_ref.id)
+        invalidate_user_library(user_id)
+        if copied:
+            indexing_status = INDEXING_INDEXED
+        else:
+            indexing_status = INDEXING_PENDING
+            indexing_queue.submit(
+                (user_id, new_function_ref.id),
+                function_data.get('code'),
+                user_id,
+                function_data.get('name'),
+                new_function_ref.id
+            )
         
         return JsonResponse({
             'success': True, 
             'message': 'Function added to your library',
-            'newFunctionId': new_function_ref[1].id
+            'newFunctionId': new_function_ref.id,
+            'indexingStatus': indexing_status
         })
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+# Configurable values of the agent run in progress, see chat_agent
+_agent_request = contextvars.ContextVar('agent_request', default={})
+
+
+def request_context() -> Dict:
+    """
+    Per-request state (user_id, repl_session) that get_response passes to the
+    shared agent through its invocation config. Empty outside an agent run.
+    """
+    return _agent_request.get()
+
+
 class VectorSearchInput(BaseModel):
     user_id: str 
     query: str 
     limit: int 
+    score_threshold: Optional[float] = None
   
         
-async def Asearch_vector_store(user_id: str, query: str, limit: int = 5) -> Dict:
+async def Asearch_vector_store(user_id: str, query: str, limit: int = 5, score_threshold: Optional[float] = None) -> Dict:
     """
     Search the Qdrant vector store for functions matching the query, filtered by user_id
     
@@ -728,44 +1825,39 @@ async def Asearch_vector_store(user_id: str, query: str, limit: int = 5) -> Dict
         user_id: The ID of the user whose functions to search
         query: The search query or description of the function to find
         limit: Maximum number of results to return
+        score_threshold: Minimum similarity score of returned functions
         
     Returns:
         Dict containing search results and status
     """
+    # Inside an agent run the request's user wins over the model's argument
+    user_id = request_context().get('user_id', user_id)
     try:
+        # Repeated searches against an unchanged library are served from cache
+        library_version = await async_data.get_library_version(user_id)
+        cached = search_result_cache.get(user_id, query, limit, score_threshold, library_version)
+        if cached is not None:
+            return cached
+        
         # Generate embeddings for the search query
-        query_vector = embeddings.embed_query(query)
+        query_vector = await embeddings.aembed_query(query)
         
-        # Search Qdrant with user_id filter
-        search_results =await qdrant_client.search(
-            collection_name="function_descriptions",
-            query_vector=query_vector,
-            query_filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="userId",
-                        match={"value": user_id}
-                    )
-                ]
-            ),
-            limit=limit
-        )
+        # Search the local index if the user has one, Qdrant otherwise
+        index = await async_data.get_local_index(user_id)
+        if index:
+            search_results = index.search(query_vector, limit, score_threshold)
+        else:
+            search_results = await async_data.search_functions(user_id, query_vector, limit, score_threshold)
         
-        # Format results
-        formatted_results = []
-        for result in search_results:
-            formatted_results.append({
-                "function_name": result.payload.get("function_name"),
-                "description": result.payload.get("description"),
-                "score": result.score,
-                "timestamp": result.payload.get("timestamp")
-            })
+        formatted_results = format_search_results(search_results)
             
-        return {
+        result = {
             "success": True,
             "results": formatted_results,
             "count": len(formatted_results)
         }
+        search_result_cache.put(user_id, query, limit, score_threshold, result, library_version)
+        return result
         
     except Exception as e:
         print(f"Error in vector search: {str(e)}")
@@ -776,7 +1868,35 @@ async def Asearch_vector_store(user_id: str, query: str, limit: int = 5) -> Dict
         }
        
 
-def search_vector_store(user_id: str, query: str, limit: int = 5) -> Dict:
+def get_local_index(user_id):
+    """
+    Return the user's in-process vector index, loading it from Qdrant on a miss.
+    Returns False when local indexes are disabled or the library is too large.
+    """
+    if not LOCAL_INDEX_ENABLED:
+        return False
+    index = local_index.peek(user_id)
+    if index is None:
+        version = local_index.version(user_id)
+        points, _ = qdrant_client.scroll(
+            collection_name=QDRANT_COLLECTION,
+            scroll_filter=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="userId",
+                        match={"value": user_id}
+                    )
+                ]
+            ),
+            limit=local_index.max_functions + 1,
+            with_payload=True,
+            with_vectors=True
+        )
+        index = local_index.put(user_id, [(point.id, point.vector, point.payload) for point in points], version)
+    return index
+
+
+def search_vector_store(user_id: str, query: str, limit: int = 5, score_threshold: Optional[float] = None) -> Dict:
     """
     Search the Qdrant vector store for functions matching the query, filtered by user_id
     
@@ -784,44 +1904,52 @@ def search_vector_store(user_id: str, query: str, limit: int = 5) -> Dict:
         user_id: The ID of the user whose functions to search
         query: The search query or description of the function to find
         limit: Maximum number of results to return
+        score_threshold: Minimum similarity score of returned functions
         
     Returns:
         Dict containing search results and status
     """
+    # Inside an agent run the request's user wins over the model's argument
+    user_id = request_context().get('user_id', user_id)
     try:
+        # Repeated searches against an unchanged library are served from cache
+        library_version = search_result_cache.version(user_id)
+        cached = search_result_cache.get(user_id, query, limit, score_threshold, library_version)
+        if cached is not None:
+            return cached
+        
         # Generate embeddings for the search query
         query_vector = embeddings.embed_query(query)
         
-        # Search Qdrant with user_id filter
-        search_results = qdrant_client.search(
-            collection_name="function_descriptions",
-            query_vector=query_vector,
-            query_filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="userId",
-                        match={"value": user_id}
-                    )
-                ]
-            ),
-            limit=limit
-        )
+        # Search the local index if the user has one, Qdrant otherwise
+        index = get_local_index(user_id)
+        if index:
+            search_results = index.search(query_vector, limit, score_threshold)
+        else:
+            search_results = qdrant_client.search(
+                collection_name=QDRANT_COLLECTION,
+                query_vector=query_vector,
+                query_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(
+                            key="userId",
+                            match={"value": user_id}
+                        )
+                    ]
+                ),
+                limit=limit,
+                score_threshold=score_threshold
+            )
         
-        # Format results
-        formatted_results = []
-        for result in search_results:
-            formatted_results.append({
-                "function_name": result.payload.get("function_name"),
-                "description": result.payload.get("description"),
-                "score": result.score,
-                "timestamp": result.payload.get("timestamp")
-            })
+        formatted_results = format_search_results(search_results)
             
-        return {
+        result = {
             "success": True,
             "results": formatted_results,
             "count": len(formatted_results)
         }
+        search_result_cache.put(user_id, query, limit, score_threshold, result, library_version)
+        return result
         
     except Exception as e:
         print(f"Error in vector search: {str(e)}")
@@ -830,6 +1958,141 @@ def search_vector_store(user_id: str, query: str, limit: int = 5) -> Dict:
             "error": str(e),
             "results": []
         }
+
+
+MAX_SEARCH_QUERIES = 32
+
+
+def format_search_results(search_results):
+    """Shape Qdrant or local index hits the way the search tools return them"""
+    return [{
+        "function_id": result.payload.get("function_id"),
+        "function_name": result.payload.get("function_name"),
+        "description": result.payload.get("description"),
+        "score": result.score,
+        "timestamp": result.payload.get("timestamp")
+    } for result in search_results]
+
+
+def search_vector_store_batch(user_id: str, queries: List[str], limit: int = 5, score_threshold: Optional[float] = None) -> Dict:
+    """
+    Search the user's functions for several queries at once.
+    
+    Queries missing from the result cache are embedded in one embed_documents
+    call and searched in one Qdrant search_batch request.
+    
+    Args:
+        user_id: The ID of the user whose functions to search
+        queries: The search queries, results are returned in the same order
+        limit: Maximum number of results to return per query
+        score_threshold: Minimum similarity score of returned functions
+        
+    Returns:
+        Dict with one search_vector_store style result per query
+    """
+    try:
+        library_version = search_result_cache.version(user_id)
+        results = [
+            search_result_cache.get(user_id, query, limit, score_threshold, library_version)
+            for query in queries
+        ]
+        missing = [i for i, result in enumerate(results) if result is None]
+        
+        if missing:
+            query_vectors = embeddings.embed_documents([queries[i] for i in missing])
+            
+            index = get_local_index(user_id)
+            if index:
+                batch_results = [index.search(vector, limit, score_threshold) for vector in query_vectors]
+            else:
+                user_filter = models.Filter(
+                    must=[
+                        models.FieldCondition(
+                            key="userId",
+                            match={"value": user_id}
+                        )
+                    ]
+                )
+                batch_results = qdrant_client.search_batch(
+                    collection_name=QDRANT_COLLECTION,
+                    requests=[
+                        models.SearchRequest(
+                            vector=vector,
+                            filter=user_filter,
+                            limit=limit,
+                            score_threshold=score_threshold,
+                            with_payload=True
+                        )
+                        for vector in query_vectors
+                    ]
+                )
+            
+            for i, search_results in zip(missing, batch_results):
+                formatted_results = format_search_results(search_results)
+                result = {
+                    "success": True,
+                    "results": formatted_results,
+                    "count": len(formatted_results)
+                }
+                search_result_cache.put(user_id, queries[i], limit, score_threshold, result, library_version)
+                results[i] = result
+        
+        return {
+            "success": True,
+            "results": [
+                {"query": query, **result}
+                for query, result in zip(queries, results)
+            ],
+            "count": len(results)
+        }
+        
+    except Exception as e:
+        print(f"Error in batch vector search: {str(e)}")
+        return {
+            "success": False,
+            "error": str(e),
+            "results": []
+        }
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def search_user_functions(request):
+    """
+    Semantic search over the user's functions for a list of queries, with a
+    JSON body of queries and optionally limit and scoreThreshold
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            return JsonResponse({'success': False, 'error': 'Request body must be a JSON object'}, status=400)
+        queries = data.get('queries')
+        limit = int(data.get('limit', 5))
+        score_threshold = data.get('scoreThreshold')
+        if score_threshold is not None:
+            score_threshold = float(score_threshold)
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Invalid request body'}, status=400)
+    
+    if not isinstance(queries, list) or not queries or not all(isinstance(query, str) and query.strip() for query in queries):
+        return JsonResponse({'success': False, 'error': 'queries must be a non-empty list of strings'}, status=400)
+    if len(queries) > MAX_SEARCH_QUERIES:
+        return JsonResponse({'success': False, 'error': f'At most {MAX_SEARCH_QUERIES} queries per request'}, status=400)
+    if not 1 <= limit <= 50:
+        return JsonResponse({'success': False, 'error': 'limit must be between 1 and 50'}, status=400)
+    
+    result = search_vector_store_batch(user_id, queries, limit, score_threshold)
+    return JsonResponse(result, status=200 if result['success'] else 500)
       
     
 async def Aget_user_functions_firestore(user_id: str) -> List[Dict]:
@@ -842,11 +2105,9 @@ async def Aget_user_functions_firestore(user_id: str) -> List[Dict]:
     Returns:
         List of dictionaries containing function data
     """
+    user_id = request_context().get('user_id', user_id)
     try:
-        functions_ref =await db.collection('functions').where('userId', '==', user_id)
-        docs = functions_ref.stream()
-        functions = [{'id': doc.id, **doc.to_dict()} for doc in docs]
-        return functions
+        return await async_data.get_user_functions(user_id)
     except Exception as e:
         print(f"Error getting user functions: {str(e)}")
         return []  
@@ -862,11 +2123,10 @@ def get_user_functions_firestore(user_id: str) -> List[Dict]:
     Returns:
         List of dictionaries containing function data
     """
+    user_id = request_context().get('user_id', user_id)
     try:
-        functions_ref = db.collection('functions').where('userId', '==', user_id)
-        docs = functions_ref.stream()
-        functions = [{'id': doc.id, **doc.to_dict()} for doc in docs]
-        return functions
+        # Cached, the agent may call this several times in one turn
+        return get_cached_user_library(user_id)
     except Exception as e:
         print(f"Error getting user functions: {str(e)}")
         return []  
@@ -908,6 +2168,14 @@ SYSTEM_INSTRUCTIONS = """You are an AI assistant specialized in managing and exe
 - Explain function capabilities and requirements
 
 3. FUNCTION EXECUTION WORKFLOW:
+Use find_and_run to execute a function (parameters: user_id, query or function_id, args, kwargs).
+It finds the function, runs it and saves the execution history in one step, so do not call
+search_vector_store, get_user_functions_firestore, python_repl or save_function_execution
+for the same execution. If it reports missing arguments, ask the user for them using the
+returned signature; if it returns candidates, ask which one they meant and run it by its function_id.
+
+Only use the step-by-step workflow below when find_and_run cannot be used, for example
+when the function has to be combined with other code:
 a) Search Phase:
    - Use search_vector_store to find relevant functions (parameters: user_id, query, limit)
    - Analyze search results to identify the most appropriate function
@@ -996,14 +2264,16 @@ async def save_function_history(user_id: str, function_name: str, description: s
     """
     try:
         history_ref = db.collection('function_history').document()
-        await history_ref.set({
+        history_data = {
             'userId': user_id,
             'functionName': function_name,
             'description': description,
             'inputParams': input_params,
             'output': output,
-            'timestamp': datetime.now(),
-        })
+            'timestamp': datetime.datetime.now(),
+        }
+        if not execution_writer.enqueue(history_ref, history_data):
+            await async_data.set_document('function_history', history_ref.id, history_data)
     except Exception as e:
         print(f"Error saving function history: {str(e)}")
 
@@ -1018,14 +2288,14 @@ class PythonREPLTool(BaseTool):
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._globals = {}
-        self._locals = {}
+        # Builtins and safe imports are resolved once, sessions start from a copy
+        self._base_globals = {}
         
         # Handle builtins properly
         if hasattr(__builtins__, '__dict__'):
-            self._globals.update(__builtins__.__dict__)
+            self._base_globals.update(__builtins__.__dict__)
         elif isinstance(__builtins__, dict):
-            self._globals.update(__builtins__)
+            self._base_globals.update(__builtins__)
         
         safe_imports = {
             'requests': 'requests',
@@ -1045,9 +2315,17 @@ class PythonREPLTool(BaseTool):
         
         for module_name, import_as in safe_imports.items():
             try:
-                self._globals[import_as] = __import__(module_name)
+                self._base_globals[import_as] = __import__(module_name)
             except ImportError:
                 print(f"Warning: Could not import {module_name}")
+        
+        self._default_session = self.new_session()
+
+    def new_session(self) -> Dict:
+        """Fresh interpreter namespace, passed to a run as the repl_session config value"""
+        # One namespace for definitions and lookups, so functions can see
+        # their own module-level names (recursion, helpers, constants)
+        return {'globals': dict(self._base_globals)}
 
     def _sanitize_code(self, code: str) -> str:
         """Disabled sanitization for now"""
@@ -1055,52 +2333,56 @@ class PythonREPLTool(BaseTool):
     
     def _run(self, code: str) -> str:
         """Execute Python code and return the result"""
-        code = self._sanitize_code(code)
+        session = request_context().get('repl_session') or self._default_session
+        return self.run_in_session(code, session)
+    
+    def run_in_session(self, code: str, session: Dict) -> str:
+        """Execute Python code in a namespace from new_session() and return the result"""
+        return self.execute(code, session)['output']
+    
+    def execute(self, code: str, session: Dict) -> Dict:
+        """
+        Execute Python code in a namespace from new_session().
         
-        # Capture stdout
-        old_stdout = sys.stdout
-        redirected_output = sys.stdout = io.StringIO()
+        Returns:
+            Dict with success, False if the code raised, and output: the printed
+            output and the value of a trailing expression, or the error
+        """
+        code = self._sanitize_code(code)
+        namespace = session['globals']
         
-        try:
-            # Execute the code in a single compile/exec call to maintain context
-            compiled_code = compile(code, '<string>', 'exec')
-            exec(compiled_code, self._globals, self._locals)
-            
-            # Get printed output
-            printed_output = redirected_output.getvalue()
-            
-            # Get the last expression's value if it exists
-            last_value = None
+        # Only this turn's prints, other turns run concurrently in the same process
+        with capture_output() as redirected_output:
             try:
+                # A trailing expression is split off and evaluated once for its value,
+                # everything before it runs as a module
                 tree = ast.parse(code)
-                last_node = tree.body[-1] if tree.body else None
-                if isinstance(last_node, ast.Expr):
-                    last_value = eval(compile(ast.Expression(body=last_node.value),
-                                           '<string>', 'eval'),
-                                    self._globals, self._locals)
-            except:
-                pass
-            
-            # Construct the response
-            if printed_output and last_value is not None:
-                return f"{printed_output.rstrip()}\nResult: {str(last_value)}"
-            elif printed_output:
-                return printed_output.rstrip()
-            elif last_value is not None:
-                return str(last_value)
-            else:
-                return ""
+                last_node = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+                exec(compile(tree, '<string>', 'exec'), namespace)
                 
-        except Exception as e:
-            return f"Error: {str(e)}\n{traceback.format_exc()}"
-            
-        finally:
-            sys.stdout = old_stdout
+                last_value = None
+                if last_node is not None:
+                    last_value = eval(compile(ast.Expression(body=last_node.value), '<string>', 'eval'), namespace)
+            except Exception as e:
+                return {'success': False, 'output': f"Error: {str(e)}\n{traceback.format_exc()}"}
+        
+        # Construct the response from the printed output and the value
+        printed_output = redirected_output.getvalue()
+        if printed_output and last_value is not None:
+            output = f"{printed_output.rstrip()}\nResult: {str(last_value)}"
+        elif printed_output:
+            output = printed_output.rstrip()
+        elif last_value is not None:
+            output = str(last_value)
+        else:
+            output = ""
+        return {'success': True, 'output': output}
     
             
-    def _arun(self, code: str) -> str:
-        """Async version of _run"""
-        raise NotImplementedError("PythonREPLTool does not support async execution")
+    async def _arun(self, code: str) -> str:
+        """Async version of _run, executed on a worker thread"""
+        # to_thread copies the context, so request_context() still sees the run's config
+        return await asyncio.to_thread(self._run, code)
     
 
 
@@ -1180,10 +2462,11 @@ class PythonREPLTool2(BaseTool):
         """Execute Python code and return the result"""
         print("Code:", code)
        
-        # Capture stdout
-        old_stdout = sys.stdout
-        redirected_output = sys.stdout = io.StringIO()
-        
+        # Only this run's prints, other requests run concurrently in the same process
+        with capture_output() as redirected_output:
+            return self._execute(code, redirected_output)
+    
+    def _execute(self, code: str, redirected_output) -> str:
         try:
             # Execute the code
             exec_globals = self._globals  # Use instance variables
@@ -1233,9 +2516,6 @@ class PythonREPLTool2(BaseTool):
                 
         except Exception as e:
             return f"Error: {str(e)}\n{traceback.format_exc()}"
-            
-        finally:
-            sys.stdout = old_stdout
     
     
 class FormatInput(BaseModel):
@@ -1296,6 +2576,7 @@ class FunctionExecution(BaseModel):
     
 def save_function_execution(function_name: str, parameters: str,code:str, result: str, user_id: str, status: str = 'success') -> str:
     """Save function execution details to Firestore"""
+    user_id = request_context().get('user_id', user_id)
     try:
         execution_ref = db.collection('function_executions').document()
         execution_data = {
@@ -1308,7 +2589,10 @@ def save_function_execution(function_name: str, parameters: str,code:str, result
             'code': code,
             'status': status
         }
-        execution_ref.set(execution_data)
+        # Returned right away, the record is committed by the write-behind queue
+        if not execution_writer.enqueue(execution_ref, execution_data):
+            # Buffer is full, write synchronously rather than drop the record
+            execution_ref.set(execution_data)
         return execution_ref.id
     except Exception as e:
         print(f"Error saving function execution: {str(e)}")
@@ -1316,19 +2600,22 @@ def save_function_execution(function_name: str, parameters: str,code:str, result
 
 async def Asave_function_execution(function_name: str, parameters: str,code:str, result: str, user_id: str, status: str = 'success') -> str:
     """Save function execution details to Firestore"""
+    user_id = request_context().get('user_id', user_id)
     try:
-        execution_ref = await db.collection('function_executions').document()
+        execution_ref = db.collection('function_executions').document()  # ID is generated locally
         execution_data = {
             'execution_id': execution_ref.id,  # Generated by Firestore
             'function_name': function_name,
             'parameters': parameters,
-            'timestamp': datetime.now(),
+            'timestamp': datetime.datetime.now(),
             'result': result,
             'user_id': user_id,
-             'code': code,
+            'code': code,
             'status': status
         }
-        await execution_ref.set(execution_data)  # Added await here
+        # Enqueueing never blocks, only a full buffer falls back to an awaited write
+        if not execution_writer.enqueue(execution_ref, execution_data):
+            await async_data.set_document('function_executions', execution_ref.id, execution_data)
         return execution_ref.id
     except Exception as e:
         print(f"Error saving function execution: {str(e)}")
@@ -1343,6 +2630,159 @@ save_function_execution_tool = StructuredTool.from_function(
 )
 
 
+class FindAndRunInput(BaseModel):
+    user_id: str
+    query: Optional[str] = Field(default=None, description="Name or description of the function to run")
+    function_id: Optional[str] = Field(default=None, description="ID of the function to run, if known")
+    args: List[Any] = Field(default_factory=list, description="Positional arguments, as JSON values")
+    kwargs: Dict[str, Any] = Field(default_factory=dict, description="Keyword arguments, as JSON values")
+
+
+def find_and_run(user_id: str, query: Optional[str] = None, function_id: Optional[str] = None,
+                 args: Optional[List[Any]] = None, kwargs: Optional[Dict[str, Any]] = None) -> Dict:
+    """
+    Find a function in the user's library, run it with the given arguments and
+    record the execution, all in one tool call
+    
+    Args:
+        user_id: The ID of the user whose function to run
+        query: Name or description of the function, used when function_id is not given
+        function_id: The ID of the function
+        args: Positional arguments
+        kwargs: Keyword arguments
+        
+    Returns:
+        Dict with the call, its result and status and the execution ID, or an
+        error with the candidates or signature needed to ask the user
+    """
+    user_id = request_context().get('user_id', user_id)
+    args, kwargs = args or [], kwargs or {}
+    try:
+        functions = get_cached_user_library(user_id)
+        if function_id:
+            function = find_library_function(functions, function_id)
+        elif query:
+            function = match_function_name(query, functions)
+            if function is None:
+                # Same gate as the /chat/ fast path: only a clear best match is run
+                results = search_vector_store(user_id, query, limit=3).get('results', [])
+                candidates = [
+                    {"function_id": result['function_id'], "function_name": result['function_name']}
+                    for result in results
+                ]
+                if not candidates:
+                    return {"success": False, "error": f"No function matches {query}"}
+                if is_confident_match(results):
+                    function = find_library_function(functions, candidates[0]['function_id'])
+                if function is None:
+                    return {
+                        "success": False,
+                        "error": f"No confident match for {query}, ask the user which function they mean",
+                        "candidates": candidates
+                    }
+        else:
+            return {"success": False, "error": "Either query or function_id is required"}
+        if function is None:
+            return {"success": False, "error": f"Function {function_id} not found"}
+        
+        definition = find_function_definition(function.get('code') or '', function.get('name'))
+        try:
+            bind_arguments(definition, args, kwargs)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "function_name": function.get('name'),
+                "signature": format_signature(definition)
+            }
+        
+        result = run_function_call(
+            user_id,
+            function,
+            format_call(definition.name, args, kwargs),
+            {"args": args, "kwargs": kwargs},
+            session=request_context().get('repl_session')
+        )
+        return {"success": result['status'] == 'success', **result}
+    except Exception as e:
+        print(f"Error in find_and_run: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+async def Afind_and_run(**kwargs) -> Dict:
+    """Async version of find_and_run, executed on a worker thread"""
+    # to_thread copies the context, so request_context() still sees the run's config
+    return await asyncio.to_thread(find_and_run, **kwargs)
+
+
+find_and_run_tool = StructuredTool.from_function(
+    name="find_and_run",
+    description=(
+        "Find a function in the user's library by name, description or ID, run it with the "
+        "given arguments and record the execution, in one step. Use this whenever the user "
+        "wants a function executed."
+    ),
+    func=find_and_run,
+    args_schema=FindAndRunInput,
+    coroutine=Afind_and_run
+)
+
+
+# The agent is built once per process and shared by all requests, per-request
+# state is passed through the invocation config (see agent_config)
+python_repl_tool = PythonREPLTool()
+AGENT_TOOLS = [
+    find_and_run_tool,
+    search_vector_store_tool,
+    get_user_functions_firestore_tool,
+    python_repl_tool,
+    save_function_execution_tool,
+]
+agent_executor = AgentExecutor(
+    agent=create_tool_calling_agent(llm=llm, tools=AGENT_TOOLS, prompt=CHAT_PROMPT),
+    tools=AGENT_TOOLS,
+    # Shared by concurrent turns, its step logs would interleave on stdout
+    verbose=False,
+)
+
+
+def _invoke_agent(inputs: Dict, config: RunnableConfig) -> Dict:
+    token = _agent_request.set(config.get('configurable', {}))
+    try:
+        return agent_executor.invoke(inputs, config)
+    finally:
+        _agent_request.reset(token)
+
+
+async def _ainvoke_agent(inputs: Dict, config: RunnableConfig) -> Dict:
+    token = _agent_request.set(config.get('configurable', {}))
+    try:
+        return await agent_executor.ainvoke(inputs, config)
+    finally:
+        _agent_request.reset(token)
+
+
+# AgentExecutor does not hand its config to the tools it calls, so it runs
+# inside a RunnableLambda that publishes the config for request_context().
+# Tool calls, their tasks and worker threads inherit the context variable on
+# every Python version, unlike langchain's own config context before 3.11.
+chat_agent = RunnableLambda(_invoke_agent, afunc=_ainvoke_agent, name="chat_agent")
+
+
+def agent_config(user_id: str) -> RunnableConfig:
+    """Invocation config of one agent run for user_id, with a fresh REPL session"""
+    return {
+        'configurable': {
+            'user_id': user_id,
+            'repl_session': python_repl_tool.new_session(),
+        }
+    }
+
+
+
+# Fields returned by get_execution_history?view=summary
+EXECUTION_SUMMARY_FIELDS = ['execution_id', 'function_name', 'parameters', 'timestamp', 'status', 'user_id']
+
      
 @csrf_exempt
 @require_http_methods(["GET"])
@@ -1351,26 +2791,105 @@ def get_execution_history(request):
     if not id_token:
         return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
-    decoded_token = verify_firebase_token(id_token)
+    decoded_token = verify_auth_token(id_token)
     if not decoded_token:
         return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
     
     user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
     print(f"Getting execution history for {user_id}")
     
+    # Pagination is opt-in so existing clients keep getting the full history
+    paginate = 'page_size' in request.GET or 'cursor' in request.GET
+    summary = request.GET.get('view') == 'summary'
     try:
-        executions_ref = db.collection('function_executions').filter(
-            'user_id', '==', user_id
-        )
+        page_size = parse_page_size(request.GET.get('page_size'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        executions_ref = db.collection('function_executions').where('user_id', '==', user_id)
+        if request.GET.get('function_name'):
+            executions_ref = executions_ref.where('function_name', '==', request.GET['function_name'])
+        if request.GET.get('status'):
+            executions_ref = executions_ref.where('status', '==', request.GET['status'])
+        if summary:
+            # Leave out the heavy code and result fields, see get_execution_detail
+            executions_ref = executions_ref.select(EXECUTION_SUMMARY_FIELDS)
+        
+        if paginate:
+            docs, next_cursor = paginate_query(
+                executions_ref,
+                db.collection('function_executions'),
+                'timestamp',
+                page_size,
+                cursor=request.GET.get('cursor')
+            )
+        else:
+            # Unordered like before pagination, ordering by timestamp needs a
+            # composite index that only paginated requests rely on
+            docs, next_cursor = executions_ref.stream(), None
         
-        docs = executions_ref.stream()
         executions = []
         for doc in docs:
             data = doc.to_dict()
             data['timestamp'] = data['timestamp'].isoformat()
             executions.append(data)
-            
-        return JsonResponse({'success': True, 'executions': executions})
+        
+        response = {'success': True, 'executions': executions}
+        if paginate:
+            response['nextCursor'] = next_cursor
+        return JsonResponse(response)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+def get_execution_data(execution_id):
+    """
+    Return an execution record, None if it does not exist.
+    
+    Records returned by save_function_execution may still be buffered in the
+    write-behind queue, so it is checked before Firestore.
+    """
+    execution_ref = db.collection('function_executions').document(execution_id)
+    data = execution_writer.pending(execution_ref)
+    if data is not None:
+        return data
+    execution_doc = execution_ref.get()
+    return execution_doc.to_dict() if execution_doc.exists else None
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def get_execution_detail(request):
+    """
+    Fetch a single execution including its code and result
+    """
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    decoded_token = verify_auth_token(id_token)
+    if not decoded_token:
+        return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    execution_id = request.GET.get('execution_id')
+    if not execution_id:
+        return JsonResponse({'success': False, 'error': 'Execution ID is required'}, status=400)
+    
+    try:
+        data = get_execution_data(execution_id)
+        if data is None:
+            return JsonResponse({'success': False, 'error': 'Execution not found'}, status=404)
+        
+        if data.get('user_id') != user_id:
+            return JsonResponse({'success': False, 'error': 'Unauthorized to view this execution'}, status=403)
+        
+        data['timestamp'] = data['timestamp'].isoformat()
+        return JsonResponse({'success': True, 'execution': data})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
@@ -1400,15 +2919,13 @@ def repeat_execution(request):
 
         # Fetch execution document
         print("Fetching execution document")  # Debug log
-        execution_doc = db.collection('function_executions').document(execution_id).get()
-        if not execution_doc.exists:
+        execution_data = get_execution_data(execution_id)
+        if execution_data is None:
             return JsonResponse({
                 'success': False,
                 'error': 'Execution not found'
             }, status=404)
         
-        # Get execution data
-        execution_data = execution_doc.to_dict()
         print(f"Retrieved execution data: {execution_data}")  # Debug log
         
         if not execution_data.get('code'):
@@ -1494,7 +3011,7 @@ def get_response(request):
             return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
     
         try:
-            decoded_token = verify_firebase_token(id_token)
+            decoded_token = verify_auth_token(id_token)
             if not decoded_token:
                 return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
         except Exception as auth_error:
@@ -1505,48 +3022,9 @@ def get_response(request):
         print(f"User ID: {user_id}")
 
         try:
-            # Get or create chat history for this user
-            chat_history = get_or_create_chat_history(user_id)
-            print("Chat history retrieved")
-            
-            # Add user message to history
-            chat_history.add_user_message(user_message)
-            print("User message added to history")
-
-            # Create agent with tools
-            tools = [search_vector_store_tool, get_user_functions_firestore_tool, PythonREPLTool(), save_function_execution_tool]
-            print("Tools initialized")
-            
-            agent = create_tool_calling_agent(llm=llm, tools=tools, prompt=CHAT_PROMPT)
-            print("Agent created")
-            
-            agent_executor = AgentExecutor(
-                agent=agent,
-                tools=tools,
-                verbose=True,
-            )
-            print("Agent executor created")
-            
-            user_message = user_message.strip() + "\nuser_id: {}".format(user_id)
-            
-            # Get response from agent
             print("Invoking agent")
-            response = agent_executor.invoke({
-                "input": user_message,
-                "chat_history": chat_history.messages  
-            })
-            print(f"Agent response received: {response}")
-            
-            formatted_response = response_formatter_tool._run(response['output'])
+            formatted_response = run_sync(run_agent_turn(user_id, user_message))
             print(f"Response formatted: {formatted_response}")
-            
-            # Add AI response to history
-            chat_history.add_ai_message(formatted_response)
-            print("AI response added to history")
-            
-            # Clean old conversations if needed
-            if len(conversation_histories) > 1000:
-                clean_old_conversations()
 
             return JsonResponse({
                 'status': 'success',
@@ -1578,6 +3056,213 @@ def get_response(request):
             'traceback': traceback.format_exc()
         }, status=500)
 
+@async_api_view(["POST"])
+async def Aget_response(request):
+    """
+    Async version of get_response, served when ASYNC_VIEWS is enabled. The
+    agent runs with ainvoke, so a turn waiting on the LLM or a tool holds no
+    worker thread.
+    """
+    try:
+        data = json.loads(request.body)
+        user_message = data.get('message')
+        id_token = request.headers.get('Authorization')
+        
+        if not id_token:
+            return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+        try:
+            decoded_token = await Averify_auth_token(id_token)
+            if not decoded_token:
+                return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+        except Exception as auth_error:
+            print(f"Authentication error: {str(auth_error)}")
+            return JsonResponse({'success': False, 'error': f'Authentication error: {str(auth_error)}'}, status=401)
+    
+        user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+
+        try:
+            # The agent's OpenAI clients are bound to the shared loop, not the server's
+            formatted_response = await run_async(run_agent_turn(user_id, user_message))
+
+            return JsonResponse({
+                'status': 'success',
+                'response': formatted_response,
+                'user_id': user_id
+            })
+
+        except Exception as processing_error:
+            print(f"Error processing message: {str(processing_error)}")
+            print(f"Traceback: {traceback.format_exc()}")
+            return JsonResponse({
+                'status': 'error',
+                'message': f'Error processing message: {str(processing_error)}',
+                'traceback': traceback.format_exc()
+            }, status=500)
+
+    except json.JSONDecodeError as json_error:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Invalid JSON: {str(json_error)}'
+        }, status=400)
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Unexpected error: {str(e)}',
+            'traceback': traceback.format_exc()
+        }, status=500)
+
+
+async def run_agent_turn(user_id, user_message):
+    """
+    Answer a message with the shared agent, recording the turn in the chat
+    history. Runs on the shared event loop: sync views wait for it with
+    run_sync, async views await it with run_async.
+    """
+    chat_history = get_or_create_chat_history(user_id)
+    chat_history.add_user_message(user_message)
+    
+    response = await chat_agent.ainvoke({
+        "input": user_message.strip() + "\nuser_id: {}".format(user_id),
+        "chat_history": chat_history.messages
+    }, config=agent_config(user_id))
+    
+    formatted_response = response_formatter_tool._run(response['output'])
+    chat_history.add_ai_message(formatted_response)
+    
+    # Clean old conversations if needed
+    if len(conversation_histories) > 1000:
+        clean_old_conversations()
+    return formatted_response
+
+
+def sse_event(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def agent_event_stream(user_id, chat_history, user_message):
+    """
+    Run the shared agent with astream_events and yield SSE messages for model
+    tokens, tool calls and the final formatted answer
+    """
+    inputs = {
+        "input": user_message.strip() + "\nuser_id: {}".format(user_id),
+        "chat_history": chat_history.messages
+    }
+    try:
+        async for event in chat_agent.astream_events(inputs, config=agent_config(user_id), version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if content:
+                    yield sse_event("token", {"content": content})
+            elif kind == "on_tool_start":
+                yield sse_event("tool_start", {"tool": event["name"], "input": event["data"].get("input")})
+            elif kind == "on_tool_end":
+                yield sse_event("tool_end", {"tool": event["name"], "output": str(event["data"].get("output"))})
+            elif kind == "on_chain_end" and event["name"] == "chat_agent":
+                formatted_response = response_formatter_tool._run(event["data"]["output"]["output"])
+                chat_history.add_ai_message(formatted_response)
+                yield sse_event("final", {"response": formatted_response, "user_id": user_id})
+    except Exception as e:
+        print(f"Error streaming response: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        yield sse_event("error", {"message": f"Error processing message: {str(e)}"})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def stream_response(request):
+    """
+    Streaming variant of get_response. Sends Server-Sent Events as the agent
+    runs: token, tool_start, tool_end, then final with the formatted answer,
+    or error.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as json_error:
+        return JsonResponse({'status': 'error', 'message': f'Invalid JSON: {str(json_error)}'}, status=400)
+    
+    user_message = data.get('message')
+    if not user_message:
+        return JsonResponse({'status': 'error', 'message': 'Message is required'}, status=400)
+    
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    try:
+        decoded_token = verify_auth_token(id_token)
+        if not decoded_token:
+            return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    except Exception as auth_error:
+        print(f"Authentication error: {str(auth_error)}")
+        return JsonResponse({'success': False, 'error': f'Authentication error: {str(auth_error)}'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    chat_history = get_or_create_chat_history(user_id)
+    chat_history.add_user_message(user_message)
+    if len(conversation_histories) > 1000:
+        clean_old_conversations()
+    
+    # WSGI iterates a sync generator, the agent's events are produced on the shared event loop
+    response = StreamingHttpResponse(
+        iterate_sync(agent_event_stream(user_id, chat_history, user_message)),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+
+@async_api_view(["POST"])
+async def Astream_response(request):
+    """
+    Async version of stream_response, served when ASYNC_VIEWS is enabled.
+    The response iterates the agent's events asynchronously, so a stream
+    never blocks the server's event loop while it waits for the next token.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as json_error:
+        return JsonResponse({'status': 'error', 'message': f'Invalid JSON: {str(json_error)}'}, status=400)
+    
+    user_message = data.get('message')
+    if not user_message:
+        return JsonResponse({'status': 'error', 'message': 'Message is required'}, status=400)
+    
+    id_token = request.headers.get('Authorization')
+    if not id_token:
+        return JsonResponse({'success': False, 'error': 'No token provided'}, status=401)
+    
+    try:
+        decoded_token = await Averify_auth_token(id_token)
+        if not decoded_token:
+            return JsonResponse({'success': False, 'error': 'Invalid token'}, status=401)
+    except Exception as auth_error:
+        print(f"Authentication error: {str(auth_error)}")
+        return JsonResponse({'success': False, 'error': f'Authentication error: {str(auth_error)}'}, status=401)
+    
+    user_id = hashlib.sha256(decoded_token['email'].encode()).hexdigest()
+    
+    chat_history = get_or_create_chat_history(user_id)
+    chat_history.add_user_message(user_message)
+    if len(conversation_histories) > 1000:
+        clean_old_conversations()
+    
+    # Events are produced on the shared loop, where the agent's clients live
+    response = StreamingHttpResponse(
+        iterate_async(agent_event_stream(user_id, chat_history, user_message)),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+
 def clean_old_conversations():
     """Remove old conversation histories to prevent memory issues"""
     try:
@@ -0,0 +1,159 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE', '10000'))
+# Firestore batched writes are limited to 500 operations
+WRITE_BEHIND_BATCH_SIZE = min(int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200')), 500)
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.5'))
+WRITE_BEHIND_MAX_RETRIES = 5
+WRITE_BEHIND_BACKOFF = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Buffers Firestore document writes and commits them from a background thread.
+
+    Callers pre-generate the document reference (Firestore IDs are created
+    client side), enqueue the data and return immediately. The worker drains
+    the queue in batched writes, retrying failed batches with exponential
+    backoff. The queue is bounded: enqueue returns False when it is full so the
+    caller can fall back to a synchronous write instead of dropping data.
+
+    Until its batch is committed a buffered document is only in this queue,
+    readers of a document that may have just been written look it up with
+    pending() first.
+    """
+
+    def __init__(self, client, max_queue=WRITE_BEHIND_MAX_QUEUE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, max_retries=WRITE_BEHIND_MAX_RETRIES,
+                 backoff=WRITE_BEHIND_BACKOFF):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'failed': 0,
+            'rejected': 0,
+            'batches': 0,
+            'retries': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+        }
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, doc_ref, data):
+        """
+        Schedule doc_ref.set(data).
+
+        Returns:
+            True if the write was buffered, False if the queue is full
+        """
+        self._ensure_worker()
+        with self._lock:
+            try:
+                self._queue.put_nowait((doc_ref, data))
+            except queue.Full:
+                self._metrics['rejected'] += 1
+                return False
+            self._pending[doc_ref.path] = data
+        self._metrics['enqueued'] += 1
+        return True
+
+    def pending(self, doc_ref):
+        """Return a copy of the data buffered for doc_ref, or None if it is not waiting to be written"""
+        with self._lock:
+            data = self._pending.get(doc_ref.path)
+        return dict(data) if data is not None else None
+
+    def _run(self):
+        while True:
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(items)
+            finally:
+                with self._lock:
+                    for doc_ref, data in items:
+                        if self._pending.get(doc_ref.path) is data:
+                            del self._pending[doc_ref.path]
+                for _ in items:
+                    self._queue.task_done()
+
+    def _write_batch(self, items):
+        started = time.monotonic()
+        error = None
+        for attempt in range(self.max_retries):
+            try:
+                batch = self.client.batch()
+                for doc_ref, data in items:
+                    batch.set(doc_ref, data)
+                batch.commit()
+                self._metrics['written'] += len(items)
+                break
+            except Exception as e:
+                error = e
+                print(f"Error writing batch of {len(items)} documents (attempt {attempt + 1}): {str(e)}")
+                if attempt + 1 < self.max_retries:
+                    self._metrics['retries'] += 1
+                    time.sleep(self.backoff * 2 ** attempt)
+        else:
+            self._metrics['failed'] += len(items)
+            logger.error(
+                "Dropped batch of %d documents after %d attempts: %s (first: %s)",
+                len(items), self.max_retries, error, items[0][0].path
+            )
+
+        elapsed = time.monotonic() - started
+        self._metrics['batches'] += 1
+        self._metrics['last_flush_seconds'] = elapsed
+        self._metrics['max_flush_seconds'] = max(self._metrics['max_flush_seconds'], elapsed)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every buffered write has been committed (or given up on).
+
+        Returns:
+            True if the queue drained within timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if self._thread is None or not self._thread.is_alive():
+                self._ensure_worker()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        """Return queue depth, write counters and flush latency"""
+        return {'queue_depth': self._queue.qsize(), **self._metrics}
+
+    def register_shutdown_flush(self, timeout=10):
+        atexit.register(self.flush, timeout)
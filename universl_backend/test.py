@@ -1,28 +1,9 @@
+from core.qdrant_setup import ensure_qdrant_collection
+
 def init_qdrant_collection():
-    try:
-        collections = qdrant_client.get_collections().collections
-        collection_names = [collection.name for collection in collections]
-        
-        if "function_descriptions" not in collection_names:
-            qdrant_client.create_collection(
-                collection_name="function_descriptions",
-                vectors_config={
-                    "size": 768,  
-                    "distance": "Cosine"
-                }
-            )
-            
-            qdrant_client.create_payload_index(
-                collection_name="function_descriptions",
-                field_name="userId",
-                field_schema="keyword"
-            )
-            
-            
-        return True
-    except Exception as e:
-        print(f"Error initializing Qdrant collection: {str(e)}")
-        return False
+    # Shares the bootstrap (and its schema check) with core.views
+    ensure_qdrant_collection(qdrant_client)
+    return True
 
 def find_existing_function(user_id, function_name):
     """
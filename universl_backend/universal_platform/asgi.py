@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'universal_platform.settings')
+# Under ASGI the async views run on the server's event loop
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
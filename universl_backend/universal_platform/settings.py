@@ -152,3 +152,6 @@ else:
 # Add these lines to disable Django's auth system
 AUTH_USER_MODEL = None
 AUTHENTICATION_BACKENDS = []
+
+# Route the chat and library endpoints to their async views, asgi.py turns this on
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')